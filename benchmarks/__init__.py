@@ -0,0 +1,116 @@
+"""
+Benchmarks for library hot paths: message codec, notification dispatch, request round trips and per-hub resources.
+They run against emulated hubs, so no hardware is needed. Run from repository root::
+
+    python -m benchmarks --save baseline.json
+    python -m benchmarks --compare baseline.json
+
+Results are saved as JSON of this shape, to compare runs made on different commits::
+
+    {"meta": {"commit": ..., "python": ..., "platform": ..., "time": ...},
+     "results": {"<name>": {"value": 123.4, "unit": "msg/s", "better": "higher"}}}
+"""
+import json
+import platform
+import subprocess
+import time
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """Register function that takes `duration` seconds budget and returns dict of results"""
+    BENCHMARKS.append(func)
+    return func
+
+
+def result(value, unit, better="higher"):
+    return {"value": value, "unit": unit, "better": better}
+
+
+def throughput(func, duration):
+    """Call `func` repeatedly for about `duration` seconds, return calls per second"""
+    calls = 0
+    batch = 1
+    start = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            func()
+        calls += batch
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return calls / elapsed
+        batch = min(batch * 2, 10000)
+
+
+def percentiles(samples, unit="us", scale=1000000.0):
+    """Exact percentiles of duration samples given in seconds"""
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def _perc(perc):
+        return samples[min(len(samples) - 1, int(len(samples) * perc / 100.0))] * scale
+
+    return {
+        "p50": result(_perc(50), unit, "lower"),
+        "p90": result(_perc(90), unit, "lower"),
+        "p99": result(_perc(99), unit, "lower"),
+    }
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(duration=0.5, name_filter=None):
+    """
+    :param duration: time budget for each measurement, in seconds
+    :param name_filter: run only benchmarks having this substring in the name
+    """
+    results = {}
+    for func in BENCHMARKS:
+        if name_filter and name_filter not in func.__name__:
+            continue
+        for name, value in func(duration).items():
+            results["%s.%s" % (func.__name__, name)] = value
+
+    return {
+        "meta": {
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.time(),
+        },
+        "results": results,
+    }
+
+
+def save(report, path):
+    with open(path, "w") as fhd:
+        json.dump(report, fhd, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as fhd:
+        return json.load(fhd)
+
+
+def compare(baseline, report, threshold=0.2):
+    """
+    :param threshold: relative change in worse direction that counts as regression
+    :return: list of tuples (name, baseline value, new value, relative change, is regression)
+    """
+    rows = []
+    for name, new in sorted(report["results"].items()):
+        old = baseline["results"].get(name)
+        if not old or not old["value"]:
+            continue
+
+        change = (new["value"] - old["value"]) / float(old["value"])
+        worse = -change if new["better"] == "higher" else change
+        rows.append((name, old["value"], new["value"], change, worse > threshold))
+    return rows
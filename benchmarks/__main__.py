@@ -0,0 +1,40 @@
+import argparse
+import logging
+import sys
+
+import benchmarks
+import benchmarks.cases  # registers benchmarks
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Run pylgbst benchmarks")
+    parser.add_argument("--duration", type=float, default=0.5, help="seconds per measurement")
+    parser.add_argument("--filter", help="run only benchmarks with this substring in the name")
+    parser.add_argument("--save", metavar="FILE", help="save results as JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare results against saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative change in worse direction reported as regression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = benchmarks.run(args.duration, args.filter)
+
+    for name, res in sorted(report["results"].items()):
+        print("%-50s %14.2f %s" % (name, res["value"], res["unit"]))
+
+    if args.save:
+        benchmarks.save(report, args.save)
+
+    if args.compare:
+        baseline = benchmarks.load(args.compare)
+        print("\nCompared to %s (commit %s):" % (args.compare, baseline["meta"].get("commit")))
+        regressions = 0
+        for name, old, new, change, regressed in benchmarks.compare(baseline, report, args.threshold):
+            regressions += regressed
+            print("%-50s %14.2f -> %14.2f %+7.1f%%%s" % (name, old, new, change * 100, " REGRESSION" if regressed else ""))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
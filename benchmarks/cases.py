@@ -0,0 +1,184 @@
+import gc
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from binascii import unhexlify
+
+from benchmarks import benchmark, result, throughput, percentiles
+from pylgbst.comms.cemulator import HubEmulator
+from pylgbst.hub import MoveHub
+from pylgbst.messages import MsgHubProperties, MsgHubAction, MsgHubAlert, MsgHubAttachedIO, MsgGenericError, \
+    MsgPortInfo, MsgPortModeInfo, MsgPortValueSingle, MsgPortValueCombined, MsgPortInputFmtSingle, \
+    MsgPortOutputFeedback, MsgPortInfoRequest, MsgPortModeInfoRequest, MsgPortInputFmtSetupSingle, \
+    MsgVirtualPortSetup, MsgPortOutput
+
+UPSTREAM_SAMPLES = {
+    MsgHubProperties: "0f00010106064c45474f204d6f7665",
+    MsgHubAction: "04000230",
+    MsgHubAlert: "0600030104 00",
+    MsgHubAttachedIO: "0f00040001270000000010000000 10",
+    MsgGenericError: "0500056105",
+    MsgPortInfo: "0b004300010f040e000100",
+    MsgPortModeInfo: "110044000000504f574552000000000000",
+    MsgPortValueSingle: "0800450001020000",
+    MsgPortValueCombined: "0a004601000400000000",
+    MsgPortInputFmtSingle: "0a004700020100000001",
+    MsgPortOutputFeedback: "050082000a",
+}
+
+DOWNSTREAM_SAMPLES = {
+    MsgHubProperties: lambda: MsgHubProperties(MsgHubProperties.VOLTAGE_PERC, MsgHubProperties.UPD_REQUEST),
+    MsgHubAction: lambda: MsgHubAction(MsgHubAction.DISCONNECT),
+    MsgHubAlert: lambda: MsgHubAlert(MsgHubAlert.LOW_VOLTAGE, MsgHubAlert.UPD_REQUEST),
+    MsgPortInfoRequest: lambda: MsgPortInfoRequest(0x00, MsgPortInfoRequest.INFO_MODE_INFO),
+    MsgPortModeInfoRequest: lambda: MsgPortModeInfoRequest(0x00, 0x02, MsgPortModeInfoRequest.INFO_NAME),
+    MsgPortInputFmtSetupSingle: lambda: MsgPortInputFmtSetupSingle(0x00, 0x02, 1, True),
+    MsgVirtualPortSetup: lambda: MsgVirtualPortSetup(MsgVirtualPortSetup.CMD_CONNECT, (0x00, 0x01)),
+    MsgPortOutput: lambda: MsgPortOutput(0x00, 0x09, b"\xe8\x03\x64\x64\x7f\x03"),
+}
+
+_hub = None
+
+
+def _get_hub():
+    global _hub
+    if _hub is None:
+        _hub = MoveHub(HubEmulator())
+    return _hub
+
+
+@benchmark
+def decode(duration):
+    """Messages per second decoded, per upstream message class"""
+    hub = _get_hub()
+    results = {}
+    for cls, sample in UPSTREAM_SAMPLES.items():
+        data = unhexlify(sample.replace(" ", ""))
+        results[cls.__name__] = result(throughput(lambda: cls.decode(data), duration / 4), "msg/s")
+        results["lookup.%s" % cls.__name__] = result(throughput(lambda: hub._get_upstream_msg(data), duration / 4),
+                                                     "msg/s")
+    return results
+
+
+@benchmark
+def encode(duration):
+    """Messages per second created and encoded, per downstream message class"""
+    return {cls.__name__: result(throughput(lambda: factory().bytes(), duration / 4), "msg/s")
+            for cls, factory in DOWNSTREAM_SAMPLES.items()}
+
+
+@benchmark
+def dispatch(duration):
+    """Notifications per second passed through `Hub._notify` to peripheral queue, and delivery latency to callback"""
+    hub = _get_hub()
+    motor = hub.motor_external
+    delivered = threading.Event()
+    stamps = []
+
+    def _callback(angle):
+        stamps.append(time.perf_counter())
+        delivered.set()
+
+    motor.subscribe(_callback)
+    time.sleep(0.1)
+    data = unhexlify("0800450300000000")
+    try:
+        results = {"notify": result(throughput(lambda: hub._notify(0x0E, data), duration), "msg/s")}
+        time.sleep(0.2)  # let the queue drain
+
+        samples = []
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            delivered.clear()
+            start = time.perf_counter()
+            hub._notify(0x0E, data)
+            if not delivered.wait(1):
+                break
+            samples.append(stamps[-1] - start)
+
+        for name, value in percentiles(samples).items():
+            results["callback_latency.%s" % name] = value
+    finally:
+        motor.unsubscribe(_callback)
+    return results
+
+
+@benchmark
+def roundtrip(duration):
+    """Synchronous request to reply round trips through `Hub.send` against zero-latency emulator"""
+    hub = _get_hub()
+    samples = []
+
+    def _send():
+        start = time.perf_counter()
+        hub.send(MsgHubProperties(MsgHubProperties.VOLTAGE_PERC, MsgHubProperties.UPD_REQUEST))
+        samples.append(time.perf_counter() - start)
+
+    results = {"send": result(throughput(_send, duration), "req/s")}
+    for name, value in percentiles(samples).items():
+        results["send.%s" % name] = value
+    return results
+
+
+@benchmark
+def resources(duration):
+    """Memory and threads taken by each connected hub"""
+    count = 3
+    gc.collect()
+    threads_before = threading.active_count()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    hubs = [MoveHub(HubEmulator()) for _ in range(count)]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    threads = threading.active_count() - threads_before
+    for hub in hubs:
+        hub.connection.disconnect()
+
+    return {
+        "memory_per_hub": result(used / 1024.0 / count, "KiB", "lower"),
+        "threads_per_hub": result(threads / float(count), "threads", "lower"),
+    }
+
+
+def _import_time(statement, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", statement])
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+# modules not needed to talk to a hub, importing any of them from hot modules once made startup twice slower
+SLOW_MODULES = ("asyncio", "http.server", "json", "pylgbst.comms.debug", "pylgbst.control", "socketserver")
+
+
+def slow_imports(statement):
+    """
+    :return: names from `SLOW_MODULES` loaded by statement in fresh interpreter
+    """
+    out = subprocess.check_output([sys.executable, "-c", statement + "\nimport sys\nprint('\\n'.join(sys.modules))"])
+    return sorted(set(out.decode().split()).intersection(SLOW_MODULES))
+
+
+@benchmark
+def startup(duration):
+    """
+    Import time of package and hub module in fresh interpreter, minus bare interpreter startup.
+    Fails when hub module pulls in any of `SLOW_MODULES`, timing alone is too noisy to catch that.
+    """
+    slow = slow_imports("import pylgbst.hub")
+    if slow:
+        raise AssertionError("Importing pylgbst.hub loads modules it doesn't need: %s" % ", ".join(slow))
+
+    runs = max(5, int(duration * 20))
+    bare = _import_time("pass", runs)
+    return {
+        "import_pylgbst": result((_import_time("import pylgbst", runs) - bare) * 1000.0, "ms", "lower"),
+        "import_hub": result((_import_time("import pylgbst.hub", runs) - bare) * 1000.0, "ms", "lower"),
+    }
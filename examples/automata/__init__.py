@@ -2,7 +2,8 @@ import logging
 import time
 from collections import Counter
 
-from pylgbst.hub import MoveHub, COLOR_NONE, COLOR_BLACK, COLORS, COLOR_CYAN, COLOR_BLUE, COLOR_RED, COLOR_YELLOW, \
+from pylgbst.hub import MoveHub
+from pylgbst.peripherals import COLOR_NONE, COLOR_BLACK, COLORS, COLOR_CYAN, COLOR_BLUE, COLOR_RED, COLOR_YELLOW, \
     COLOR_WHITE
 from pylgbst.peripherals import EncodedMotor
 
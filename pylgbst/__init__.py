@@ -1,40 +1,87 @@
+import importlib
 import logging
-import traceback
+import os
+import threading
 
-from pylgbst.comms import DebugServer, Connection
+from pylgbst.comms import Connection
+from pylgbst.utilities import JsonCache, queue
 
 log = logging.getLogger('pylgbst')
 
+# submodules available as attributes without explicit import, loaded on first access
+SUBMODULES = ("comms", "hub", "hubinfo", "hubSpecific", "messages", "metrics", "packets", "peripherals", "tracer",
+              "utilities")
 
-def get_connection_bluegiga(controller=None, hub_mac=None, hub_name=None):
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module("pylgbst." + name)
+    if name == "DebugServer":  # was imported here eagerly
+        from pylgbst.comms.debug import DebugServer
+
+        return DebugServer
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def _create_bluegiga(controller=None):
     del controller  # to prevent code analysis warning
     from pylgbst.comms.cpygatt import BlueGigaConnection
 
-    return BlueGigaConnection().connect(hub_mac, hub_name)
+    return BlueGigaConnection()
 
 
-def get_connection_gattool(controller='hci0', hub_mac=None, hub_name=None):
+def _create_gattool(controller='hci0'):
     from pylgbst.comms.cpygatt import GattoolConnection
 
-    return GattoolConnection(controller).connect(hub_mac, hub_name)
+    return GattoolConnection(controller)
 
 
-def get_connection_gatt(controller='hci0', hub_mac=None, hub_name=None):
+def _create_gatt(controller='hci0', **kwargs):
     from pylgbst.comms.cgatt import GattConnection
 
-    return GattConnection(controller).connect(hub_mac, hub_name)
+    return GattConnection(controller, **kwargs)
 
 
-def get_connection_gattlib(controller='hci0', hub_mac=None, hub_name=None):
+def _create_gattlib(controller='hci0'):
     from pylgbst.comms.cgattlib import GattLibConnection
 
-    return GattLibConnection(controller).connect(hub_mac, hub_name)
+    return GattLibConnection(controller)
 
 
-def get_connection_bluepy(controller='hci0', hub_mac=None, hub_name=None):
+def _create_bluepy(controller='hci0'):
     from pylgbst.comms.cbluepy import BluepyConnection
 
-    return BluepyConnection(controller).connect(hub_mac, hub_name)
+    return BluepyConnection(controller)
+
+
+def _create_bleak(controller=None, hub_mac=None, hub_name=None):
+    del controller  # to prevent code analysis warning
+    from pylgbst.comms.cbleak import BleakDriver
+
+    return BleakDriver(hub_mac, hub_name)
+
+
+def get_connection_bluegiga(controller=None, hub_mac=None, hub_name=None):
+    return _create_bluegiga(controller).connect(hub_mac, hub_name)
+
+
+def get_connection_gattool(controller='hci0', hub_mac=None, hub_name=None):
+    return _create_gattool(controller).connect(hub_mac, hub_name)
+
+
+def get_connection_gatt(controller='hci0', hub_mac=None, hub_name=None, **kwargs):
+    """
+    :param kwargs: passed to `GattConnection`, e.g. `timeout` in seconds to find and connect the hub
+    """
+    return _create_gatt(controller, **kwargs).connect(hub_mac, hub_name)
+
+
+def get_connection_gattlib(controller='hci0', hub_mac=None, hub_name=None):
+    return _create_gattlib(controller).connect(hub_mac, hub_name)
+
+
+def get_connection_bluepy(controller='hci0', hub_mac=None, hub_name=None):
+    return _create_bluepy(controller).connect(hub_mac, hub_name)
 
 
 def get_connection_bleak(controller='hci0', hub_mac=None, hub_name=None):
@@ -43,42 +90,141 @@ def get_connection_bleak(controller='hci0', hub_mac=None, hub_name=None):
 
     :param controller: Not used, kept for compatibility with others.
     :param hub_mac: Optional Lego HUB MAC to connect to.
-    :return: Driver object.
+    :return: Driver object, it connects when notifications get enabled.
     """
-    del controller  # to prevent code analysis warning
-    from pylgbst.comms.cbleak import BleakDriver
+    return _create_bleak(controller, hub_mac, hub_name)
 
-    return BleakDriver(hub_mac, hub_name)
 
+# name, library to probe, whether it needs local adapter, factory of not yet connected connection
+BACKENDS = [
+    ("bleak", "bleak", False, _create_bleak),
+    ("bluepy", "bluepy", True, _create_bluepy),
+    ("bluegiga", "pygatt", False, _create_bluegiga),
+    ("gatt", "gatt", True, _create_gatt),
+    ("gatttool", "pygatt", True, _create_gattool),
+    ("gattlib", "gattlib", True, _create_gattlib),
+]
 
-def get_connection_auto(controller='hci0', hub_mac=None, hub_name=None) -> Connection:
-    fns = [
-        get_connection_bleak,
-        get_connection_bluepy,
-        get_connection_bluegiga,
-        get_connection_gatt,
-        get_connection_gattool,
-        get_connection_gattlib,
-    ]
-
-    conn = None
-    for fn in fns:
+_backend_cache = JsonCache("backends.json")
+
+
+def _adapter_present(controller):
+    import platform
+
+    if platform.system() != "Linux" or not controller:
+        return True  # no cheap way to check, let the backend try
+    return os.path.exists(os.path.join("/sys/class/bluetooth", controller))
+
+
+def probe_backends(controller='hci0'):
+    """
+    Return names of backends that can possibly work here, checking without any scanning or importing:
+    backend library is installed and Bluetooth adapter is present.
+    """
+    import importlib.util
+
+    viable = []
+    for name, module, needs_adapter, _ in BACKENDS:
+        if importlib.util.find_spec(module) is None:
+            log.debug("Backend %s is not available, no '%s' library installed", name, module)
+        elif needs_adapter and not _adapter_present(controller):
+            log.debug("Backend %s is not available, no adapter %s found", name, controller)
+        else:
+            viable.append(name)
+    return viable
+
+
+def _race_backends(names, controller, hub_mac, hub_name):
+    """
+    Try backends concurrently, first one to connect wins. Losers are cancelled right away,
+    those that still manage to connect are disconnected.
+
+    :return: tuple of winner name and connection, (None, None) if all failed
+    """
+    factories = {name: fn for name, _, _, fn in BACKENDS}
+    results = queue.Queue()
+    lock = threading.Lock()
+    candidates = {}
+    winner = []
+
+    def _try(name):
         try:
-            logging.info("Trying %s", fn.__name__)
-            return fn(controller, hub_mac, hub_name)
-        except KeyboardInterrupt:
-            raise
+            log.info("Trying %s", name)
+            conn = factories[name](controller)
+            with lock:
+                candidates[name] = conn
+                if winner:
+                    conn.cancel()
+            conn.connect(hub_mac, hub_name)
         except BaseException:
-            logging.debug("Failed: %s", traceback.format_exc())
+            log.debug("Failed %s", name, exc_info=True)
+            results.put((name, None))
+            return
+
+        with lock:
+            if not winner:
+                winner.append(name)
+                for other, candidate in candidates.items():
+                    if other != name:
+                        candidate.cancel()
+                results.put((name, conn))
+                return
+
+        log.debug("Backend %s connected after %s won, disconnecting", name, winner[0])
+        try:
+            conn.disconnect()
+        except BaseException:
+            log.debug("Failed to disconnect %s", name, exc_info=True)
+        results.put((name, None))
+
+    for name in names:
+        thread = threading.Thread(target=_try, args=(name,))
+        thread.daemon = True
+        thread.name = "Backend probe %s" % name
+        thread.start()
+
+    for _ in names:
+        name, conn = results.get()
+        if conn is not None:
+            return name, conn
 
+    return None, None
+
+
+def get_connection_auto(controller='hci0', hub_mac=None, hub_name=None) -> Connection:
+    """
+    Detect working backend and connect with it.
+
+    Backends are probed without scanning first, then the viable ones are tried concurrently.
+    Winning backend is remembered per host and controller, and is tried alone next time.
+    """
+    import socket
+
+    cache_key = "%s:%s" % (socket.gethostname(), controller)
+    viable = probe_backends(controller)
+
+    cached = _backend_cache.get(cache_key)
+    if cached in viable:
+        name, conn = _race_backends([cached], controller, hub_mac, hub_name)
+        if conn is not None:
+            log.info("Succeeded with cached backend %s", name)
+            return conn
+
+        _backend_cache.delete(cache_key)
+        viable.remove(cached)
+
+    name, conn = _race_backends(viable, controller, hub_mac, hub_name)
     if conn is None:
         raise Exception("Failed to autodetect connection, make sure you have installed prerequisites")
 
-    logging.info("Succeeded with %s", conn.__class__.__name__)
+    _backend_cache.set(cache_key, name)
+    log.info("Succeeded with %s", conn.__class__.__name__)
     return conn
 
 
 def start_debug_server(iface="hci0", port=9090):
+    from pylgbst.comms.debug import DebugServer
+
     server = DebugServer(get_connection_auto(iface))
     try:
         server.start(port)
@@ -1,17 +1,11 @@
 """
 This package holds communication aspects
 """
-import binascii
-import json
 import logging
-import socket
-import traceback
+import time
 from abc import abstractmethod
-from binascii import unhexlify
-from threading import Thread
 
-from pylgbst.messages import MsgHubAction
-from pylgbst.utilities import str2hex
+from pylgbst.utilities import JsonCache
 
 log = logging.getLogger('comms')
 
@@ -23,10 +17,84 @@ ENABLE_NOTIFICATIONS_VALUE = b'\x01\x00'
 MOVE_HUB_HARDWARE_HANDLE = 0x0E
 
 
+class DiscoveryCache:
+    """
+    Remembers where hubs were found, so reconnect can go straight to the device instead of scanning.
+    Entries are keyed by hub MAC and hold address, address type, backend name and last seen time.
+    Name is not a key: several hubs can share one, so lookups by name alone always scan.
+    Entry is dropped when direct connect to it fails, or when it was not seen for `ttl` seconds.
+    """
+
+    def __init__(self, name="discovery.json", ttl=30 * 24 * 3600):
+        self.ttl = ttl
+        self.enabled = True
+        self._storage = JsonCache(name)
+
+    @staticmethod
+    def _key(hub_mac, hub_name):
+        del hub_name  # ambiguous, see class docstring
+        return "mac:%s" % hub_mac.lower() if hub_mac else None
+
+    def lookup(self, hub_mac=None, hub_name=None, backend=None):
+        """
+        :param backend: if given, only record made by the same backend is returned
+        :rtype: dict
+        """
+        key = self._key(hub_mac, hub_name)
+        if not self.enabled or not key:
+            return None
+
+        record = self._storage.get(key)
+        if not record:
+            return None
+
+        if time.time() - record.get("last_seen", 0) > self.ttl:
+            log.debug("Discovery cache entry has expired: %s", record)
+            self._storage.delete(key)
+            return None
+
+        if backend and record.get("backend") != backend:
+            return None
+
+        return record
+
+    def remember(self, hub_mac, hub_name, address, backend, address_type=None):
+        key = self._key(hub_mac, hub_name)
+        if not self.enabled or not key:
+            return
+
+        self._storage.set(key, {
+            "address": address,
+            "address_type": address_type,
+            "backend": backend,
+            "last_seen": time.time(),
+        })
+
+    def forget(self, hub_mac=None, hub_name=None):
+        key = self._key(hub_mac, hub_name)
+        if key:
+            self._storage.delete(key)
+
+
+discovery_cache = DiscoveryCache()
+
+
 class Connection:
+    cancelled = False
+
     def connect(self, hub_mac=None):
         pass
 
+    def cancel(self):
+        """
+        Stop `connect` running in another thread, it raises `ConnectionError` at the next scan round
+        """
+        self.cancelled = True
+
+    def _check_cancelled(self):
+        if self.cancelled:
+            raise ConnectionError("Connecting was cancelled")
+
     @abstractmethod
     def is_alive(self):
         pass
@@ -38,6 +106,13 @@ class Connection:
     def write(self, handle, data):
         pass
 
+    def write_without_response(self, handle, data):
+        """
+        Write that does not wait for BLE-level confirmation, for high-rate commands
+        that are confirmed by hub's protocol feedback anyway. Falls back to regular write for backends without it.
+        """
+        self.write(handle, data)
+
     @abstractmethod
     def set_notify_handler(self, handler):
         pass
@@ -45,6 +120,30 @@ class Connection:
     def enable_notifications(self):
         self.write(ENABLE_NOTIFICATIONS_HANDLE, ENABLE_NOTIFICATIONS_VALUE)
 
+    def _connect_cached(self, hub_mac, hub_name, backend, connect_fn):
+        """
+        Try connecting straight to the address remembered in discovery cache, skipping the scan.
+
+        :param connect_fn: callable accepting cache record, connects or raises
+        :return: True if connected, False if caller has to scan
+        """
+        record = discovery_cache.lookup(hub_mac, hub_name, backend)
+        if not record:
+            return False
+
+        log.info("Connecting to cached address %s", record["address"])
+        try:
+            connect_fn(record)
+        except KeyboardInterrupt:
+            raise
+        except BaseException:
+            log.info("Direct connect failed, falling back to scanning", exc_info=True)
+            discovery_cache.forget(hub_mac, hub_name)
+            return False
+
+        discovery_cache.remember(hub_mac, hub_name, record["address"], backend, record.get("address_type"))
+        return True
+
     def _is_device_matched(self, address, dev_name, hub_mac, find_name):
         assert hub_mac or find_name, 'You have to provide either hub_mac or hub_name in connection options'
         log.debug("Checking device: %s, MAC: %s", dev_name, address)
@@ -62,159 +161,8 @@ class Connection:
         return matched
 
 
-class DebugServer:
-    """
-    WARNING: deprecated class
-    Starts TCP server to be used with DebugServerConnection to speed-up development process
-    It holds BLE connection to Move Hub, so no need to re-start it every time
-    Usage: DebugServer(BLEConnection().connect()).start()
-
-    :type connection: BLEConnection
-    """
-
-    def __init__(self, connection):
-        self._running = False
-        self.sock = socket.socket()
-        self.connection = connection
-
-    def start(self, port=9090):
-        self.sock.bind(('', port))
-        self.sock.listen(1)
-
-        self._running = True
-        while self._running:
-            log.info("Accepting MoveHub debug connections at %s", port)
-            conn, addr = self.sock.accept()
-            if not self._running:
-                raise KeyboardInterrupt("Shutdown")
-            self.connection.set_notify_handler(lambda x, y: self._notify(conn, x, y))
-            try:
-                self._handle_conn(conn)
-            except KeyboardInterrupt:
-                raise
-            except BaseException:
-                log.error("Problem handling incoming connection: %s", traceback.format_exc())
-            finally:
-                self.connection.set_notify_handler(self._notify_dummy)
-                conn.close()
-
-    def __del__(self):
-        self.sock.close()
-
-    def _notify_dummy(self, handle, data):
-        log.debug("Dropped notification from handle %s: %s", handle, binascii.hexlify(data))
-        self._check_shutdown(data)
-
-    def _notify(self, conn, handle, data):
-        payload = {"type": "notification", "handle": handle, "data": str2hex(data)}
-        log.debug("Send notification: %s", payload)
-        try:
-            conn.send(json.dumps(payload) + "\n")
-        except KeyboardInterrupt:
-            raise
-        except BaseException:
-            log.error("Problem sending notification: %s", traceback.format_exc())
-
-        self._check_shutdown(data)
-
-    def _check_shutdown(self, data):
-        if data[5] == MsgHubAction.TYPE:
-            log.warning("Device shutdown")
-            self._running = False
-
-    def _handle_conn(self, conn):
-        """
-        :type conn: socket._socketobject
-        """
-        buf = ""
-        while True:
-            data = conn.recv(1024)
-            log.debug("Recv: %s", data.strip())
-            if not data:
-                break
-
-            buf += data
-
-            if "\n" in buf:
-                line = buf[:buf.index("\n")]
-                buf = buf[buf.index("\n") + 1:]
-
-                if line:
-                    log.debug("Cmd line: %s", line)
-                    try:
-                        self._handle_cmd(json.loads(line))
-                    except KeyboardInterrupt:
-                        raise
-                    except BaseException:
-                        log.error("Failed to handle cmd: %s", traceback.format_exc())
-
-    def _handle_cmd(self, cmd):
-        if cmd['type'] == 'write':
-            self.connection.write(cmd['handle'], unhexlify(cmd['data']))
-        else:
-            raise ValueError("Unhandled cmd: %s", cmd)
-
-
-class DebugServerConnection(Connection):
-    """
-    WARNING: deprecated class
-    Connection type to be used with DebugServer, replaces BLEConnection
-    """
-
-    def __init__(self, port=9090):
-        super().__init__()
-        self.notify_handler = None
-        self.buf = ""
-        self.sock = socket.socket()
-        self.sock.connect(('localhost', port))
-        self.incoming = []
-
-        self.reader = Thread(target=self._recv)
-        self.reader.setName("Debug connection reader")
-        self.reader.setDaemon(True)
-        self.reader.start()
-
-    def __del__(self):
-        self.sock.close()
-
-    def write(self, handle, data):
-        payload = {
-            "type": "write",
-            "handle": handle,
-            "data": str2hex(data)
-        }
-        self._send(payload)
-
-    def _send(self, payload):
-        log.debug("Sending to debug server: %s", payload)
-        self.sock.send(json.dumps(payload) + "\n")
-
-    def _recv(self):
-        while True:
-            data = self.sock.recv(1024)
-            log.debug("Recv from debug server: %s", data.strip())
-            if not data:
-                raise KeyboardInterrupt("Server has closed connection")
-
-            self.buf += data
-
-            while "\n" in self.buf:
-                line = self.buf[:self.buf.index("\n")]
-                self.buf = self.buf[self.buf.index("\n") + 1:]
-                if line:
-                    item = json.loads(line)
-                    if item['type'] == 'notification' and self.notify_handler:
-                        try:
-                            self.notify_handler(item['handle'], unhexlify(item['data']))
-                        except BaseException:
-                            log.error("Failed to notify handler: %s", traceback.format_exc())
-                    elif item['type'] == 'response':
-                        self.incoming.append(item)
-                    else:
-                        log.warning("Dropped inbound: %s", item)
-
-    def set_notify_handler(self, handler):
-        self.notify_handler = handler
-
-    def is_alive(self):
-        return self.reader.isAlive()
+def __getattr__(name):
+    if name in ("DebugServer", "DebugServerConnection"):  # deprecated, loaded only when asked for
+        from pylgbst.comms import debug
+        return getattr(debug, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -1,36 +1,99 @@
 import asyncio
+import concurrent.futures
 import logging
 import platform
 import queue
 import threading
-import time
+import traceback
 
 import bleak
 
-from pylgbst.comms import Connection, MOVE_HUB_HW_UUID_CHAR, MOVE_HUB_HW_UUID_SERV
+from pylgbst import packets
+from pylgbst.comms import Connection, MOVE_HUB_HARDWARE_HANDLE, MOVE_HUB_HW_UUID_CHAR, MOVE_HUB_HW_UUID_SERV, \
+    discovery_cache
+from pylgbst.tracer import tracer
 
 log = logging.getLogger('comms-bleak')
 
+DIRECT_CONNECT_TIMEOUT = 10
+
+
+def _scanner_kwargs():
+    # For MacOS 12+ the service_uuids kwarg is required for scanning
+    if "Darwin" == platform.system() and int(platform.mac_ver()[0].split(".")[0]) >= 12:
+        return {"service_uuids": [MOVE_HUB_HW_UUID_SERV]}
+    return {}
+
 
 class BleakDriver(Connection):
     """Driver that provides interface between API and Bleak."""
 
-    def __init__(self, hub_mac=None, hub_name=None):
+    def __init__(self, hub_mac=None, hub_name=None, session=None):
         """
         Initialize new object of Bleak Driver class.
 
         :param hub_mac: Optional Lego HUB MAC to connect to.
+        :param session: Optional BleakSession to share event loop and scanner with other hubs.
         """
         self.hub_mac = hub_mac
         self.hub_name = hub_name
+        self._session = session
+        self._bleak = None
         self._handler = None
         self._abort = False
         self._connection_thread = None
+        self._connection_future = None
+        self._connect_future = None  # set while `connect` runs, to cancel it
         self._processing_thread = None
+        self._loop = None
 
-        # Queues to handle request / responses. Acts as a buffer between API and async BLE driver
+        # Queues to handle request / responses. Acts as a buffer between API and async BLE driver.
+        # Requests go into asyncio queue that lives in BLE thread's loop, it's created there
         self.resp_queue = queue.Queue()
-        self.req_queue = queue.Queue()
+        self.req_queue = None
+
+    def connect(self, hub_mac=None, hub_name=None):
+        """
+        Find and connect the hub right away, instead of doing it in `enable_notifications`.
+
+        :raises ConnectionError: when connecting fails or is cancelled
+        :return: self
+        """
+        if hub_mac or hub_name:
+            self.hub_mac, self.hub_name = hub_mac, hub_name
+        self._check_cancelled()
+
+        if self._session:
+            self._connect_future = asyncio.run_coroutine_threadsafe(self._connect(), self._session.loop)
+            try:
+                self._connect_future.result()
+            except (asyncio.CancelledError, concurrent.futures.CancelledError):
+                raise ConnectionError("Connecting was cancelled")
+            return self
+
+        self._loop = asyncio.new_event_loop()
+        self._connect_future = self._loop.create_task(self._connect())
+        if self.cancelled:  # cancelled before the task to cancel existed
+            self._connect_future.cancel()
+        try:
+            self._loop.run_until_complete(self._connect_future)
+        except asyncio.CancelledError:
+            self._loop.close()
+            raise ConnectionError("Connecting was cancelled")
+        except BaseException:
+            self._loop.close()
+            raise
+        return self
+
+    def cancel(self):
+        Connection.cancel(self)
+        future = self._connect_future
+        if future is None or future.done():
+            return
+        if isinstance(future, asyncio.Task):
+            self._loop.call_soon_threadsafe(future.cancel)
+        else:
+            future.cancel()
 
     def set_notify_handler(self, handler):
         """
@@ -48,31 +111,63 @@ class BleakDriver(Connection):
         We cannot do this earlier, because API need to fist set notification handler.
         :return: None
         """
-        self._connection_thread = threading.Thread(target=lambda: asyncio.run(self._bleak_thread()))
-        self._connection_thread.daemon = True
-        self._connection_thread.start()
+        if self._session:
+            self._loop = self._session.loop
+            self._connection_future = asyncio.run_coroutine_threadsafe(self._bleak_thread(), self._loop)
+        else:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+            self._connection_thread = threading.Thread(target=self._run_loop)
+            self._connection_thread.daemon = True
+            self._connection_thread.start()
 
         self._processing_thread = threading.Thread(target=self._processing)
         self._processing_thread.daemon = True
         self._processing_thread.start()
 
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._get_req_queue()
+        try:
+            self._loop.run_until_complete(self._bleak_thread())
+        finally:
+            self._loop.close()
+
+    def _get_req_queue(self):
+        """Called inside BLE loop only, so the queue belongs to it"""
+        if self.req_queue is None:
+            self.req_queue = asyncio.Queue()
+        return self.req_queue
+
+    def _enqueue_request(self, item):
+        """Called inside BLE thread's loop, see `write`"""
+        self._get_req_queue().put_nowait(item)
+
+    async def _connect(self):
+        self._bleak = BleakConnection(self._session)
+        await self._bleak.connect(self.hub_mac, self.hub_name, **_scanner_kwargs())
+
     async def _bleak_thread(self):
-        bleak = BleakConnection()
-        # For MacOS 12+ the service_uuids kwarg is required for scanning
-        kwargs = {}
-        if "Darwin" == platform.system() and int(platform.mac_ver()[0].split(".")[0]) >= 12:
-            kwargs = {"service_uuids": [MOVE_HUB_HW_UUID_SERV]}
-        await bleak.connect(self.hub_mac, self.hub_name, **kwargs)
+        if not self._bleak:
+            await self._connect()
+        bleak = self._bleak
         await bleak.set_notify_handler((self._safe_handler, self.resp_queue))
         # After connecting, need to send any data or hub will drop the connection,
         # below command is Advertising name request update
         await bleak.write_char(MOVE_HUB_HW_UUID_CHAR, bytearray([0x05, 0x00, 0x01, 0x01, 0x05]))
+        req_queue = self._get_req_queue()
         while not self._abort:
-            await asyncio.sleep(0.1)
-            if self.req_queue.qsize() != 0:
-                data = self.req_queue.get()
-                await bleak.write(data[0], data[1])
-
+            data = await req_queue.get()
+            if data is None:  # wake-up from disconnect()
+                break
+            span = data[3]
+            if span:
+                span.stamp("queue")
+            await bleak.write(data[0], data[1], data[2])
+            if span:
+                span.stamp("write")
+
+        await bleak.disconnect()
         logging.info("Communications thread has exited")
 
     @staticmethod
@@ -81,11 +176,11 @@ class BleakDriver(Connection):
 
     def _processing(self):
         while not self._abort:
-            if self.resp_queue.qsize() != 0:
-                msg = self.resp_queue.get()
-                self._handler(msg[0], bytes(msg[1]))
+            msg = self.resp_queue.get()
+            if msg is None:  # wake-up from disconnect()
+                break
+            self._handler(msg[0], bytes(msg[1]))
 
-            time.sleep(0.01)
         logging.info("Processing thread has exited")
 
     def write(self, handle, data):
@@ -97,10 +192,26 @@ class BleakDriver(Connection):
         :raises ConnectionError" When internal threads are not working
         :return: None
         """
-        if not self._connection_thread.is_alive() or not self._processing_thread.is_alive():
+        if not self.is_alive():
+            raise ConnectionError('Something went wrong, communication threads not functioning.')
+
+        span = tracer.current() if tracer.enabled else None
+        self._loop.call_soon_threadsafe(self._enqueue_request, (handle, data, True, span))
+
+    def write_without_response(self, handle, data):
+        """
+        Send data to given handle number, without waiting for BLE write confirmation.
+
+        :param handle: Handle number that will be translated into characteristic uuid
+        :param data: data to send
+        :raises ConnectionError" When internal threads are not working
+        :return: None
+        """
+        if not self.is_alive():
             raise ConnectionError('Something went wrong, communication threads not functioning.')
 
-        self.req_queue.put((handle, data))
+        span = tracer.current() if tracer.enabled else None
+        self._loop.call_soon_threadsafe(self._enqueue_request, (handle, data, False, span))
 
     def disconnect(self):
         """
@@ -109,6 +220,27 @@ class BleakDriver(Connection):
         :return: None
         """
         self._abort = True
+        if self._bleak and self._connection_thread is None and self._connection_future is None:
+            self._disconnect_unstarted()
+            return
+
+        try:
+            if self._loop:
+                self._loop.call_soon_threadsafe(self._enqueue_request, None)
+        except RuntimeError:
+            log.debug("Event loop is already closed")
+        self.resp_queue.put(None)
+
+    def _disconnect_unstarted(self):
+        """Hub was connected by `connect`, but communication threads were never started"""
+        try:
+            if self._session:
+                asyncio.run_coroutine_threadsafe(self._bleak.disconnect(), self._session.loop).result()
+            else:
+                self._loop.run_until_complete(self._bleak.disconnect())
+                self._loop.close()
+        except BaseException:
+            log.debug("Failed to disconnect", exc_info=True)
 
     def is_alive(self):
         """
@@ -116,24 +248,40 @@ class BleakDriver(Connection):
 
         :return: True if driver is functioning; False otherwise.
         """
-        if self._connection_thread is not None and self._processing_thread is not None:
-            return self._connection_thread.is_alive() and self._processing_thread.is_alive()
+        if self._connection_future is not None:
+            connection_alive = not self._connection_future.done()
+        elif self._connection_thread is not None:
+            connection_alive = self._connection_thread.is_alive()
         else:
             return False
 
+        return connection_alive and self._processing_thread is not None and self._processing_thread.is_alive()
+
+
 class BleakConnection(Connection):
     """Bleak driver for communicating with BLE device."""
 
-    def __init__(self):
-        """Initialize new instance of BleakConnection class."""
+    def __init__(self, session=None):
+        """
+        Initialize new instance of BleakConnection class.
+
+        :param session: Optional BleakSession, to use its shared scanner for device discovery.
+        """
         Connection.__init__(self)
 
+        self._session = session
         self._device = None
         self._client = None
+        self._characteristics = {}  # handle => characteristic, resolved once
+        self._hw_characteristic = None
         logging.getLogger('bleak.backends.dotnet.client').setLevel(logging.WARNING)
         logging.getLogger('bleak.backends.bluezdbus.client').setLevel(logging.WARNING)
 
-    async def find_device(self, hub_mac=None, hub_name=None):
+    async def find_device(self, hub_mac=None, hub_name=None, **kwargs):
+        if self._session:
+            return await self._session.find_device(
+                lambda address, name: self._is_device_matched(address, name, hub_mac, hub_name))
+
         found_event = asyncio.Event()
         found_device = None
 
@@ -148,11 +296,13 @@ class BleakConnection(Connection):
                 found_event.set()
         
         scanner = bleak.BleakScanner(
-            detection_callback=_detect
+            detection_callback=_detect, **kwargs
         )
         await scanner.start()
-        await found_event.wait()
-        await scanner.stop()
+        try:
+            await found_event.wait()
+        finally:
+            await scanner.stop()
         return found_device
 
     async def connect(self, hub_mac=None, hub_name=None, **kwargs):
@@ -166,34 +316,70 @@ class BleakConnection(Connection):
         :raises ConnectionError: When cannot connect to given MAC or name matching fails.
         :return: None
         """
-        log.info("Discovering devices... Press green button on Hub")
-
-        self._device = await self.find_device(hub_mac, hub_name, **kwargs)
-
-        self._client = bleak.BleakClient(self._device)
-        status = await self._client.connect()
-        log.debug('Connection status: {status}'.format(status=status))
+        record = discovery_cache.lookup(hub_mac, hub_name, "bleak")
+        if record and self._session and not self._session.claim(record["address"]):
+            record = None  # already handed to another request of the session
+        if record:
+            log.info("Connecting to cached address %s", record["address"])
+            self._client = bleak.BleakClient(record["address"])
+            try:
+                await self._client.connect(timeout=DIRECT_CONNECT_TIMEOUT)
+            except Exception:
+                log.info("Direct connect failed, falling back to scanning: %s", traceback.format_exc())
+                discovery_cache.forget(hub_mac, hub_name)
+                if self._session:
+                    self._session.release(record["address"])  # so the scan can find it
+                record = None
+
+        if not record:
+            log.info("Discovering devices... Press green button on Hub")
+            self._device = await self.find_device(hub_mac, hub_name, **kwargs)
+
+            self._client = bleak.BleakClient(self._device)
+            status = await self._client.connect()
+            log.debug('Connection status: {status}'.format(status=status))
+
+        discovery_cache.remember(hub_mac, hub_name, self._client.address, "bleak")
+        self._characteristics = {}
+        self._hw_characteristic = self._client.services.get_characteristic(MOVE_HUB_HW_UUID_CHAR)
+
+    def _get_characteristic(self, handle):
+        """
+        Resolve handle into characteristic, caching the result.
 
-    async def write(self, handle, data):
+        If handle cannot be found in service description, LEGO Hub characteristic is used.
+        """
+        char = self._characteristics.get(handle)
+        if char is None:
+            desc = self._client.services.get_descriptor(handle)
+            if desc is None:
+                # dedicated handle not found, try to send by using LEGO Move Hub default characteristic
+                char = self._hw_characteristic or MOVE_HUB_HW_UUID_CHAR
+            else:
+                char = desc.characteristic_uuid
+            self._characteristics[handle] = char
+        return char
+
+    async def write(self, handle, data, response=True):
         """
         Send data to given handle number.
 
-        If handle cannot be found in service description, hardcoded LEGO uuid will be used.
-        :param handle: Handle number that will be translated into characteristic uuid
+        :param handle: Handle number that will be translated into characteristic
         :param data: data to send
+        :param response: False to skip waiting for BLE write confirmation
         :return: None
         """
-        log.debug('Request: {handle} {payload}'.format(handle=handle, payload=[hex(x) for x in data]))
-        desc = self._client.services.get_descriptor(handle)
+        if packets.enabled:
+            packets.trace(packets.OUT, "bleak", handle, data)
 
         if not isinstance(data, bytearray):
             data = bytearray(data)
 
-        if desc is None:
-            # dedicated handle not found, try to send by using LEGO Move Hub default characteristic
-            await self._client.write_gatt_char(MOVE_HUB_HW_UUID_CHAR, data)
-        else:
-            await self._client.write_gatt_char(desc.characteristic_uuid, data)
+        await self._client.write_gatt_char(self._get_characteristic(handle), data, response=response)
+
+    async def disconnect(self):
+        if self._client:
+            await self._client.disconnect()
 
     async def write_char(self, characteristic_uuid, data):
         """
@@ -215,7 +401,8 @@ class BleakConnection(Connection):
         handler, resp_queue = inputs
 
         def c(handle, data):
-            log.debug('Response: {handle} {payload}'.format(handle=handle, payload=[hex(x) for x in data]))
+            if packets.enabled:
+                packets.trace(packets.IN, "bleak", MOVE_HUB_HARDWARE_HANDLE, data)
             handler(handle, data, resp_queue)
 
         await self._client.start_notify(MOVE_HUB_HW_UUID_CHAR, c)
@@ -228,3 +415,114 @@ class BleakConnection(Connection):
         :return: None.
         """
         pass
+
+
+class BleakSession:
+    """
+    Shares one event loop thread and one BLE scanner between many hubs.
+    Scanning runs while there are hubs to find, each advertisement is matched against all of them at once,
+    then hubs get connected concurrently.
+
+    Usage::
+
+        session = BleakSession()
+        conns = session.connect([(None, "LEGO Move Hub"), ("AA:BB:CC:DD:EE:FF", None)])
+        hubs = [MoveHub(conn) for conn in conns]
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._scanner = None
+        self._scanner_lock = None
+        self._requests = []  # list of (matcher, future) waiting for device
+        self._claimed = set()  # addresses already handed to some request
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.name = "Bleak session loop"
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _detect(self, device, advertisement_data):
+        if device.address in self._claimed:
+            return
+
+        for matcher, future in self._requests:
+            if not future.done() and matcher(device.address, device.name):
+                log.info('Device matched: %r', device)
+                self._claimed.add(device.address)
+                future.set_result(device)
+                break
+
+    def claim(self, address):
+        """
+        Reserve address for a direct connect, so scanning requests don't get the same device. Called inside the loop.
+
+        :return: False if it's already claimed
+        """
+        if address in self._claimed:
+            return False
+        self._claimed.add(address)
+        return True
+
+    def release(self, address):
+        """Give up claimed address, called inside the loop"""
+        self._claimed.discard(address)
+
+    async def find_device(self, matcher):
+        """
+        Wait for advertisement matching given criteria, scanning is shared with other calls
+
+        :param matcher: callable(address, name) returning bool
+        """
+        if self._scanner_lock is None:
+            self._scanner_lock = asyncio.Lock()
+
+        request = (matcher, self.loop.create_future())
+        self._requests.append(request)
+        try:
+            async with self._scanner_lock:
+                if not self._scanner:
+                    log.info("Discovering devices... Press green button on Hub")
+                    self._scanner = bleak.BleakScanner(detection_callback=self._detect, **_scanner_kwargs())
+                    await self._scanner.start()
+            return await request[1]
+        finally:
+            self._requests.remove(request)
+            async with self._scanner_lock:
+                if not self._requests and self._scanner:
+                    scanner, self._scanner = self._scanner, None
+                    await scanner.stop()
+
+    def connect(self, hubs, timeout=None):
+        """
+        Find and connect many hubs at once.
+
+        :param hubs: list of (hub_mac, hub_name) tuples, any of the two can be None
+        :param timeout: seconds to wait for all hubs, None to wait forever
+        :rtype: list[BleakDriver]
+        """
+        drivers = [BleakDriver(hub_mac, hub_name, session=self) for hub_mac, hub_name in hubs]
+
+        async def connect_all():
+            await asyncio.gather(*[driver._connect() for driver in drivers])
+
+        future = asyncio.run_coroutine_threadsafe(connect_all(), self.loop)
+        try:
+            future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+        return drivers
+
+    def get_connection(self, hub_mac=None, hub_name=None, timeout=None):
+        """
+        :rtype: BleakDriver
+        """
+        return self.connect([(hub_mac, hub_name)], timeout)[0]
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -1,16 +1,24 @@
 import logging
+import os
 import re
-from threading import Thread, Event
+import select
+import time
+from threading import Thread, Event, Lock
 
 from bluepy import btle
 
-from pylgbst.comms import Connection
-from pylgbst.utilities import str2hex, queue
+from pylgbst import packets
+from pylgbst.comms import Connection, discovery_cache
+from pylgbst.utilities import queue, Histogram
 
 log = logging.getLogger('comms-bluepy')
 
 COMPLETE_LOCAL_NAME_ADTYPE = 9
 PROPAGATE_DISPATCHER_EXCEPTION = False
+DIRECT_CONNECT_TIMEOUT = 10
+IDLE_TIMEOUT = 1.0  # how long dispatcher sleeps when nothing happens
+POLL_TIMEOUT_MIN = 0.001  # adaptive timeouts, used when helper process output can't be watched
+POLL_TIMEOUT_MAX = 0.05
 
 
 def _get_iface_number(controller):
@@ -45,6 +53,14 @@ class BluepyThreadedPeripheral:
         self._iface_number = _get_iface_number(controller)
 
         self._disconnect_event = Event()
+        self._connected_event = Event()
+        self._connect_error = None
+        self._wake_read, self._wake_write = os.pipe()  # self-pipe to interrupt waiting for notifications
+        self._wake_lock = Lock()  # guards writing into the pipe against closing it
+        self._wake_closed = False
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+        self.write_latency = Histogram()  # from queueing a write to its completion, updated by dispatcher only
 
         self._dispatcher_thread = Thread(target=self._dispatch_calls)
         self._dispatcher_thread.setDaemon(True)
@@ -52,16 +68,30 @@ class BluepyThreadedPeripheral:
         self._dispatcher_thread.start()
 
     def _dispatch_calls(self):
-        self._peripheral = btle.Peripheral(self._addr, self._addrType, self._iface_number)
+        try:
+            self._peripheral = btle.Peripheral(self._addr, self._addrType, self._iface_number)
+        except BaseException as exc:
+            self._connect_error = exc
+            self._close_wake_pipe()
+            raise
+        finally:
+            self._connected_event.set()
+
+        helper_fd = self._get_helper_fd()
+        if helper_fd is None:
+            log.debug("Can't watch bluepy helper output, will use adaptive polling")
+
+        timeout = POLL_TIMEOUT_MIN
         try:
             while not self._disconnect_event.is_set():
                 try:
-                    try:
-                        method = self._call_queue.get(False)
-                        method()
-                    except queue.Empty:
-                        pass
-                    self._peripheral.waitForNotifications(1.)
+                    if helper_fd is not None:
+                        self._drain_calls()
+                        self._wait_events(helper_fd)
+                    elif self._drain_calls() or self._peripheral.waitForNotifications(timeout):
+                        timeout = POLL_TIMEOUT_MIN
+                    else:
+                        timeout = min(timeout * 2, POLL_TIMEOUT_MAX)
                 except Exception as ex:
                     log.exception('Exception in call dispatcher thread', exc_info=ex)
                     if PROPAGATE_DISPATCHER_EXCEPTION:
@@ -69,16 +99,80 @@ class BluepyThreadedPeripheral:
                         raise
         finally:
             self._peripheral.disconnect()
+            self._close_wake_pipe()
+
+    def _close_wake_pipe(self):
+        with self._wake_lock:
+            if self._wake_closed:
+                return
+            self._wake_closed = True
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+
+    def _get_helper_fd(self):
+        helper = getattr(self._peripheral, "_helper", None)
+        try:
+            return helper.stdout.fileno()
+        except (AttributeError, ValueError, OSError):
+            return None
+
+    def _drain_calls(self):
+        """Run all queued calls, return True if there were any"""
+        called = False
+        while True:
+            try:
+                method = self._call_queue.get_nowait()
+            except queue.Empty:
+                return called
+            method()
+            called = True
+
+    def _wait_events(self, helper_fd):
+        """Sleep until bluepy helper has output or new call is queued, then handle notifications"""
+        readable, _, _ = select.select([helper_fd, self._wake_read], [], [], IDLE_TIMEOUT)
+        if self._wake_read in readable:
+            try:
+                os.read(self._wake_read, 4096)
+            except BlockingIOError:
+                pass
+
+        if helper_fd in readable:
+            # helper output is line-buffered, so keep going while there are buffered notifications
+            while self._peripheral.waitForNotifications(0):
+                pass
+
+    def _put_call(self, method):
+        self._call_queue.put(method)
+        with self._wake_lock:
+            if self._wake_closed:
+                return
+            try:
+                os.write(self._wake_write, b"\0")
+            except OSError:  # pipe is full, so dispatcher is going to wake up anyway
+                pass
+
+    def wait_connected(self, timeout=None):
+        if not self._connected_event.wait(timeout):
+            raise ConnectionError("Timed out connecting to %s" % self._addr)
+        if self._connect_error:
+            raise ConnectionError("Failed to connect to %s: %s" % (self._addr, self._connect_error))
 
     def write(self, handle, data):
-        self._call_queue.put(lambda: self._peripheral.writeCharacteristic(handle, data))
+        queued = time.monotonic()
+
+        def _write():
+            self._peripheral.writeCharacteristic(handle, data)
+            self.write_latency.add(time.monotonic() - queued)
+
+        self._put_call(_write)
 
     def set_notify_handler(self, handler):
         delegate = BluepyDelegate(handler)
-        self._call_queue.put(lambda: self._peripheral.withDelegate(delegate))
+        self._put_call(lambda: self._peripheral.withDelegate(delegate))
 
     def disconnect(self):
         self._disconnect_event.set()
+        self._put_call(lambda: None)  # wake the dispatcher
 
 
 class BluepyConnection(Connection):
@@ -89,9 +183,19 @@ class BluepyConnection(Connection):
 
     def connect(self, hub_mac=None, hub_name=None):
         log.debug("Trying to connect client to MoveHub with MAC: %s", hub_mac)
+
+        def _connect_direct(record):
+            peripheral = BluepyThreadedPeripheral(record["address"], record["address_type"], self._controller)
+            peripheral.wait_connected(DIRECT_CONNECT_TIMEOUT)
+            self._peripheral = peripheral
+
+        if self._connect_cached(hub_mac, hub_name, "bluepy", _connect_direct):
+            return self
+
         scanner = btle.Scanner()
 
         while not self._peripheral:
+            self._check_cancelled()
             log.info("Discovering devices...")
             scanner.scan(1)
             devices = scanner.getDevices()
@@ -103,6 +207,7 @@ class BluepyConnection(Connection):
 
                 if self._is_device_matched(address, name, hub_mac, hub_name):
                     self._peripheral = BluepyThreadedPeripheral(address, address_type, self._controller)
+                    discovery_cache.remember(hub_mac, hub_name, address, "bluepy", address_type)
                     break
 
         return self
@@ -111,11 +216,20 @@ class BluepyConnection(Connection):
         self._peripheral.disconnect()
 
     def write(self, handle, data):
-        log.debug("Writing to handle %s: %s", handle, str2hex(data))
+        if packets.enabled:
+            packets.trace(packets.OUT, "bluepy", handle, data)
         self._peripheral.write(handle, data)
 
     def set_notify_handler(self, handler):
         self._peripheral.set_notify_handler(handler)
 
+    def get_write_latency(self):
+        """
+        Statistics of time from write call until bluepy completes it, in seconds
+
+        :rtype: dict
+        """
+        return self._peripheral.write_latency.summary()
+
     def is_alive(self):
         return True
@@ -0,0 +1,566 @@
+"""
+Software hub that speaks LEGO Wireless Protocol, to run and benchmark the library without any hardware.
+
+Emulator is a `Connection`: it answers property and port requests, acknowledges port mode setups,
+reports output feedback after simulated motion time and streams sensor values. Link latency, jitter
+and loss are simulated too. All emulated hubs share one scheduler thread, so hundreds of them are cheap::
+
+    hub = MoveHub(HubEmulator(HubEmulator.MOVE_HUB, latency=0.01))
+"""
+import heapq
+import itertools
+import logging
+import random
+import time
+from struct import pack, unpack_from
+from threading import Thread, Condition, RLock
+
+from pylgbst.comms import Connection, ENABLE_NOTIFICATIONS_HANDLE
+from pylgbst.messages import DevTypes, MsgHubProperties, MsgHubAction, MsgHubAlert, MsgHubAttachedIO, \
+    MsgGenericError, MsgPortInfoRequest, MsgPortModeInfoRequest, MsgPortInputFmtSetupSingle, MsgVirtualPortSetup, \
+    MsgPortOutput, MsgPortValueSingle, MsgPortInputFmtSingle, MsgPortInfo, MsgPortModeInfo, MsgPortOutputFeedback
+
+log = logging.getLogger('comms-emulator')
+
+MAX_SPEED = 1000.0  # degrees per second at 100% speed
+
+FEEDBACK_IN_PROGRESS = 0b0001
+FEEDBACK_COMPLETED = 0b0010
+FEEDBACK_DISCARDED = 0b0100
+FEEDBACK_IDLE = 0b1000
+
+ERROR_COMMAND_NOT_RECOGNIZED = 0x05
+ERROR_INVALID_USE = 0x06
+
+MOTOR_TYPES = (DevTypes.MOTOR, DevTypes.SYSTEM_TRAIN_MOTOR, DevTypes.MOTOR_EXTERNAL_TACHO,
+               DevTypes.MOTOR_INTERNAL_TACHO, DevTypes.TECHNIC_LARGE_LINEAR_MOTOR,
+               DevTypes.TECHNIC_XLARGE_LINEAR_MOTOR, DevTypes.TECHNIC_MEDIUM_ANGULAR_MOTOR,
+               DevTypes.TECHNIC_LARGE_ANGULAR_MOTOR, DevTypes.TECHNIC_MEDIUM_ANGULAR_MOTOR_GREY,
+               DevTypes.TECHNIC_LARGE_ANGULAR_MOTOR_GREY)
+
+# device type => capabilities, total modes, input modes mask, output modes mask
+MODE_INFO = {
+    DevTypes.MOTOR_INTERNAL_TACHO: (0x0F, 4, 0b1110, 0b0001),
+    DevTypes.MOTOR_EXTERNAL_TACHO: (0x0F, 4, 0b1110, 0b0001),
+    DevTypes.VISION_SENSOR: (0x07, 11, 0b10101011111, 0b01010100000),
+    DevTypes.RGB_LIGHT: (0x01, 2, 0b00, 0b11),
+    DevTypes.TILT_INTERNAL: (0x06, 8, 0b11111111, 0),
+    DevTypes.CURRENT: (0x02, 2, 0b11, 0),
+    DevTypes.VOLTAGE: (0x02, 2, 0b11, 0),
+}
+DEFAULT_MODE_INFO = (0x02, 1, 0b1, 0)
+
+# device type => {mode: value size}, None key is the default for the device
+VALUE_SIZES = {
+    DevTypes.RGB_LIGHT: {0: 1, 1: 3},
+    DevTypes.VISION_SENSOR: {6: 6},
+    DevTypes.VOLTAGE: {None: 2},
+    DevTypes.CURRENT: {None: 2},
+    DevTypes.REMOTE_CONTROL_BUTTON: {None: 1},
+    DevTypes.REMOTE_CONTROL_RSSI: {None: 1},
+}
+
+SYSTEM_TYPES = {"LEGO Move Hub": 0x40, "Smart Hub": 0x41, "Remote Handset": 0x42}
+
+
+class EmulatorScheduler:
+    """Single timer thread running callbacks of all emulated hubs"""
+
+    def __init__(self):
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = Condition()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.name = "Hub emulator scheduler"
+        self._thread.start()
+
+    def call_at(self, due, callback, *args):
+        with self._cond:
+            heapq.heappush(self._queue, (due, next(self._counter), callback, args))
+            self._cond.notify()
+
+    def call_later(self, delay, callback, *args):
+        self.call_at(time.monotonic() + delay, callback, *args)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    self._cond.wait(self._queue[0][0] - time.monotonic() if self._queue else None)
+                _, _, callback, args = heapq.heappop(self._queue)
+
+            try:
+                callback(*args)
+            except Exception:
+                log.exception("Emulator callback failed")
+
+
+_default_scheduler = None
+
+
+def get_default_scheduler():
+    global _default_scheduler
+    if _default_scheduler is None:
+        _default_scheduler = EmulatorScheduler()
+    return _default_scheduler
+
+
+class _EmulatedPort:
+    def __init__(self, port, dev_type, members=()):
+        self.port = port
+        self.dev_type = dev_type
+        self.members = members  # ports combined into virtual one
+        self.mode = 0
+        self.delta = 1
+        self.updates = False
+        self.last_value = None
+        self.values = {}  # mode => value bytes set by user
+
+        # motor simulation, position is base_position + speed * (now - base_time)
+        self.base_position = 0.0
+        self.base_time = time.monotonic()
+        self.speed = 0.0
+        self.move_id = 0  # identifies motion that scheduled completion
+
+    def position(self, now):
+        return self.base_position + self.speed * (now - self.base_time)
+
+    def set_motion(self, now, speed, position=None):
+        self.base_position = self.position(now) if position is None else position
+        self.base_time = now
+        self.speed = speed
+        self.move_id += 1
+        return self.move_id
+
+    def value(self, mode, now):
+        if mode in self.values:
+            return self.values[mode]
+
+        if self.dev_type in MOTOR_TYPES:
+            if mode == 0x01:
+                return pack("<b", int(max(-100, min(100, self.speed * 100 / MAX_SPEED))))
+            elif mode == 0x02:
+                return pack("<i", int(round(self.position(now))))
+        elif self.dev_type == DevTypes.VOLTAGE:
+            return pack("<H", 3000)
+        elif self.dev_type == DevTypes.CURRENT:
+            return pack("<H", 150)
+
+        sizes = VALUE_SIZES.get(self.dev_type, {})
+        return bytes(sizes.get(mode, sizes.get(None, 4)))
+
+
+class HubEmulator(Connection):
+    """
+    :param layout: tuple of hub name and list of (port, device type), see `MOVE_HUB`, `SMART_HUB`, `REMOTE_HANDSET`
+    :param latency: one-way link delay, seconds
+    :param jitter: max random addition to latency, seconds
+    :param loss: probability of packet to be lost, in each direction
+    :param sensor_rate: how many times per second subscribed sensors are sampled
+    :type scheduler: EmulatorScheduler
+    """
+
+    MOVE_HUB = ("LEGO Move Hub", [
+        (0x00, DevTypes.MOTOR_INTERNAL_TACHO),
+        (0x01, DevTypes.MOTOR_INTERNAL_TACHO),
+        (0x02, DevTypes.VISION_SENSOR),
+        (0x03, DevTypes.MOTOR_EXTERNAL_TACHO),
+        (0x32, DevTypes.RGB_LIGHT),
+        (0x3A, DevTypes.TILT_INTERNAL),
+        (0x3B, DevTypes.CURRENT),
+        (0x3C, DevTypes.VOLTAGE),
+        (0x10, (0x00, 0x01)),
+    ])
+    SMART_HUB = ("Smart Hub", [
+        (0x00, DevTypes.SYSTEM_TRAIN_MOTOR),
+        (0x32, DevTypes.RGB_LIGHT),
+        (0x3B, DevTypes.CURRENT),
+        (0x3C, DevTypes.VOLTAGE),
+    ])
+    REMOTE_HANDSET = ("Remote Handset", [
+        (0x00, DevTypes.REMOTE_CONTROL_BUTTON),
+        (0x01, DevTypes.REMOTE_CONTROL_BUTTON),
+        (0x34, DevTypes.RGB_LIGHT),
+        (0x3B, DevTypes.VOLTAGE),
+        (0x3C, DevTypes.REMOTE_CONTROL_RSSI),
+    ])
+
+    def __init__(self, layout=MOVE_HUB, mac="00:16:53:00:00:01", latency=0.0, jitter=0.0, loss=0.0,
+                 sensor_rate=20.0, scheduler=None, seed=None):
+        super().__init__()
+        self.name, self._layout = layout
+        self.mac = mac
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.sensor_rate = sensor_rate
+        self.scheduler = scheduler or get_default_scheduler()
+
+        self.sent = 0  # notifications delivered
+        self.received = 0  # writes accepted
+        self.lost = 0
+
+        self._random = random.Random(seed)
+        self._lock = RLock()
+        self._handler = None
+        self._alive = False
+        self._last_due = 0.0
+        self._ports = {}
+        self._button_updates = False
+        self._button = 0
+        self._ticking = False
+
+    def connect(self, hub_mac=None, hub_name=None):
+        return self
+
+    def set_notify_handler(self, handler):
+        self._handler = handler
+
+    def enable_notifications(self):
+        with self._lock:
+            if self._alive:
+                return
+            self._alive = True
+            for port, dev in self._layout:
+                if isinstance(dev, tuple):
+                    self._attach_virtual(port, dev)
+                else:
+                    self.attach(port, dev)
+
+    def is_alive(self):
+        return self._alive
+
+    def disconnect(self):
+        self._alive = False
+
+    # === link simulation ===
+
+    def _emit(self, msg_type, payload):
+        data = pack("<BBB", 3 + len(payload), 0, msg_type) + payload
+        with self._lock:
+            if self._random.random() < self.loss:
+                self.lost += 1
+                return
+            delay = self.latency + (self._random.random() * self.jitter if self.jitter else 0.0)
+            due = max(time.monotonic() + delay, self._last_due)  # link keeps the order
+            self._last_due = due
+        self.scheduler.call_at(due, self._deliver, data)
+
+    def _deliver(self, data):
+        if self._alive and self._handler:
+            self.sent += 1
+            self._handler(0x0E, data)
+
+    def write(self, handle, data):
+        if handle == ENABLE_NOTIFICATIONS_HANDLE:
+            return
+
+        data = bytes(data)
+        with self._lock:
+            if self._random.random() < self.loss:
+                self.lost += 1
+                return
+            self.received += 1
+
+        if self.latency or self.jitter:
+            delay = self.latency + self._random.random() * self.jitter
+            self.scheduler.call_later(delay, self._handle_write, data)
+        else:
+            self._handle_write(data)
+
+    def _handle_write(self, data):
+        if not self._alive:
+            return
+
+        msg_type = data[2]
+        handlers = {
+            MsgHubProperties.TYPE: self._on_property,
+            MsgHubAction.TYPE: self._on_action,
+            MsgHubAlert.TYPE: self._on_alert,
+            MsgPortInfoRequest.TYPE: self._on_port_info,
+            MsgPortModeInfoRequest.TYPE: self._on_mode_info,
+            MsgPortInputFmtSetupSingle.TYPE: self._on_input_setup,
+            MsgVirtualPortSetup.TYPE: self._on_virtual_setup,
+            MsgPortOutput.TYPE: self._on_output,
+        }
+        handler = handlers.get(msg_type)
+        with self._lock:
+            if handler:
+                handler(data[3:])
+            else:
+                self._error(msg_type, ERROR_COMMAND_NOT_RECOGNIZED)
+
+    def _error(self, msg_type, code):
+        self._emit(MsgGenericError.TYPE, pack("<BB", msg_type, code))
+
+    # === devices ===
+
+    def attach(self, port, dev_type):
+        """Plug device into the port, hub announces it"""
+        with self._lock:
+            self._ports[port] = _EmulatedPort(port, dev_type)
+            payload = pack("<BBH", port, MsgHubAttachedIO.EVENT_ATTACHED, dev_type.value)
+            self._emit(MsgHubAttachedIO.TYPE, payload + pack("<II", 0x10000000, 0x10000000))
+
+    def detach(self, port):
+        with self._lock:
+            self._ports.pop(port, None)
+            self._emit(MsgHubAttachedIO.TYPE, pack("<BB", port, MsgHubAttachedIO.EVENT_DETACHED))
+
+    def _attach_virtual(self, port, members):
+        dev_type = self._ports[members[0]].dev_type
+        self._ports[port] = _EmulatedPort(port, dev_type, members)
+        payload = pack("<BBHBB", port, MsgHubAttachedIO.EVENT_ATTACHED_VIRTUAL, dev_type.value, *members)
+        self._emit(MsgHubAttachedIO.TYPE, payload)
+
+    def set_sensor_value(self, port, mode, value):
+        """Make sensor report given raw value bytes in given mode"""
+        with self._lock:
+            self._ports[port].values[mode] = bytes(value)
+
+    def press_button(self, pressed=True):
+        with self._lock:
+            self._button = 1 if pressed else 0
+            if self._button_updates:
+                self._property_update(MsgHubProperties.BUTTON, pack("<B", self._button))
+
+    def get_position(self, port):
+        return self._ports[port].position(time.monotonic())
+
+    # === hub level requests ===
+
+    def _property_update(self, prop, value):
+        self._emit(MsgHubProperties.TYPE, pack("<BB", prop, MsgHubProperties.UPSTREAM_UPDATE) + value)
+
+    def _property_value(self, prop):
+        props = MsgHubProperties
+        if prop == props.ADVERTISE_NAME:
+            return self.name.encode("ascii")
+        elif prop == props.BUTTON:
+            return pack("<B", self._button)
+        elif prop in (props.FW_VERSION, props.HW_VERSION):
+            return pack("<I", 0x10000000)
+        elif prop == props.RADIO_FW_VERSION:
+            return b"2_02_01"
+        elif prop == props.RSSI:
+            return pack("<b", -50)
+        elif prop == props.VOLTAGE_PERC:
+            return pack("<B", 100)
+        elif prop == props.BATTERY_TYPE:
+            return pack("<B", 0)
+        elif prop == props.MANUFACTURER:
+            return b"LEGO System A/S"
+        elif prop == props.WIRELESS_PROTO_VERSION:
+            return pack("<H", 0x3000)
+        elif prop == props.SYSTEM_TYPE_ID:
+            return pack("<B", SYSTEM_TYPES.get(self.name, 0))
+        elif prop == props.HW_NETW_ID:
+            return pack("<B", 0)
+        elif prop in (props.PRIMARY_MAC, props.SECONDARY_MAC):
+            return bytes(int(x, 16) for x in self.mac.split(":"))
+        return None
+
+    def _on_property(self, payload):
+        prop, operation = payload[0], payload[1]
+        value = self._property_value(prop)
+        if value is None:
+            self._error(MsgHubProperties.TYPE, ERROR_INVALID_USE)
+            return
+
+        if prop == MsgHubProperties.BUTTON and operation in (MsgHubProperties.UPD_ENABLE,
+                                                             MsgHubProperties.UPD_DISABLE):
+            self._button_updates = operation == MsgHubProperties.UPD_ENABLE
+
+        if operation in (MsgHubProperties.UPD_REQUEST, MsgHubProperties.UPD_ENABLE):
+            self._property_update(prop, value)
+
+    def _on_action(self, payload):
+        action = payload[0]
+        if action == MsgHubAction.SWITCH_OFF:
+            self._emit(MsgHubAction.TYPE, pack("<B", MsgHubAction.UPSTREAM_SHUTDOWN))
+            self.scheduler.call_later(self.latency + 0.01, self.disconnect)
+        elif action == MsgHubAction.DISCONNECT:
+            self._emit(MsgHubAction.TYPE, pack("<B", MsgHubAction.UPSTREAM_DISCONNECT))
+            self.scheduler.call_later(self.latency + 0.01, self.disconnect)
+
+    def _on_alert(self, payload):
+        self._emit(MsgHubAlert.TYPE, pack("<BBB", payload[0], MsgHubAlert.UPSTREAM_UPDATE, 0))
+
+    # === port level requests ===
+
+    def _get_port(self, msg_type, port):
+        dev = self._ports.get(port)
+        if dev is None:
+            self._error(msg_type, ERROR_INVALID_USE)
+        return dev
+
+    def _on_port_info(self, payload):
+        port, info_type = payload[0], payload[1]
+        dev = self._get_port(MsgPortInfoRequest.TYPE, port)
+        if not dev:
+            return
+
+        if info_type == MsgPortInfoRequest.INFO_PORT_VALUE:
+            self._emit(MsgPortValueSingle.TYPE, pack("<B", port) + dev.value(dev.mode, time.monotonic()))
+        elif info_type == MsgPortInfoRequest.INFO_MODE_INFO:
+            caps, total, inputs, outputs = MODE_INFO.get(dev.dev_type, DEFAULT_MODE_INFO)
+            self._emit(MsgPortInfo.TYPE, pack("<BBBBHH", port, info_type, caps, total, inputs, outputs))
+        else:
+            _, _, inputs, _ = MODE_INFO.get(dev.dev_type, DEFAULT_MODE_INFO)
+            self._emit(MsgPortInfo.TYPE, pack("<BBHH", port, info_type, inputs, 0))
+
+    def _on_mode_info(self, payload):
+        port, mode, info_type = payload[0], payload[1], payload[2]
+        if not self._get_port(MsgPortModeInfoRequest.TYPE, port):
+            return
+
+        info = MsgPortModeInfoRequest
+        if info_type == info.INFO_NAME:
+            value = ("MODE%d" % mode).encode("ascii") + b"\x00"
+        elif info_type in (info.INFO_RAW_RANGE, info.INFO_PCT_RANGE, info.INFO_SI_RANGE):
+            value = pack("<ff", 0.0, 100.0)
+        elif info_type == info.INFO_UNITS:
+            value = b"\x00"
+        elif info_type == info.INFO_MAPPING:
+            value = pack("<BB", 0x10, 0x10)
+        elif info_type == info.INFO_MOTOR_BIAS:
+            value = pack("<B", 0)
+        elif info_type == info.INFO_CAPABILITY_BITS:
+            value = bytes(6)
+        elif info_type == info.INFO_VALUE_FORMAT:
+            value = pack("<BBBB", 1, 0, 3, 0)
+        else:
+            self._error(MsgPortModeInfoRequest.TYPE, ERROR_INVALID_USE)
+            return
+        self._emit(MsgPortModeInfo.TYPE, pack("<BBB", port, mode, info_type) + value)
+
+    def _on_input_setup(self, payload):
+        port, mode = payload[0], payload[1]
+        delta, = unpack_from("<I", payload, 2)
+        dev = self._get_port(MsgPortInputFmtSetupSingle.TYPE, port)
+        if not dev:
+            return
+
+        dev.mode, dev.delta, dev.updates = mode, delta, bool(payload[6])
+        dev.last_value = None
+        self._emit(MsgPortInputFmtSingle.TYPE, bytes(payload[:7]))
+        if dev.updates:
+            self._start_ticking()
+
+    def _on_virtual_setup(self, payload):
+        if payload[0] == MsgVirtualPortSetup.CMD_CONNECT:
+            members = (payload[1], payload[2])
+            if members[0] not in self._ports or members[1] not in self._ports:
+                self._error(MsgVirtualPortSetup.TYPE, ERROR_INVALID_USE)
+                return
+            port = next(x for x in itertools.count(0x10) if x not in self._ports)
+            self._attach_virtual(port, members)
+        else:
+            self.detach(payload[1])
+
+    def _on_output(self, payload):
+        port, flags, subcmd = payload[0], payload[1], payload[2]
+        params = payload[3:]
+        dev = self._get_port(MsgPortOutput.TYPE, port)
+        if not dev:
+            return
+
+        feedback = flags & MsgPortOutput.SC_FEEDBACK
+        targets = [self._ports[x] for x in dev.members] if dev.members else [dev]
+        duration = self._apply_output(targets, subcmd, params)
+        if duration is None:
+            if feedback:
+                self._feedback(port, FEEDBACK_COMPLETED | FEEDBACK_IDLE)
+            return
+
+        move_ids = [target.move_id for target in targets]
+        if feedback:
+            self._feedback(port, FEEDBACK_IN_PROGRESS)
+        finish = time.monotonic() + duration
+        self.scheduler.call_at(finish, self._finish_motion, dev, targets, move_ids, feedback, finish)
+
+    def _apply_output(self, targets, subcmd, params):
+        """Update motion of target motors, return duration of the motion if it's finite"""
+        now = time.monotonic()
+        if subcmd in (0x01, 0x02, 0x07, 0x08):  # start power or speed
+            for idx, target in enumerate(targets):
+                target.set_motion(now, _speed(params[idx]))
+        elif subcmd in (0x09, 0x0A):  # speed for time
+            msec, = unpack_from("<H", params, 0)
+            for idx, target in enumerate(targets):
+                target.set_motion(now, _speed(params[2 + idx]))
+            return msec / 1000.0
+        elif subcmd in (0x0B, 0x0C):  # speed for degrees
+            degrees, = unpack_from("<I", params, 0)
+            speeds = [_speed(params[4 + idx]) for idx in range(len(targets))]
+            for target, speed in zip(targets, speeds):
+                target.set_motion(now, speed)
+            fastest = max(abs(x) for x in speeds)
+            return degrees / fastest if fastest else 0.0
+        elif subcmd in (0x0D, 0x0E):  # goto absolute position
+            positions = unpack_from("<" + "i" * len(targets), params, 0)
+            speed = abs(_speed(params[4 * len(targets)])) or MAX_SPEED
+            duration = max(abs(pos - target.position(now)) for target, pos in zip(targets, positions)) / speed
+            for target, pos in zip(targets, positions):
+                target.set_motion(now, (pos - target.position(now)) / duration if duration else 0.0)
+            return duration
+        elif subcmd in (0x14, 0x15) or (subcmd == MsgPortOutput.WRITE_DIRECT_MODE_DATA and params[:1] == b"\x02"
+                                and targets[0].dev_type in MOTOR_TYPES):  # preset encoder
+            offset = 1 if subcmd == MsgPortOutput.WRITE_DIRECT_MODE_DATA else 0
+            for idx, target in enumerate(targets):
+                target.set_motion(now, target.speed, unpack_from("<i", params, offset + 4 * idx)[0])
+        elif subcmd == MsgPortOutput.WRITE_DIRECT_MODE_DATA and targets[0].dev_type in MOTOR_TYPES:
+            targets[0].set_motion(now, _speed(params[1]))  # train motor power
+        return None
+
+    def _finish_motion(self, dev, targets, move_ids, feedback, finish):
+        with self._lock:
+            if [target.move_id for target in targets] != move_ids:
+                if feedback:
+                    self._feedback(dev.port, FEEDBACK_DISCARDED)
+                return
+
+            for target in targets:
+                target.set_motion(finish, 0.0)  # stop exactly where planned, regardless of scheduler delay
+            if feedback:
+                self._feedback(dev.port, FEEDBACK_COMPLETED | FEEDBACK_IDLE)
+
+    def _feedback(self, port, status):
+        self._emit(MsgPortOutputFeedback.TYPE, pack("<BB", port, status))
+
+    # === sensor streams ===
+
+    def _start_ticking(self):
+        if not self._ticking and self.sensor_rate:
+            self._ticking = True
+            self.scheduler.call_later(1.0 / self.sensor_rate, self._tick)
+
+    def _tick(self):
+        with self._lock:
+            streaming = [dev for dev in self._ports.values() if dev.updates]
+            if not self._alive or not streaming:
+                self._ticking = False
+                return
+
+            now = time.monotonic()
+            for dev in streaming:
+                value = dev.value(dev.mode, now)
+                if dev.last_value is not None and not self._changed(dev, value):
+                    continue
+                dev.last_value = value
+                self._emit(MsgPortValueSingle.TYPE, pack("<B", dev.port) + value)
+
+            self.scheduler.call_later(1.0 / self.sensor_rate, self._tick)
+
+    @staticmethod
+    def _changed(dev, value):
+        if dev.dev_type in MOTOR_TYPES and dev.mode == 0x02:
+            return abs(unpack_from("<i", value)[0] - unpack_from("<i", dev.last_value)[0]) >= dev.delta
+        return value != dev.last_value
+
+
+def _speed(byte):
+    """Signed percent byte to degrees per second, special brake and hold values mean zero"""
+    percent = byte - 256 if byte > 127 else byte
+    return percent * MAX_SPEED / 100 if abs(percent) <= 100 else 0.0
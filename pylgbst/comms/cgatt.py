@@ -1,37 +1,65 @@
 import logging
 import re
 import threading
-from time import sleep
+import time
 
 import gatt
 
+from pylgbst import packets
 from pylgbst.comms import Connection, MOVE_HUB_HW_UUID_SERV, MOVE_HUB_HW_UUID_CHAR, \
-    MOVE_HUB_HARDWARE_HANDLE
-from pylgbst.utilities import str2hex
+    MOVE_HUB_HARDWARE_HANDLE, discovery_cache
 
 log = logging.getLogger('comms-gatt')
 
+DIRECT_CONNECT_TIMEOUT = 10
+TIMEOUT = 60
+
+
+class HubDeviceManager(gatt.DeviceManager):
+    """Device manager that signals as soon as matching device is discovered"""
+
+    def __init__(self, adapter_name):
+        super().__init__(adapter_name=adapter_name)
+        self.matcher = None
+        self.found_address = None
+        self.found_event = threading.Event()
+
+    def device_discovered(self, device):
+        if self.matcher and not self.found_event.is_set() and self.matcher(device.mac_address, device.alias()):
+            self.found_address = device.mac_address
+            self.found_event.set()
+
 
 class CustomDevice(gatt.Device):
     def __init__(self, mac_address, manager):
         gatt.Device.__init__(self, mac_address=mac_address, manager=manager)
         self._notify_callback = lambda hnd, val: None
         self._handle = None
+        self._resolved_event = threading.Event()
 
-    def connect(self):
+    def connect(self, timeout=None):
+        """
+        :param timeout: seconds to wait for connection and services resolution, None to wait forever
+        """
+        self._resolved_event.clear()
         gatt.Device.connect(self)
         log.info("Waiting for device connection...")
-        while self._handle is None:
-            log.debug("Sleeping...")
-            sleep(1)
+        if not self._resolved_event.wait(timeout):
+            raise ConnectionError("Timed out connecting to %s" % self.mac_address)
 
         if isinstance(self._handle, BaseException):
             exc = self._handle
             self._handle = None
             raise exc
 
+    def connect_failed(self, error):
+        gatt.Device.connect_failed(self, error)
+        self._handle = ConnectionError("Failed to connect to %s: %s" % (self.mac_address, error))
+        self._resolved_event.set()
+
     def write(self, data):
-        log.debug("Writing to handle: %s", str2hex(data))
+        if packets.enabled:
+            packets.trace(packets.OUT, "gatt", MOVE_HUB_HARDWARE_HANDLE, data)
         return self._handle.write_value(data)
 
     def enable_notifications(self):
@@ -56,10 +84,12 @@ class CustomDevice(gatt.Device):
         if self._handle is None:
             self.manager.stop()
             self._handle = RuntimeError("Failed to obtain MoveHub handle")
+        self._resolved_event.set()
 
     def characteristic_value_updated(self, characteristic, value):
         value = self._fix_weird_bug(value)
-        log.debug('Notification in GattDevice: %s', str2hex(value))
+        if packets.enabled:
+            packets.trace(packets.IN, "gatt", MOVE_HUB_HARDWARE_HANDLE, value)
         self._notify_callback(MOVE_HUB_HARDWARE_HANDLE, value)
 
     def _fix_weird_bug(self, value):
@@ -75,12 +105,17 @@ class GattConnection(Connection):
     :type _device: CustomDevice
     """
 
-    def __init__(self, bt_iface_name='hci0'):
+    def __init__(self, bt_iface_name='hci0', timeout=TIMEOUT):
+        """
+        :param timeout: seconds to wait for the hub to be found and connected, None to wait forever
+        :raises ConnectionError: from `connect`, when timeout has passed
+        """
         super().__init__()
         self._device = None
         self._iface = bt_iface_name
+        self._timeout = timeout
         try:
-            self._manager = gatt.DeviceManager(adapter_name=self._iface)
+            self._manager = HubDeviceManager(adapter_name=self._iface)
         except TypeError:
             raise NotImplementedError("Gatt is not implemented for this platform")
 
@@ -90,26 +125,49 @@ class GattConnection(Connection):
 
     def connect(self, hub_mac=None, hub_name=None):
         self._manager_thread.start()
-        self._manager.start_discovery()
-
-        while not self._device:
-            log.info("Discovering devices...")
-            devices = self._manager.devices()
-            log.debug("Devices: %s", devices)
 
-            for dev in devices:
-                address = dev.mac_address
-                name = dev.alias()
-                if self._is_device_matched(address, name, hub_mac, hub_name):
-                    self._device = CustomDevice(address, self._manager)
-                    break
+        def _connect_direct(record):
+            device = CustomDevice(record["address"], self._manager)
+            device.connect(DIRECT_CONNECT_TIMEOUT)
+            self._device = device
 
-            if not self._device:
-                sleep(1)
+        if self._connect_cached(hub_mac, hub_name, "gatt", _connect_direct):
+            return self
 
-        self._device.connect()
+        started = time.time()
+        try:
+            address = self._discover(hub_mac, hub_name)
+            self._device = CustomDevice(address, self._manager)
+            remaining = None if self._timeout is None else max(0, self._timeout - (time.time() - started))
+            self._device.connect(remaining)
+        except BaseException:
+            self._manager.stop()
+            raise
+        discovery_cache.remember(hub_mac, hub_name, address, "gatt")
         return self
 
+    def _discover(self, hub_mac, hub_name):
+        manager = self._manager
+        manager.found_event.clear()
+        manager.matcher = lambda address, name: self._is_device_matched(address, name, hub_mac, hub_name)
+        log.info("Discovering devices...")
+        manager.start_discovery()
+        try:
+            for dev in manager.devices():  # already known to BlueZ, won't be reported again
+                manager.device_discovered(dev)
+
+            deadline = None if self._timeout is None else time.time() + self._timeout
+            while not manager.found_event.wait(1 if deadline is None else min(1, max(0, deadline - time.time()))):
+                self._check_cancelled()
+                if deadline is not None and time.time() >= deadline:
+                    raise ConnectionError("Hub was not found in %s seconds, make sure it is on and advertising"
+                                          % self._timeout)
+        finally:
+            manager.matcher = None
+            manager.stop_discovery()
+
+        return manager.found_address
+
     def disconnect(self):
         self._manager.stop()
         self._device.disconnect()
@@ -5,7 +5,8 @@ from threading import Thread
 
 from gattlib import DiscoveryService, GATTRequester
 
-from pylgbst.comms import Connection
+from pylgbst import packets
+from pylgbst.comms import Connection, discovery_cache
 from pylgbst.utilities import queue, str2hex
 
 log = logging.getLogger('comms-gattlib')
@@ -32,7 +33,8 @@ class Requester(GATTRequester):
         self._notify_queue.put((handle, data))
 
     def on_indication(self, handle, data):
-        log.debug("Indication on handle %s: %s", handle, str2hex(data))
+        if packets.enabled:
+            packets.trace(packets.IN, "gattlib", handle, data)
 
     def _dispatch_notifications(self):
         while True:
@@ -62,9 +64,16 @@ class GattLibConnection(Connection):
         self._iface = bt_iface_name
 
     def connect(self, hub_mac=None, hub_name=None):
+        def _connect_direct(record):
+            self.requester = Requester(record["address"], True, self._iface)
+
+        if self._connect_cached(hub_mac, hub_name, "gattlib", _connect_direct):
+            return self
+
         service = DiscoveryService(self._iface)
 
         while not self.requester:
+            self._check_cancelled()
             log.info("Discovering devices using %s...", self._iface)
             devices = service.discover(1)
             log.debug("Devices: %s", devices)
@@ -72,6 +81,7 @@ class GattLibConnection(Connection):
             for address, name in devices.items():
                 if self._is_device_matched(address, name, hub_mac, hub_name):
                     self.requester = Requester(address, True, self._iface)
+                    discovery_cache.remember(hub_mac, hub_name, address, "gattlib")
                     break
 
             if self.requester:
@@ -87,7 +97,8 @@ class GattLibConnection(Connection):
             raise RuntimeError("No requester available")
 
     def write(self, handle, data):
-        log.debug("Writing to %s: %s", handle, str2hex(data))
+        if packets.enabled:
+            packets.trace(packets.OUT, "gattlib", handle, data)
         return self.requester.write_by_handle(handle, data)
 
     def is_alive(self):
@@ -2,8 +2,8 @@ import logging
 
 import pygatt
 
-from pylgbst.comms import Connection, MOVE_HUB_HW_UUID_CHAR
-from pylgbst.utilities import str2hex
+from pylgbst import packets
+from pylgbst.comms import Connection, MOVE_HUB_HW_UUID_CHAR, discovery_cache
 
 log = logging.getLogger('comms-pygatt')
 
@@ -15,6 +15,8 @@ class GattoolConnection(Connection):
     :type _conn_hnd: pygatt.backends.bgapi.device.BGAPIBLEDevice
     """
 
+    BACKEND_NAME = "gatttool"
+
     def __init__(self, controller='hci0'):
         Connection.__init__(self)
         self.backend = lambda: pygatt.GATTToolBackend(hci_device=controller)
@@ -25,7 +27,14 @@ class GattoolConnection(Connection):
         adapter = self.backend()
         adapter.start()  # enable or disable restart? What's the best?
 
+        def _connect_direct(record):
+            self._conn_hnd = adapter.connect(record["address"])
+
+        if self._connect_cached(hub_mac, hub_name, self.BACKEND_NAME, _connect_direct):
+            return self
+
         while not self._conn_hnd:
+            self._check_cancelled()
             log.info("Discovering devices...")
             devices = adapter.scan(1)
             log.debug("Devices: %s", devices)
@@ -36,6 +45,7 @@ class GattoolConnection(Connection):
                 name = dev['name']
                 if self._is_device_matched(address, name, hub_mac, hub_name):
                     self._conn_hnd = adapter.connect(address)
+                    discovery_cache.remember(hub_mac, hub_name, address, self.BACKEND_NAME)
                     break
 
             if self._conn_hnd:
@@ -47,7 +57,8 @@ class GattoolConnection(Connection):
         self._conn_hnd.disconnect()
 
     def write(self, handle, data):
-        log.debug("Writing to handle %s: %s", handle, str2hex(data))
+        if packets.enabled:
+            packets.trace(packets.OUT, self.BACKEND_NAME, handle, data)
         return self._conn_hnd.char_write_handle(handle, bytearray(data))
 
     def set_notify_handler(self, handler):
@@ -58,6 +69,8 @@ class GattoolConnection(Connection):
 
 
 class BlueGigaConnection(GattoolConnection):
+    BACKEND_NAME = "bluegiga"
+
     def __init__(self):
         super().__init__()
         self.backend = lambda: pygatt.BGAPIBackend()
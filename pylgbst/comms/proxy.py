@@ -0,0 +1,420 @@
+"""
+Proxy that holds BLE connections to hubs and shares them with many local clients over TCP.
+
+Each frame is a fixed header followed by payload::
+
+    <uint16 payload length> <uint8 frame type> <uint8 hub index> <uint16 handle> <payload>
+
+All integers are little-endian. Clients receive notifications only for hubs they have subscribed to,
+optionally filtered by LWP message type. Writes from all clients to the same hub are serialized.
+FRAME_WRITE is acknowledged with empty FRAME_WRITE once the hub-side write is done, or with FRAME_ERROR
+that has the failed frame type in its handle field. A client too slow to take its frames is disconnected.
+Hub announces its attached devices only once, so server keeps the last attach message per port
+and replays them to every new subscriber.
+"""
+import logging
+import socket
+import struct
+import traceback
+from threading import Thread, Lock
+
+from pylgbst.comms import Connection
+from pylgbst.messages import MsgHubAttachedIO
+from pylgbst.utilities import queue
+
+log = logging.getLogger('comms-proxy')
+
+FRAME_HEADER = struct.Struct("<HBBH")
+
+FRAME_WRITE = 0x01
+FRAME_WRITE_NO_RESPONSE = 0x02
+FRAME_NOTIFY = 0x03
+FRAME_SUBSCRIBE = 0x04  # payload is list of message types to receive, empty for all
+FRAME_UNSUBSCRIBE = 0x05
+FRAME_LIST_HUBS = 0x06  # reply payload is newline-separated hub names, in hub index order
+FRAME_ERROR = 0x07  # payload is utf-8 error text, handle is the type of failed frame
+
+DEFAULT_PORT = 9090
+CLIENT_QUEUE_SIZE = 1024
+MAX_BATCH = 64
+HANDSHAKE_TIMEOUT = 10
+WRITE_TIMEOUT = 10
+
+
+def pack_frame(frame_type, hub=0, handle=0, payload=b""):
+    return FRAME_HEADER.pack(len(payload), frame_type, hub, handle) + bytes(payload)
+
+
+def _recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+    return data
+
+
+def read_frame(sock):
+    """
+    :return: tuple of frame type, hub index, handle, payload
+    """
+    length, frame_type, hub, handle = FRAME_HEADER.unpack(_recv_exact(sock, FRAME_HEADER.size))
+    payload = _recv_exact(sock, length) if length else b""
+    return frame_type, hub, handle, payload
+
+
+class _ProxyClient:
+    """Server side of one client socket, outgoing frames are queued and sent in batches by own thread"""
+
+    def __init__(self, server, sock, address):
+        self.server = server
+        self.sock = sock
+        self.address = address
+        self.filters = {}  # hub index => set of message types, empty set means all
+        self._outgoing = queue.Queue(CLIENT_QUEUE_SIZE)
+        self._closed = False
+
+        self._reader = Thread(target=self._read_loop)
+        self._reader.daemon = True
+        self._reader.name = "Proxy client reader %s:%s" % address[:2]
+        self._writer = Thread(target=self._write_loop)
+        self._writer.daemon = True
+        self._writer.name = "Proxy client writer %s:%s" % address[:2]
+
+    def start(self):
+        self._reader.start()
+        self._writer.start()
+
+    def wants(self, hub, data):
+        types = self.filters.get(hub)
+        if types is None:
+            return False
+        return not types or (len(data) > 2 and data[2] in types)
+
+    def send(self, frame):
+        try:
+            self._outgoing.put_nowait(frame)
+        except queue.Full:
+            # dropping frames could lose replies the client waits for, better to fail it loudly
+            log.warning("Client %s is too slow to take its frames, disconnecting it", self.address)
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.server._remove_client(self)
+        try:
+            self._outgoing.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _write_loop(self):
+        while not self._closed:
+            frame = self._outgoing.get()
+            if frame is None:
+                break
+
+            batch = [frame]
+            while len(batch) < MAX_BATCH:
+                try:
+                    frame = self._outgoing.get_nowait()
+                except queue.Empty:
+                    break
+                if frame is None:
+                    break
+                batch.append(frame)
+
+            try:
+                self.sock.sendall(b"".join(batch))
+            except OSError:
+                log.debug("Failed to send to client %s: %s", self.address, traceback.format_exc())
+                break
+        self.close()
+
+    def _read_loop(self):
+        try:
+            while True:
+                frame_type, hub, handle, payload = read_frame(self.sock)
+                try:
+                    self._handle_frame(frame_type, hub, handle, payload)
+                except (ValueError, IndexError, OSError) as exc:
+                    # OSError here comes from the hub side write, client socket is only read above
+                    log.debug("Failed to handle frame from %s: %s", self.address, traceback.format_exc())
+                    error = str(exc) or exc.__class__.__name__
+                    self.send(pack_frame(FRAME_ERROR, hub, frame_type, error.encode("utf-8")))
+        except (ConnectionError, OSError):
+            log.debug("Client %s disconnected", self.address)
+        finally:
+            self.close()
+
+    def _handle_frame(self, frame_type, hub, handle, payload):
+        if frame_type == FRAME_WRITE:
+            self.server.write(hub, handle, payload, True)
+            self.send(pack_frame(FRAME_WRITE, hub, handle))
+        elif frame_type == FRAME_WRITE_NO_RESPONSE:
+            self.server.write(hub, handle, payload, False)
+        elif frame_type == FRAME_SUBSCRIBE:
+            self.server.subscribe(self, hub, set(payload))
+        elif frame_type == FRAME_UNSUBSCRIBE:
+            self.filters.pop(hub, None)
+        elif frame_type == FRAME_LIST_HUBS:
+            names = "\n".join(self.server.hub_names()).encode("utf-8")
+            self.send(pack_frame(FRAME_LIST_HUBS, 0, 0, names))
+        else:
+            raise ValueError("Unknown frame type: 0x%x" % frame_type)
+
+
+class ProxyServer:
+    """
+    Holds connections to many hubs and serves many clients at once, replaces deprecated DebugServer.
+    Usage::
+
+        server = ProxyServer()
+        server.add_hub("LEGO Move Hub", get_connection_auto(hub_name="LEGO Move Hub"))
+        server.start()
+
+    Then in other processes use ``ProxyConnection(hub="LEGO Move Hub").connect()`` in place of BLE connection.
+    """
+
+    def __init__(self, host="localhost", port=DEFAULT_PORT):
+        self._hubs = []  # list of (name, connection, write lock)
+        self._clients = []
+        self._clients_lock = Lock()
+        self._attached = {}  # hub index => port => (handle, last attach/detach message)
+        self._fan_out_lock = Lock()  # keeps replayed attach messages ordered with live ones
+        self._running = False
+
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.port = self.sock.getsockname()[1]
+        self.sock.listen(16)
+
+    def add_hub(self, name, connection):
+        """
+        Take over the connection: proxy becomes its notification handler and enables notifications
+
+        :type connection: Connection
+        :return: hub index used in frames
+        """
+        index = len(self._hubs)
+        self._hubs.append((name, connection, Lock()))
+        connection.set_notify_handler(lambda handle, data: self._fan_out(index, handle, data))
+        connection.enable_notifications()
+        return index
+
+    def hub_names(self):
+        return [name for name, _, _ in self._hubs]
+
+    def get_hub(self, index):
+        if index >= len(self._hubs):
+            raise ValueError("Unknown hub index: %s" % index)
+        return self._hubs[index]
+
+    def write(self, index, handle, data, response=True):
+        _, connection, lock = self.get_hub(index)
+        with lock:
+            if response:
+                connection.write(handle, data)
+            else:
+                connection.write_without_response(handle, data)
+
+    def subscribe(self, client, index, msg_types):
+        """Set client's filter for the hub and send it the devices attached so far"""
+        self.get_hub(index)  # validate
+        with self._fan_out_lock:
+            client.filters[index] = msg_types
+            for handle, data in self._attached.get(index, {}).values():
+                if client.wants(index, data):
+                    client.send(pack_frame(FRAME_NOTIFY, index, handle, data))
+
+    def _fan_out(self, index, handle, data):
+        frame = None
+        with self._clients_lock:
+            clients = list(self._clients)
+
+        with self._fan_out_lock:
+            if len(data) > 3 and data[2] == MsgHubAttachedIO.TYPE:
+                self._attached.setdefault(index, {})[data[3]] = (handle, bytes(data))
+
+            for client in clients:
+                if client.wants(index, data):
+                    if frame is None:
+                        frame = pack_frame(FRAME_NOTIFY, index, handle, data)
+                    client.send(frame)
+
+    def _remove_client(self, client):
+        with self._clients_lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def start(self):
+        """Accept clients until `stop` is called, blocks"""
+        self._running = True
+        log.info("Accepting proxy connections at %s", self.port)
+        while self._running:
+            try:
+                sock, address = self.sock.accept()
+            except OSError:
+                if self._running:
+                    raise
+                break
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = _ProxyClient(self, sock, address)
+            with self._clients_lock:
+                self._clients.append(client)
+            log.info("Proxy client connected: %s:%s", address[0], address[1])
+            client.start()
+
+    def stop(self):
+        self._running = False
+        self.sock.close()
+        with self._clients_lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+
+    def disconnect(self):
+        """Stop serving and disconnect from all hubs"""
+        self.stop()
+        for _, connection, _ in self._hubs:
+            connection.disconnect()
+
+
+class ProxyConnection(Connection):
+    """
+    Connection to a hub held by `ProxyServer`
+
+    :param hub: hub name or index on the server
+    :param msg_types: LWP message types to receive, None for all
+    """
+
+    def __init__(self, hub=0, host="localhost", port=DEFAULT_PORT, msg_types=None):
+        super().__init__()
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self.msg_types = msg_types
+        self._index = None
+        self._handler = None
+        self._sock = None
+        self._send_lock = Lock()
+        self._write_lock = Lock()  # one write waits for its acknowledgement at a time
+        self._replies = queue.Queue()
+        self._acks = queue.Queue()  # None for done write, error text for failed one
+        self._notifications = queue.Queue()  # handler runs in own thread, it may write and wait for ack
+        self._reader = None
+        self._dispatcher = None
+
+    def connect(self, hub_mac=None, hub_name=None):
+        self._sock = socket.create_connection((self.host, self.port))
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self._reader = Thread(target=self._recv)
+        self._reader.daemon = True
+        self._reader.name = "Proxy connection reader"
+        self._reader.start()
+        self._dispatcher = Thread(target=self._dispatch)
+        self._dispatcher.daemon = True
+        self._dispatcher.name = "Proxy connection dispatcher"
+        self._dispatcher.start()
+
+        name = hub_name or self.hub
+        if isinstance(name, int):
+            self._index = name
+        else:
+            self._send(pack_frame(FRAME_LIST_HUBS))
+            try:
+                names = self._replies.get(timeout=HANDSHAKE_TIMEOUT)
+            except queue.Empty:
+                self.disconnect()
+                raise ConnectionError("Proxy at %s:%s has not listed its hubs in %s seconds"
+                                      % (self.host, self.port, HANDSHAKE_TIMEOUT))
+            if name not in names:
+                self.disconnect()
+                raise ConnectionError("Proxy has no hub named %r, it has: %s" % (name, names))
+            self._index = names.index(name)
+        return self
+
+    def _send(self, frame):
+        with self._send_lock:
+            self._sock.sendall(frame)
+
+    def _recv(self):
+        try:
+            while True:
+                frame_type, hub, handle, payload = read_frame(self._sock)
+                if frame_type == FRAME_NOTIFY:
+                    self._notifications.put((handle, payload))
+                elif frame_type == FRAME_LIST_HUBS:
+                    self._replies.put(payload.decode("utf-8").split("\n") if payload else [])
+                elif frame_type == FRAME_WRITE:
+                    self._acks.put(None)
+                elif frame_type == FRAME_ERROR and handle == FRAME_WRITE:
+                    self._acks.put(payload.decode("utf-8"))
+                elif frame_type == FRAME_ERROR:
+                    log.error("Proxy error: %s", payload.decode("utf-8"))
+                else:
+                    log.warning("Dropped frame of unknown type 0x%x", frame_type)
+        except (ConnectionError, OSError):
+            log.info("Proxy connection closed")
+        self._acks.put("Proxy connection is closed")  # release a writer waiting for acknowledgement
+        self._notifications.put(None)
+
+    def _dispatch(self):
+        while True:
+            item = self._notifications.get()
+            if item is None:
+                break
+            if self._handler:
+                try:
+                    self._handler(*item)
+                except BaseException:
+                    log.error("Failed to notify handler: %s", traceback.format_exc())
+
+    def write(self, handle, data):
+        """
+        Wait until proxy has written data to the hub
+
+        :raises ConnectionError: when hub-side write fails or proxy doesn't confirm it in time
+        """
+        with self._write_lock:
+            self._send(pack_frame(FRAME_WRITE, self._index, handle, data))
+            try:
+                error = self._acks.get(timeout=WRITE_TIMEOUT)
+            except queue.Empty:
+                self.disconnect()  # late acknowledgement would be taken by the next write
+                raise ConnectionError("Proxy has not confirmed write in %s seconds" % WRITE_TIMEOUT)
+        if error is not None:
+            raise ConnectionError("Proxy failed to write to hub: %s" % error)
+
+    def write_without_response(self, handle, data):
+        self._send(pack_frame(FRAME_WRITE_NO_RESPONSE, self._index, handle, data))
+
+    def set_notify_handler(self, handler):
+        self._handler = handler
+
+    def enable_notifications(self):
+        """Server has notifications enabled already, just subscribe to them"""
+        self._send(pack_frame(FRAME_SUBSCRIBE, self._index, 0, bytes(self.msg_types or ())))
+
+    def disconnect(self):
+        if self._sock:
+            try:
+                if self._index is not None:
+                    self._send(pack_frame(FRAME_UNSUBSCRIBE, self._index))
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+
+    def is_alive(self):
+        return self._reader is not None and self._reader.is_alive()
@@ -0,0 +1,266 @@
+"""
+Recording of connection traffic into compact binary trace, and replaying it back.
+
+Trace file is append-only, a header followed by records::
+
+    header: <8s magic> <uint32 version> <double wall clock time of start>
+    record: <double seconds since start> <uint8 direction> <uint16 handle> <uint16 length> <data>
+
+Next to it, ``<trace>.idx`` holds sparse time index: pairs of <double seconds> <uint64 offset>, appended every
+`INDEX_INTERVAL` records. Both files are memory-mapped for reading, so seeking in multi-hour trace doesn't load it whole.
+"""
+import bisect
+import logging
+import mmap
+import os
+import struct
+import time
+from threading import Thread, Lock, Event, current_thread
+
+from pylgbst.comms import Connection
+
+log = logging.getLogger('comms-recorder')
+
+MAGIC = b"PYLGBSTT"
+VERSION = 1
+HEADER = struct.Struct("<8sId")
+RECORD = struct.Struct("<dBHH")
+INDEX_ENTRY = struct.Struct("<dQ")
+INDEX_INTERVAL = 256
+
+DIR_WRITE = 0
+DIR_WRITE_NO_RESPONSE = 1
+DIR_NOTIFY = 2
+
+
+class TraceWriter:
+    """Appends records to trace file, thread-safe. Records appended after `close` are ignored"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._closed = False
+        self._file = open(path, "wb")
+        self._index = open(path + ".idx", "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self._file.flush()  # so readers never see a file without header
+        self._start = time.monotonic()
+        self._offset = HEADER.size
+        self._count = 0
+
+    def append(self, direction, handle, data):
+        data = bytes(data)
+        with self._lock:
+            if self._closed:
+                log.debug("Trace is closed, not recording %s bytes", len(data))
+                return
+            timestamp = time.monotonic() - self._start
+            if self._count % INDEX_INTERVAL == 0:
+                self._file.flush()  # index must never point past the data
+                self._index.write(INDEX_ENTRY.pack(timestamp, self._offset))
+                self._index.flush()
+
+            self._file.write(RECORD.pack(timestamp, direction, handle, len(data)) + data)
+            self._offset += RECORD.size + len(data)
+            self._count += 1
+
+    def flush(self):
+        with self._lock:
+            if not self._closed:
+                self._file.flush()
+                self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._file.close()
+            self._index.close()
+
+
+class RecordingConnection(Connection):
+    """
+    Delegates to the wrapped connection, recording writes and notifications into trace file. Usage::
+
+        hub = MoveHub(RecordingConnection(get_connection_auto(), "session.trace"))
+
+    :type connection: Connection
+    """
+
+    def __init__(self, connection, path):
+        super().__init__()
+        self.connection = connection
+        self.writer = TraceWriter(path)
+
+    def set_notify_handler(self, handler):
+        def _record(handle, data):
+            self.writer.append(DIR_NOTIFY, handle, data)
+            handler(handle, data)
+
+        self.connection.set_notify_handler(_record)
+
+    def enable_notifications(self):
+        self.connection.enable_notifications()
+
+    def write(self, handle, data):
+        self.writer.append(DIR_WRITE, handle, data)
+        self.connection.write(handle, data)
+
+    def write_without_response(self, handle, data):
+        self.writer.append(DIR_WRITE_NO_RESPONSE, handle, data)
+        self.connection.write_without_response(handle, data)
+
+    def disconnect(self):
+        self.connection.disconnect()
+        self.writer.close()
+
+    def is_alive(self):
+        return self.connection.is_alive()
+
+
+class TraceReader:
+    """Memory-mapped read access to trace, possibly still being written. Trace without header reads as empty"""
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.getsize(path) < HEADER.size:
+            log.debug("Trace %s has no header yet, it's empty", path)
+            self._map = b""  # mmap can't map empty file
+            self.started = None
+            self._index_times, self._index_offsets = [], []
+            return
+
+        with open(path, "rb") as fhd:
+            self._map = mmap.mmap(fhd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.started = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("File %s is not a trace" % path)
+
+        self._index_times, self._index_offsets = self._load_index()
+
+    def _load_index(self):
+        times, offsets = [], []
+        path = self.path + ".idx"
+        if os.path.exists(path) and os.path.getsize(path) >= INDEX_ENTRY.size:
+            with open(path, "rb") as fhd:
+                index = mmap.mmap(fhd.fileno(), 0, access=mmap.ACCESS_READ)
+            count = len(index) // INDEX_ENTRY.size
+            for timestamp, offset in INDEX_ENTRY.iter_unpack(index[:count * INDEX_ENTRY.size]):
+                if offset < len(self._map):
+                    times.append(timestamp)
+                    offsets.append(offset)
+            index.close()
+        else:
+            log.debug("No index for %s, will scan from start", self.path)
+        return times, offsets
+
+    def _offset_for(self, start):
+        """Offset of last indexed record that is not later than `start`"""
+        pos = bisect.bisect_right(self._index_times, start) - 1
+        return self._index_offsets[pos] if pos >= 0 else HEADER.size
+
+    def records(self, start=0.0):
+        """
+        Yield records as tuples of (seconds since start, direction, handle, data), from given time on
+        """
+        buf = self._map
+        offset = self._offset_for(start)
+        while offset + RECORD.size <= len(buf):
+            timestamp, direction, handle, length = RECORD.unpack_from(buf, offset)
+            end = offset + RECORD.size + length
+            if end > len(buf):
+                break  # record being written
+
+            if timestamp >= start:
+                yield timestamp, direction, handle, buf[offset + RECORD.size:end]
+            offset = end
+
+    @property
+    def duration(self):
+        last = self._index_times[-1] if self._index_times else 0.0
+        for timestamp, _, _, _ in self.records(last):
+            last = timestamp
+        return last
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+
+class ReplayConnection(Connection):
+    """
+    Plays recorded notifications back to notification handler, writes are ignored.
+
+    :param speed: 1.0 for original pace, 2.0 for twice faster etc, None for as fast as possible
+    :param start: seconds since trace start to begin replay from
+    """
+
+    def __init__(self, path, speed=1.0, start=0.0):
+        super().__init__()
+        self.speed = speed
+        self.start = start
+        self.finished = Event()
+        self._reader = TraceReader(path)
+        self._handler = None
+        self._running = False
+        self._stop = Event()  # wakes replay waiting for next record on disconnect
+        self._thread = None
+
+    def connect(self, hub_mac=None, hub_name=None):
+        return self
+
+    def set_notify_handler(self, handler):
+        self._handler = handler
+
+    def enable_notifications(self):
+        if self._thread:
+            return
+
+        self._running = True
+        self._stop.clear()
+        self._thread = Thread(target=self._replay)
+        self._thread.daemon = True
+        self._thread.name = "Trace replay"
+        self._thread.start()
+
+    def seek(self, start):
+        """Restart replay from given time"""
+        self.disconnect()
+        self._reader = TraceReader(self._reader.path)
+        self.start = start
+        self.finished.clear()
+        self._thread = None
+        self.enable_notifications()
+
+    def _replay(self):
+        began = time.monotonic()
+        for timestamp, direction, handle, data in self._reader.records(self.start):
+            if self._stop.is_set():
+                return
+            if direction != DIR_NOTIFY:
+                continue
+
+            if self.speed:
+                delay = (timestamp - self.start) / self.speed - (time.monotonic() - began)
+                if delay > 0 and self._stop.wait(delay):
+                    return
+
+            if self._handler:
+                try:
+                    self._handler(handle, bytes(data))
+                except Exception:
+                    log.exception("Failed to handle replayed notification")
+        self.finished.set()
+
+    def write(self, handle, data):
+        log.debug("Replay ignores write to handle 0x%x", handle)
+
+    def disconnect(self):
+        self._running = False
+        self._stop.set()
+        if self._thread and self._thread.is_alive() and self._thread is not current_thread():
+            self._thread.join()
+        self._reader.close()
+
+    def is_alive(self):
+        return self._running and not self.finished.is_set()
@@ -0,0 +1,264 @@
+"""
+Shared-memory transport: one process owns BLE link and publishes raw notifications into a ring buffer,
+any number of local processes read them with their own cursors, without sockets or serialization.
+
+Buffer layout is a header followed by fixed-size slots::
+
+    header: <8s magic> <uint32 version> <uint32 slot size> <uint32 slot count> <uint32 pad> <uint64 records written>
+    slot:   <uint64 record number + 1> <double timestamp> <uint8 hub> <uint16 handle> <uint16 length> <data>
+
+Slot's record number is zeroed before the slot is rewritten and set after, so readers detect
+both unfinished and overwritten slots.
+"""
+import logging
+import struct
+import time
+from threading import Lock, Thread
+from multiprocessing import shared_memory, resource_tracker
+
+from pylgbst.comms import Connection
+
+log = logging.getLogger('comms-shared')
+
+MAGIC = b"PYLGBST1"
+VERSION = 1
+HEADER = struct.Struct("<8sIIII")
+WRITTEN = struct.Struct("<Q")
+WRITTEN_OFFSET = HEADER.size
+SLOTS_OFFSET = 64
+SLOT_HEADER = struct.Struct("<QdBHH")
+
+POLL_INTERVAL_MIN = 0.0005
+POLL_INTERVAL_MAX = 0.01
+
+_published = set()  # names of buffers created by this process
+
+
+class SharedMemoryPublisher:
+    """
+    Owner side, creates the buffer. Usage::
+
+        publisher = SharedMemoryPublisher("pylgbst-hubs")
+        hub = MoveHub(publisher.wrap(get_connection_auto(), hub=0))
+
+    :param slot_size: max notification size plus `SLOT_HEADER.size` bytes of slot header
+    """
+
+    def __init__(self, name=None, slot_count=4096, slot_size=64):
+        assert slot_size > SLOT_HEADER.size
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self._max_data = slot_size - SLOT_HEADER.size
+        self._written = 0
+        self._lock = Lock()  # connections wrapped for several hubs publish from their own threads
+        self._shm = shared_memory.SharedMemory(name, create=True, size=SLOTS_OFFSET + slot_count * slot_size)
+        self.name = self._shm.name
+        _published.add(self.name)
+        buf = self._shm.buf
+        buf[:SLOTS_OFFSET] = bytes(SLOTS_OFFSET)
+        HEADER.pack_into(buf, 0, MAGIC, VERSION, slot_size, slot_count, 0)
+
+    def publish(self, hub, handle, data, timestamp=None):
+        """Safe to call from several threads"""
+        if len(data) > self._max_data:
+            log.warning("Notification of %s bytes doesn't fit into slot, truncated", len(data))
+            data = data[:self._max_data]
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        buf = self._shm.buf
+        with self._lock:
+            record = self._written
+            offset = SLOTS_OFFSET + (record % self.slot_count) * self.slot_size
+            WRITTEN.pack_into(buf, offset, 0)  # slot is being rewritten
+            SLOT_HEADER.pack_into(buf, offset, 0, timestamp, hub, handle, len(data))
+            start = offset + SLOT_HEADER.size
+            buf[start:start + len(data)] = data
+            WRITTEN.pack_into(buf, offset, record + 1)
+
+            self._written = record + 1
+            WRITTEN.pack_into(buf, WRITTEN_OFFSET, self._written)
+
+    def wrap(self, connection, hub=0):
+        """
+        Return connection that publishes every notification before passing it on
+
+        :type connection: Connection
+        """
+        return PublishingConnection(connection, self, hub)
+
+    def close(self):
+        _published.discard(self.name)
+        self._shm.close()
+        self._shm.unlink()
+
+
+class PublishingConnection(Connection):
+    """Delegates to the wrapped connection, publishing notifications to `SharedMemoryPublisher`"""
+
+    def __init__(self, connection, publisher, hub=0):
+        super().__init__()
+        self.connection = connection
+        self.publisher = publisher
+        self.hub = hub
+
+    def set_notify_handler(self, handler):
+        def _publish(handle, data):
+            self.publisher.publish(self.hub, handle, data)
+            handler(handle, data)
+
+        self.connection.set_notify_handler(_publish)
+
+    def enable_notifications(self):
+        self.connection.enable_notifications()
+
+    def write(self, handle, data):
+        self.connection.write(handle, data)
+
+    def write_without_response(self, handle, data):
+        self.connection.write_without_response(handle, data)
+
+    def disconnect(self):
+        self.connection.disconnect()
+
+    def is_alive(self):
+        return self.connection.is_alive()
+
+
+class SharedMemoryReader:
+    """
+    Consumer side cursor over the buffer, yields raw records and leaves decoding to the caller.
+
+    :param from_start: start from the oldest record still in buffer, instead of only new ones
+    """
+
+    def __init__(self, name, from_start=False):
+        self._shm = _attach(name)
+        magic, version, self.slot_size, self.slot_count, _ = HEADER.unpack_from(self._shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Shared memory %s is not a notification buffer" % name)
+
+        written = self._written()
+        self.cursor = max(0, written - self.slot_count) if from_start else written
+        self.lost = 0  # records overwritten before we've read them
+
+    def _written(self):
+        return WRITTEN.unpack_from(self._shm.buf, WRITTEN_OFFSET)[0]
+
+    def read(self):
+        """
+        Return next record as tuple of (timestamp, hub, handle, data), None if there are no new records
+        """
+        buf = self._shm.buf
+        while True:
+            written = self._written()
+            if self.cursor >= written:
+                return None
+
+            if written - self.cursor > self.slot_count:
+                self._skip_to(written - self.slot_count)
+                continue
+
+            record = self.cursor
+            offset = SLOTS_OFFSET + (record % self.slot_count) * self.slot_size
+            seq, timestamp, hub, handle, length = SLOT_HEADER.unpack_from(buf, offset)
+            start = offset + SLOT_HEADER.size
+            data = bytes(buf[start:start + length])
+            if seq == record + 1 and WRITTEN.unpack_from(buf, offset)[0] == seq:
+                self.cursor += 1
+                return timestamp, hub, handle, data
+
+            # writer has lapped us while we were reading this slot
+            self._skip_to(max(record + 1, self._written() - self.slot_count + 1))
+
+    def _skip_to(self, record):
+        self.lost += record - self.cursor
+        log.debug("Reader is too slow, skipping %s records", record - self.cursor)
+        self.cursor = record
+
+    def __iter__(self):
+        while True:
+            record = self.read()
+            if record is None:
+                return
+            yield record
+
+    def close(self):
+        self._shm.close()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:  # before Python 3.13, consumer would destroy the buffer on exit
+        shm = shared_memory.SharedMemory(name)
+        if name in _published:
+            return shm  # it's our own buffer, registered once by the publisher
+
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            log.debug("Failed to unregister shared memory from tracker")
+        return shm
+
+
+class SharedMemoryConnection(Connection):
+    """
+    Read-only connection for consumer processes, delivers notifications of one hub from shared memory.
+    Commands can't be sent through it, only sensor data and other notifications received.
+    """
+
+    def __init__(self, name, hub=0, from_start=False):
+        super().__init__()
+        self.hub = hub
+        self._reader = SharedMemoryReader(name, from_start)
+        self._handler = None
+        self._running = False
+        self._thread = None
+
+    def connect(self, hub_mac=None):
+        return self
+
+    def set_notify_handler(self, handler):
+        self._handler = handler
+
+    def enable_notifications(self):
+        if self._thread:
+            return
+
+        self._running = True
+        self._thread = Thread(target=self._poll)
+        self._thread.daemon = True
+        self._thread.name = "Shared memory reader"
+        self._thread.start()
+
+    def _poll(self):
+        interval = POLL_INTERVAL_MIN
+        while self._running:
+            got_any = False
+            for _, hub, handle, data in self._reader:
+                got_any = True
+                if hub == self.hub and self._handler:
+                    try:
+                        self._handler(handle, data)
+                    except Exception:
+                        log.exception("Failed to handle notification")
+
+            interval = POLL_INTERVAL_MIN if got_any else min(interval * 2, POLL_INTERVAL_MAX)
+            time.sleep(interval)
+
+    @property
+    def lost(self):
+        return self._reader.lost
+
+    def write(self, handle, data):
+        raise RuntimeError("Shared memory connection is read-only")
+
+    def disconnect(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+        self._reader.close()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
@@ -0,0 +1,378 @@
+"""
+Host-side closed-loop control on top of peripheral subscriptions.
+
+A :class:`ControlLoop` ticks at fixed rate, takes the latest sample of every input, runs a controller
+and writes resulting values to outputs. Outputs have latest-wins semantics: while a command is being sent,
+newer values replace the pending one instead of queuing behind it.
+"""
+import logging
+import math
+import threading
+import time
+import traceback
+
+from pylgbst.utilities import Histogram
+
+log = logging.getLogger('control')
+
+
+class PID:
+    """
+    Classic PID controller with output clamping and integral anti-windup
+    """
+
+    def __init__(self, kp, ki=0.0, kd=0.0, setpoint=0.0, output_limits=(-1.0, 1.0)):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.setpoint = setpoint
+        self.output_limits = output_limits
+
+        self._integral = 0.0
+        self._last_error = None
+
+    def reset(self):
+        self._integral = 0.0
+        self._last_error = None
+
+    def _clamp(self, value):
+        low, high = self.output_limits
+        if low is not None and value < low:
+            return low
+        if high is not None and value > high:
+            return high
+        return value
+
+    def update(self, measurement, dt):
+        """
+        :param measurement: current process value
+        :param dt: seconds passed since previous update
+        :return: clamped controller output
+        """
+        error = self.setpoint - measurement
+
+        derivative = 0.0
+        if self._last_error is not None and dt > 0:
+            derivative = (error - self._last_error) / dt
+        self._last_error = error
+
+        integral = self._integral + error * dt
+        output = self.kp * error + self.ki * integral + self.kd * derivative
+        clamped = self._clamp(output)
+        if clamped == output or (clamped - output) * error > 0:
+            # only accumulate while not saturated, or when error pulls output back into range
+            self._integral = integral
+
+        return clamped
+
+
+class SensorInput:
+    """
+    Keeps the latest sample of subscribed peripheral, together with the moment it has arrived
+    """
+
+    def __init__(self, peripheral, mode=None, granularity=1):
+        """
+        :type peripheral: pylgbst.peripherals.Peripheral
+        """
+        self.peripheral = peripheral
+        self.mode = mode
+        self.granularity = granularity
+        self.latest = None  # tuple of (timestamp, values), replaced atomically
+
+    def _on_data(self, *values):
+        self.latest = (time.monotonic(), values)
+
+    def start(self):
+        if self.mode is None:
+            self.peripheral.subscribe(self._on_data, granularity=self.granularity)
+        else:
+            self.peripheral.subscribe(self._on_data, self.mode, self.granularity)
+
+    def stop(self):
+        self.peripheral.unsubscribe(self._on_data)
+
+
+class ActuatorOutput:
+    """
+    Writes values to peripheral using its method like ``start_power`` or ``start_speed``.
+    Only the freshest value is written, stale ones are replaced while a write is in flight.
+    Subclasses change what a write is by overriding `_write`.
+    """
+
+    THREAD_NAME = "Actuator writer: %s"
+
+    def __init__(self, peripheral, method="start_power", on_written=None):
+        """
+        :type peripheral: pylgbst.peripherals.Peripheral
+        :param on_written: callable(sample_timestamp), invoked after each completed write
+        """
+        self.peripheral = peripheral
+        self.method = method
+        self.on_written = on_written
+
+        self._pending = None
+        self._in_flight = False
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.written = 0
+        self.replaced = 0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._writer)
+        self._thread.daemon = True
+        self._thread.name = self.THREAD_NAME % self.peripheral
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the writer thread, pending value is dropped and in-flight write is waited for"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def put(self, value, sample_timestamp=None):
+        with self._cond:
+            if self._pending is not None:
+                log.debug("Replacing pending value %r with %r", self._pending[0], value)
+                self.replaced += 1
+            self._pending = (value, sample_timestamp)
+            self._cond.notify_all()
+
+    def is_busy(self):
+        return self._pending is not None or self._in_flight
+
+    def flush(self):
+        """Wait until pending and in-flight values are written"""
+        with self._cond:
+            while self._running and (self._pending is not None or self._in_flight):
+                self._cond.wait()
+
+    def _write(self, value):
+        func = getattr(self.peripheral, self.method)
+        if isinstance(value, (tuple, list)):
+            func(*value)
+        else:
+            func(value)
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while self._running and self._pending is None:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                value, sample_timestamp = self._pending
+                self._pending = None
+                self._in_flight = True
+
+            try:
+                self._write(value)
+                self.written += 1
+            except BaseException:
+                log.warning("Failed to write %r to %s: %s", value, self.peripheral, traceback.format_exc())
+                continue
+            finally:
+                with self._cond:
+                    self._in_flight = False
+                    self._cond.notify_all()
+
+            if self.on_written:
+                self.on_written(sample_timestamp)
+
+
+class OutputChannel(ActuatorOutput):
+    """
+    Sends port output commands one by one, with latest-wins semantics:
+    while a command is in flight, newer command replaces the pending one instead of queuing behind it,
+    so only the freshest value goes over the link.
+    """
+
+    THREAD_NAME = "Output channel: %s"
+
+    def __init__(self, peripheral):
+        """
+        :type peripheral: pylgbst.peripherals.Peripheral
+        """
+        super().__init__(peripheral, method=None)
+        self.start()
+
+    def put(self, msg, state=None):
+        super().put((msg, state))
+
+    def _write(self, value):
+        msg, state = value
+        self.peripheral._deliver_output(msg, state)
+
+
+class LoopStats:
+    """
+    Timing metrics of control loop: period jitter, missed deadlines and sensor-to-actuator latency
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.ticks = 0
+        self.missed_deadlines = 0
+        self.jitter = Histogram()  # absolute deviation of actual period from nominal one
+        self.latency = Histogram()  # from sample arrival to completed actuator write
+        self._jitter_sq_sum = 0.0
+        self._lock = threading.Lock()
+
+    def add_tick(self):
+        with self._lock:
+            self.ticks += 1
+
+    def add_missed(self, count):
+        with self._lock:
+            self.missed_deadlines += count
+
+    def add_period(self, actual):
+        deviation = abs(actual - self.period)
+        with self._lock:
+            self.jitter.add(deviation)
+            self._jitter_sq_sum += deviation * deviation
+
+    def add_latency(self, value):
+        with self._lock:
+            self.latency.add(value)
+
+    def jitter_rms(self):
+        return math.sqrt(self._jitter_sq_sum / self.jitter.count) if self.jitter.count else 0.0
+
+    def summary(self):
+        with self._lock:
+            return {
+                "ticks": self.ticks,
+                "missed_deadlines": self.missed_deadlines,
+                "period": self.period,
+                "jitter": dict(self.jitter.summary(), rms=self.jitter_rms()),
+                "latency": self.latency.summary(),
+            }
+
+
+class ControlLoop:
+    """
+    Fixed-rate control loop runner.
+
+    Controller is a callable ``controller(samples, dt)``, where ``samples`` is dict of input name to tuple of
+    latest values (or ``None`` if nothing has arrived yet). It returns dict of output name to value to write,
+    outputs that are missing from result are left untouched.
+
+    Usage::
+
+        loop = ControlLoop(rate=50)
+        loop.add_input("tilt", hub.tilt_sensor, TiltSensor.MODE_2AXIS_ANGLE)
+        loop.add_output("motor", hub.motor_A, "start_power")
+        loop.controller = pid_controller(PID(0.02, 0.001), "tilt", "motor")
+        loop.start()
+    """
+
+    def __init__(self, rate=50.0, controller=None):
+        self.period = 1.0 / rate
+        self.controller = controller
+        self.inputs = {}
+        self.outputs = {}
+        self.stats = LoopStats(self.period)
+
+        self._running = False
+        self._thread = None
+
+    def add_input(self, name, peripheral, mode=None, granularity=1):
+        self.inputs[name] = SensorInput(peripheral, mode, granularity)
+        return self.inputs[name]
+
+    def add_output(self, name, peripheral, method="start_power"):
+        self.outputs[name] = ActuatorOutput(peripheral, method, self._on_written)
+        return self.outputs[name]
+
+    def _on_written(self, sample_timestamp):
+        if sample_timestamp is not None:
+            self.stats.add_latency(time.monotonic() - sample_timestamp)
+
+    def start(self):
+        assert self.controller, "Controller has to be set before starting the loop"
+        for inp in self.inputs.values():
+            inp.start()
+        for out in self.outputs.values():
+            out.start()
+
+        self._running = True
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.name = "Control loop"
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout)
+        for out in self.outputs.values():
+            out.stop(timeout)
+        for inp in self.inputs.values():
+            inp.stop()
+
+    def is_running(self):
+        return self._running and self._thread is not None and self._thread.is_alive()
+
+    def _loop(self):
+        next_tick = time.monotonic()
+        last_tick = None
+        while self._running:
+            now = time.monotonic()
+            if last_tick is not None:
+                self.stats.add_period(now - last_tick)
+            dt = now - last_tick if last_tick is not None else self.period
+            last_tick = now
+
+            self._tick(dt)
+            self.stats.add_tick()
+
+            next_tick += self.period
+            now = time.monotonic()
+            if now > next_tick:
+                # tick has overrun its slot, skip missed ticks instead of bursting to catch up
+                missed = int((now - next_tick) / self.period) + 1
+                self.stats.add_missed(missed)
+                next_tick += missed * self.period
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    def _tick(self, dt):
+        samples = {}
+        newest = None
+        for name, inp in self.inputs.items():
+            latest = inp.latest
+            if latest is None:
+                samples[name] = None
+                continue
+            samples[name] = latest[1]
+            if newest is None or latest[0] > newest:
+                newest = latest[0]
+
+        try:
+            result = self.controller(samples, dt)
+        except BaseException:
+            log.warning("Controller has failed: %s", traceback.format_exc())
+            return
+
+        for name, value in (result or {}).items():
+            self.outputs[name].put(value, newest)
+
+
+def pid_controller(pid, input_name, output_name, value_index=0):
+    """
+    Make controller for :class:`ControlLoop` that feeds one value of input into PID and writes result to output
+
+    :type pid: PID
+    """
+
+    def controller(samples, dt):
+        values = samples.get(input_name)
+        if not values:
+            return {}
+        return {output_name: pid.update(values[value_index], dt)}
+
+    return controller
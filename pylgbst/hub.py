@@ -1,13 +1,34 @@
+import itertools
+import logging
 import threading
-
-from pylgbst import get_connection_auto
-from pylgbst.messages import *
-from pylgbst.peripherals import *
+import time
+import traceback
+
+from pylgbst import get_connection_auto, messages as _messages, metrics, packets, peripherals as _peripherals
+from pylgbst.hubinfo import HubInfo
+from pylgbst.messages import DevTypes, MsgGenericError, MsgHubAction, MsgHubAlert, MsgHubAttachedIO, \
+    MsgHubProperties, MsgPortOutputFeedback, MsgPortValueCombined, MsgPortValueSingle, MsgVirtualPortSetup, \
+    UPSTREAM_MSGS
+from pylgbst.peripherals import Button, Current, EncodedMotor, LEDLight, LEDRGB, Motor, Peripheral, RemoteButton, \
+    Temperature, TiltSensor, TrainMotor, VisionSensor, Voltage
+from pylgbst.tracer import tracer
 from pylgbst.utilities import queue
-from pylgbst.utilities import str2hex, usbyte, ushort
+from pylgbst.utilities import bcd_version, usbyte, ushort
 
 log = logging.getLogger("hub")
 
+
+def __getattr__(name):
+    """Public names of messages and peripherals modules stay importable from here, like `COLOR_RED`"""
+    if not name.startswith("_"):
+        for module in (_peripherals, _messages):
+            if hasattr(module, name):
+                return getattr(module, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+_hub_numbers = itertools.count()
+
 PERIPHERAL_TYPES = {
     DevTypes.MOTOR: Motor,
     DevTypes.SYSTEM_TRAIN_MOTOR: TrainMotor,
@@ -46,6 +67,44 @@ PERIPHERAL_TYPES = {
 }
 
 
+class _Pipeline:
+    """Requests written at once, with their replies collected in request order"""
+
+    def __init__(self, msgs):
+        self.msgs = list(msgs)
+        self.replies = [None] * len(self.msgs)
+        self._unanswered = list(range(len(self.msgs)))
+        self._changed = threading.Condition()
+
+    def offer(self, msg):
+        """
+        :return: True if message is a reply to one of requests
+        """
+        with self._changed:
+            for idx in self._unanswered:
+                request = self.msgs[idx]
+                if isinstance(msg, MsgGenericError):
+                    # hub answers in request order, so error belongs to the oldest unanswered request of its type
+                    matches = msg.cmd == request.TYPE
+                else:
+                    matches = request.is_reply(msg)
+                if matches:
+                    self._unanswered.remove(idx)
+                    self.replies[idx] = msg
+                    self._changed.notify_all()
+                    return True
+        return False
+
+    def wait(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._changed:
+            while self._unanswered:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return
+                self._changed.wait(remaining)
+
+
 class Hub:
     """
     :type connection: pylgbst.comms.Connection
@@ -53,23 +112,48 @@ class Hub:
     """
 
     HUB_HARDWARE_HANDLE = 0x0E
+    RESTORE_TIMEOUT = 5
+    DEVICES_TIMEOUT = 10
+    REQUIRED_PORTS = ()  # builtin devices to wait for on construction
 
     def __init__(self, connection=None):
         self._msg_handlers = []
         self.peripherals = {}
+        self.metrics_label = "hub%d" % next(_hub_numbers)  # to tell hubs apart in metrics
         self._sync_request = None
+        self._sync_span = None  # tracer span of sync request
+        self._pipeline = None  # requests sent by `send_pipelined`
         self._sync_replies = queue.Queue(1)
         self._sync_lock = threading.Lock()
+        self._send_lock = threading.Lock()  # sync requests from concurrent threads take turns
+
+        self._attached_ports = set()  # ports announced by hub over current link
+        self._ports_changed = threading.Condition()
+        self._virtual_port_setups = []  # port pairs combined by us, to replay after reconnect
+        self._closing = False
+        self._reconnect = None  # reconnect policy, see `enable_reconnect`
+        self._supervisor = None
+        self._link_up = threading.Event()
+        self._link_up.set()
+        self._link_lost = threading.Event()
+        self._link_failed = False
 
         self.add_message_handler(MsgHubAttachedIO, self._handle_device_change)
+        self.add_message_handler(MsgHubAttachedIO, self._handle_port_change)  # after subclasses set their fields
         self.add_message_handler(MsgPortOutputFeedback, self._handle_output_feedback)
         self.add_message_handler(MsgPortValueSingle, self._handle_sensor_data)
         self.add_message_handler(MsgPortValueCombined, self._handle_sensor_data)
         self.add_message_handler(MsgGenericError, self._handle_error)
         self.add_message_handler(MsgHubAction, self._handle_action)
+        self.info = HubInfo(self)
 
         if not connection:
             connection = get_connection_auto()  # TODO: how to identify the hub?
+        self._attach_connection(connection)
+
+    def _attach_connection(self, connection):
+        with self._ports_changed:
+            self._attached_ports.clear()
         self.connection = connection
         self.connection.set_notify_handler(self._notify)
         self.connection.enable_notifications()
@@ -81,53 +165,178 @@ class Hub:
     def add_message_handler(self, classname, callback):
         self._msg_handlers.append((classname, callback))
 
-    def send(self, msg):
+    def send(self, msg, timeout=None, wait_reply=True):
         """
         :type msg: pylgbst.messages.DownstreamMsg
+        :param timeout: seconds to wait for reply, None to wait forever
+        :param wait_reply: False to only write the request, its reply goes to message handlers
         :rtype: pylgbst.messages.UpstreamMsg
         """
-        log.debug("Send message: %r", msg)
-        msgbytes = msg.bytes()
-        if msg.needs_reply:
-            with self._sync_lock:
-                assert not self._sync_request, "Pending request %r while trying to put %r" % (self._sync_request, msg)
-                self._sync_request = msg
-                log.debug("Waiting for sync reply to %r...", msg)
+        self._wait_link_up()
+        if isinstance(msg, MsgVirtualPortSetup):
+            self._record_virtual_port_setup(msg)
 
-            self.connection.write(self.HUB_HARDWARE_HANDLE, msgbytes)
-            resp = self._sync_replies.get()
+        span = tracer.begin(msg) if tracer.enabled else None
+        msgbytes = msg.bytes()
+        if span:
+            span.stamp("encode")
+        if packets.enabled:
+            packets.trace(packets.OUT, "hub", self.HUB_HARDWARE_HANDLE, msgbytes, msg)
+
+        if metrics.registry.enabled:
+            self._count_outgoing(msg, msgbytes)
+
+        write = self.connection.write if msg.needs_write_response else self.connection.write_without_response
+        if msg.needs_reply and wait_reply:
+            with self._send_lock:
+                with self._sync_lock:
+                    assert not self._sync_request, "Pending request %r while trying to put %r" % (
+                        self._sync_request, msg)
+                    self._sync_request = msg
+                    self._sync_span = span
+
+                sent = time.perf_counter()
+                if metrics.registry.enabled:
+                    metrics.in_flight.inc((self.metrics_label,))
+                try:
+                    try:
+                        write(self.HUB_HARDWARE_HANDLE, msgbytes)
+                    except BaseException:
+                        with self._sync_lock:
+                            self._sync_request = None  # there will be no reply to wait for
+                        raise
+                    if span:
+                        span.stamp("submit")
+                    resp = self._get_sync_reply(timeout)
+                except (TimeoutError, ConnectionError):
+                    if span:
+                        tracer.finish(span, failed=True)
+                    raise
+                finally:
+                    if metrics.registry.enabled:
+                        metrics.in_flight.dec((self.metrics_label,))
             log.debug("Fetched sync reply: %r", resp)
+            if metrics.registry.enabled:
+                metrics.reply_latency.observe((self.metrics_label, msg.__class__.__name__), time.perf_counter() - sent)
+            if span:
+                span.stamp("wakeup")
+                tracer.finish(span, failed=isinstance(resp, (MsgGenericError, Exception)))
+
             if isinstance(resp, MsgGenericError):
                 raise RuntimeError(resp.message())
+            elif isinstance(resp, Exception):
+                raise resp
             return resp
         else:
-            self.connection.write(self.HUB_HARDWARE_HANDLE, msgbytes)
+            write(self.HUB_HARDWARE_HANDLE, msgbytes)
+            if span:
+                span.stamp("submit")
+                tracer.finish(span)
             return None
 
-    def _notify(self, handle, data):
-        log.debug("Notification on %s: %s", handle, str2hex(data))
+    def send_pipelined(self, msgs, timeout=None):
+        """
+        Write all requests without waiting for each reply, then wait for all replies
+
+        :type msgs: list[pylgbst.messages.DownstreamMsg]
+        :param timeout: seconds to wait for all replies, None to wait forever
+        :return: replies in request order, `MsgGenericError` for failed requests and None for not answered in time
+        """
+        self._wait_link_up()
+        pipeline = _Pipeline(msgs)
+        with self._send_lock:  # sync requests would take error replies
+            with self._sync_lock:
+                self._pipeline = pipeline
+            try:
+                for msg in pipeline.msgs:
+                    self.send(msg, wait_reply=False)
+                pipeline.wait(timeout)
+            finally:
+                with self._sync_lock:
+                    self._pipeline = None
+        return pipeline.replies
+
+    def _count_outgoing(self, msg, msgbytes):
+        metrics.messages_out.inc((self.metrics_label, msg.__class__.__name__))
+        metrics.bytes_out.inc((self.metrics_label, self.connection.__class__.__name__), len(msgbytes))
+
+    def _get_sync_reply(self, timeout):
+        try:
+            return self._sync_replies.get(timeout=timeout)
+        except queue.Empty:
+            with self._sync_lock:
+                self._sync_request = None
+                try:
+                    return self._sync_replies.get_nowait()  # reply has sneaked in
+                except queue.Empty:
+                    pass
+            raise TimeoutError("No reply from hub in %s seconds" % timeout)
+
+    def _wait_link_up(self):
+        if self._link_up.is_set() or threading.current_thread() is self._supervisor:
+            return
+
+        log.debug("Waiting for the link to be restored...")
+        self._link_up.wait()
+        if self._link_failed:
+            raise ConnectionError("Connection to hub is lost")
+
+    def _record_virtual_port_setup(self, msg):
+        if usbyte(msg.payload, 0) == MsgVirtualPortSetup.CMD_CONNECT:
+            self._virtual_port_setups.append((usbyte(msg.payload, 1), usbyte(msg.payload, 2)))
+        else:
+            peripheral = self.peripherals.get(usbyte(msg.payload, 1))
+            if peripheral and peripheral.virtual_ports in self._virtual_port_setups:
+                self._virtual_port_setups.remove(peripheral.virtual_ports)
 
-        msg = self._get_upstream_msg(data)
+    def _notify(self, handle, data):
+        received = time.perf_counter() if tracer.enabled else None
+        if metrics.registry.enabled:
+            msg = self._get_upstream_msg_counted(data)
+        else:
+            msg = self._get_upstream_msg(data)
+        decoded = time.perf_counter() if received else None
+        if packets.enabled:
+            packets.trace(packets.IN, "hub", handle, data, msg)
 
+        consumed = False
         with self._sync_lock:
             if self._sync_request:
                 if self._sync_request.is_reply(msg):
-                    log.debug("Found matching upstream msg: %r", msg)
+                    consumed = True
+                    span = self._sync_span
+                    if span and received:
+                        span.stamp("hub", received)
+                        span.stamp("decode", decoded)
+                        span.stamp("match")
                     self._sync_replies.put(msg)
                     self._sync_request = None
+                    self._sync_span = None
+            elif self._pipeline:
+                consumed = self._pipeline.offer(msg)
 
         for msg_class, handler in self._msg_handlers:
             if isinstance(msg, msg_class):
-                log.debug("Handling msg with %s: %r", handler, msg)
+                if consumed and handler == self._handle_error:
+                    continue  # error is already delivered to its request, which may be finished by now
                 handler(msg)
 
+    def _get_upstream_msg_counted(self, data):
+        metrics.bytes_in.inc((self.metrics_label, self.connection.__class__.__name__), len(data))
+        try:
+            msg = self._get_upstream_msg(data)
+        except BaseException:
+            metrics.decode_errors.inc((self.metrics_label,))
+            raise
+        metrics.messages_in.inc((self.metrics_label, msg.__class__.__name__))
+        return msg
+
     def _get_upstream_msg(self, data):
         msg_type = usbyte(data, 2)
         msg = None
         for msg_kind in UPSTREAM_MSGS:
             if msg_type == msg_kind.TYPE:
                 msg = msg_kind.decode(data)
-                log.debug("Decoded message: %r", msg)
                 break
         assert msg
         return msg
@@ -135,7 +344,7 @@ class Hub:
     def _handle_error(self, msg):
         log.warning("Command error: %s", msg.message())
         with self._sync_lock:
-            if self._sync_request:
+            if self._sync_request and self._sync_request.TYPE == msg.cmd:
                 self._sync_request = None
                 self._sync_replies.put(msg)
 
@@ -146,9 +355,11 @@ class Hub:
         if msg.action == MsgHubAction.UPSTREAM_DISCONNECT:
             log.warning("Hub disconnects")
             self.connection.disconnect()
+            self._on_link_lost()
         elif msg.action == MsgHubAction.UPSTREAM_SHUTDOWN:
             log.warning("Hub switches off")
             self.connection.disconnect()
+            self._on_link_lost()
 
     def _handle_device_change(self, msg):
         if msg.event == MsgHubAttachedIO.EVENT_DETACHED:
@@ -165,22 +376,38 @@ class Hub:
         dev_type = DevTypes(dev_type_raw) if DevTypes.has_value(dev_type_raw) else DevTypes.UNKNOWN
 
         if dev_type in PERIPHERAL_TYPES:
-            self.peripherals[port] = PERIPHERAL_TYPES[dev_type](self, port)
+            cls = PERIPHERAL_TYPES[dev_type]
         else:
             log.warning("Have no dedicated class for peripheral type 0x%x (%s) on port 0x%x",
                         dev_type_raw, DevTypes(dev_type).name, port)
+            cls = Peripheral
 
-            self.peripherals[port] = Peripheral(self, port)
+        virtual_ports = ()
+        if msg.event == msg.EVENT_ATTACHED_VIRTUAL:
+            virtual_ports = (usbyte(msg.payload, 2), usbyte(msg.payload, 3))
 
-        log.info("Attached peripheral %s => %s", DevTypes(dev_type).name, self.peripherals[msg.port])
+        existing = self.peripherals.get(port)
+        if type(existing) is cls and existing.virtual_ports == virtual_ports:
+            # same device announced again after reconnect, keep the object with its subscribers
+            log.info("Re-attached peripheral %s => %s", DevTypes(dev_type).name, existing)
+        else:
+            self.peripherals[port] = cls(self, port)
+            log.info("Attached peripheral %s => %s", DevTypes(dev_type).name, self.peripherals[msg.port])
 
+        self.peripherals[port].dev_type = dev_type_raw
         if msg.event == msg.EVENT_ATTACHED:
-            hw_revision = reversed([usbyte(msg.payload, x) for x in range(2, 6)])
-            sw_revision = reversed([usbyte(msg.payload, x) for x in range(6, 10)])
-            # what to do with this info? it's useless, I guess
-            del hw_revision, sw_revision
+            self.peripherals[port].hw_revision = bcd_version(msg.payload, 2)
+            self.peripherals[port].fw_revision = bcd_version(msg.payload, 6)
         elif msg.event == msg.EVENT_ATTACHED_VIRTUAL:
-            self.peripherals[port].virtual_ports = (usbyte(msg.payload, 2), usbyte(msg.payload, 3))
+            self.peripherals[port].virtual_ports = virtual_ports
+
+    def _handle_port_change(self, msg):
+        with self._ports_changed:
+            if msg.event == MsgHubAttachedIO.EVENT_DETACHED:
+                self._attached_ports.discard(msg.port)
+            else:
+                self._attached_ports.add(msg.port)
+            self._ports_changed.notify_all()
 
     def _handle_output_feedback(self, msg):
         assert isinstance(msg, MsgPortOutputFeedback)
@@ -205,10 +432,161 @@ class Hub:
         device = self.peripherals[msg.port]
         device.queue_port_data(msg)
 
+    def resync_outputs(self):
+        """Re-send acknowledged output state of all peripherals, to bring the hub in line after reconnect"""
+        for peripheral in list(self.peripherals.values()):
+            peripheral.resync_output()
+
+    def enable_reconnect(self, connection_factory, max_attempts=None, initial_delay=0.5, max_delay=30.0,
+                         restore_outputs=True, check_interval=0.5):
+        """
+        Supervise the link: once it drops, reconnect with exponential backoff and restore session state,
+        that is port modes, virtual ports, button subscription and, optionally, outputs.
+        Peripheral objects and their subscribers stay valid, calls made while link is down wait for it.
+
+        :param connection_factory: callable returning new Connection to the same hub,
+            like ``lambda: get_connection_bleak(hub_mac=mac)``
+        :param max_attempts: give up after this many failed attempts, None to try forever
+        :param restore_outputs: re-send acknowledged outputs (motor powers, LED colors) after reconnect
+        :param check_interval: how often to check ``connection.is_alive()``, in seconds
+        """
+        self._reconnect = {
+            "factory": connection_factory,
+            "max_attempts": max_attempts,
+            "initial_delay": initial_delay,
+            "max_delay": max_delay,
+            "restore_outputs": restore_outputs,
+            "check_interval": check_interval,
+        }
+        if not self._supervisor:
+            self._supervisor = threading.Thread(target=self._supervise)
+            self._supervisor.daemon = True
+            self._supervisor.name = "Hub link supervisor"
+            self._supervisor.start()
+
+    def _on_link_lost(self):
+        if self._closing or not self._reconnect:
+            return
+
+        log.warning("Link to hub is lost")
+        self._link_up.clear()
+        with self._sync_lock:
+            if self._sync_request:
+                self._sync_request = None
+                self._sync_replies.put(ConnectionError("Link to hub is lost"))
+        self._link_lost.set()
+
+    def _supervise(self):
+        while not self._closing:
+            self._link_lost.wait(self._reconnect["check_interval"])
+            if self._closing:
+                break
+
+            if not self._link_lost.is_set():
+                if self.connection.is_alive():
+                    continue
+                self._on_link_lost()
+
+            self._link_lost.clear()
+            if not self._restore_link():
+                self._link_failed = True
+                self._link_up.set()  # release waiters, so they get the error
+                break
+
+    def _restore_link(self):
+        policy = self._reconnect
+        delay = policy["initial_delay"]
+        attempt = 0
+        started = time.time()
+        while not self._closing:
+            attempt += 1
+            connection = None
+            try:
+                log.info("Reconnecting to hub, attempt #%s", attempt)
+                connection = policy["factory"]()
+                self._attach_connection(connection)
+                self._restore_session(policy["restore_outputs"])
+            except Exception:
+                log.warning("Failed to reconnect: %s", traceback.format_exc())
+                if connection is not None:
+                    try:
+                        connection.disconnect()
+                    except Exception:
+                        log.debug("Failed to disconnect: %s", traceback.format_exc())
+
+                if metrics.registry.enabled:
+                    metrics.reconnects.inc((self.metrics_label, "failed"))
+
+                if policy["max_attempts"] and attempt >= policy["max_attempts"]:
+                    log.error("Giving up reconnecting after %s attempts", attempt)
+                    return False
+
+                time.sleep(delay)
+                delay = min(delay * 2, policy["max_delay"])
+            else:
+                log.info("Link restored in %.1fs", time.time() - started)
+                if metrics.registry.enabled:
+                    metrics.reconnects.inc((self.metrics_label, "ok"))
+                self._link_up.set()
+                return True
+
+        return False
+
+    def _wait_for_ports(self, ports, timeout):
+        """
+        :return: ports that did not appear within timeout
+        """
+        deadline = time.time() + timeout
+        with self._ports_changed:
+            while True:
+                missing = set(ports) - self._attached_ports
+                remaining = deadline - time.time()
+                if not missing or remaining <= 0:
+                    return missing
+                self._ports_changed.wait(remaining)
+
+    def _wait_for_devices(self, ports, timeout):
+        """
+        Returns as soon as all ports are attached
+
+        :return: ports that did not appear within timeout
+        """
+        missing = self._wait_for_ports(ports, timeout)
+        if missing:
+            log.warning("Builtin devices did not appear on ports: %s", ", ".join("0x%02x" % x for x in sorted(missing)))
+        else:
+            log.debug("All devices are present: %s", [self.peripherals.get(port) for port in ports])
+        return missing
+
+    def _restore_session(self, restore_outputs):
+        physical = [port for port, dev in self.peripherals.items() if not dev.virtual_ports]
+        missing = self._wait_for_ports(physical, self.RESTORE_TIMEOUT)
+        if missing:
+            log.warning("Ports did not re-appear after reconnect: %s", missing)
+
+        for pair in list(self._virtual_port_setups):
+            self._virtual_port_setups.remove(pair)
+            self.send(MsgVirtualPortSetup(MsgVirtualPortSetup.CMD_CONNECT, pair))
+
+        peripherals = list(self.peripherals.values())
+        button = getattr(self, "button", None)
+        if button is not None:
+            peripherals.append(button)
+
+        for peripheral in peripherals:
+            peripheral.restore_state(self.RESTORE_TIMEOUT)
+
+        if restore_outputs:
+            self.resync_outputs()
+
     def disconnect(self):
+        self._closing = True
+        self._link_lost.set()
         self.send(MsgHubAction(MsgHubAction.DISCONNECT))
 
     def switch_off(self):
+        self._closing = True
+        self._link_lost.set()
         self.send(MsgHubAction(MsgHubAction.SWITCH_OFF))
 
 
@@ -243,17 +621,20 @@ class MoveHub(Hub):
     PORT_CURRENT = 0x3B
     PORT_VOLTAGE = 0x3C
 
+    REQUIRED_PORTS = (PORT_A, PORT_B, PORT_AB, PORT_LED, PORT_TILT_SENSOR, PORT_CURRENT, PORT_VOLTAGE)
+
     # noinspection PyTypeChecker
-    def __init__(self, connection=None):
+    def __init__(self, connection=None, required_ports=None, devices_timeout=Hub.DEVICES_TIMEOUT, report_status=True):
+        """
+        :param required_ports: ports to wait for before returning, `REQUIRED_PORTS` by default
+        :param devices_timeout: seconds to wait for them, missing ones are only logged
+        :param report_status: fetch `info` and check battery on construction, or leave it for later
+        """
         self._comm_lock = threading.RLock()
         if connection is None:
             connection = get_connection_auto(hub_name=self.DEFAULT_NAME)
 
-        super().__init__(connection)
-        self.info = {}
-
-        # shorthand fields
-        self.button = Button(self)
+        # shorthand fields, set before connecting since devices get attached right away
         self.led = None
         self.current = None
         self.voltage = None
@@ -266,31 +647,18 @@ class MoveHub(Hub):
         self.port_C = None
         self.port_D = None
 
-        self._wait_for_devices()
-        self._report_status()
-
-    def _wait_for_devices(self, get_dev_set=None):
-        if not get_dev_set:
-            get_dev_set = lambda: (self.motor_A, self.motor_B, self.motor_AB, self.led, self.tilt_sensor,
-                                   self.current, self.voltage)
-        for num in range(0, 100):
-            devices = get_dev_set()
-            if all(devices):
-                log.debug("All devices are present: %s", devices)
-                return
-            log.debug("Waiting for builtin devices to appear: %s", devices)
-            time.sleep(0.1)
-        log.warning("Got only these devices: %s", get_dev_set())
+        super().__init__(connection)
+        self.button = Button(self)
+
+        self._wait_for_devices(self.REQUIRED_PORTS if required_ports is None else required_ports, devices_timeout)
+        if report_status:
+            self._report_status()
 
     def _report_status(self):
-        # maybe add firmware version
-        name = self.send(MsgHubProperties(MsgHubProperties.ADVERTISE_NAME, MsgHubProperties.UPD_REQUEST))
-        mac = self.send(MsgHubProperties(MsgHubProperties.PRIMARY_MAC, MsgHubProperties.UPD_REQUEST))
-        log.info("%s on %s", name.payload, str2hex(mac.payload))
-
-        voltage = self.send(MsgHubProperties(MsgHubProperties.VOLTAGE_PERC, MsgHubProperties.UPD_REQUEST))
-        assert isinstance(voltage, MsgHubProperties)
-        log.info("Voltage: %s%%", usbyte(voltage.parameters, 0))
+        info = self.info.fetch()
+        log.info("%s on %s, firmware %s", info.get(MsgHubProperties.ADVERTISE_NAME),
+                 info.get(MsgHubProperties.PRIMARY_MAC), info.get(MsgHubProperties.FW_VERSION))
+        log.info("Voltage: %s%%", info.get(MsgHubProperties.VOLTAGE_PERC))
 
         voltage = self.send(MsgHubAlert(MsgHubAlert.LOW_VOLTAGE, MsgHubAlert.UPD_REQUEST))
         assert isinstance(voltage, MsgHubAlert)
@@ -356,33 +724,26 @@ class SmartHub(Hub):
     PORT_CURRENT = 0x3B
     PORT_VOLTAGE = 0x3C
 
-    def __init__(self, connection=None):
+    REQUIRED_PORTS = (PORT_LED, PORT_CURRENT, PORT_VOLTAGE)
+
+    def __init__(self, connection=None, required_ports=None, devices_timeout=Hub.DEVICES_TIMEOUT):
+        """
+        :param required_ports: ports to wait for before returning, `REQUIRED_PORTS` by default
+        :param devices_timeout: seconds to wait for them, missing ones are only logged
+        """
         if connection is None:
             connection = get_connection_auto(hub_name=self.DEFAULT_NAME)
 
-        super().__init__(connection)
-
-        self.button = Button(self)
         self.led = None
         self.port_A = None
         self.port_B = None
         self.current = None
         self.voltage = None
 
-        self._wait_for_devices()
-
-    def _wait_for_devices(self, get_dev_set=None):
-        if not get_dev_set:
-            get_dev_set = lambda: (self.led, self.current, self.voltage)
+        super().__init__(connection)
+        self.button = Button(self)
 
-        for num in range(0, 100):
-            devices = get_dev_set()
-            if all(devices):
-                log.debug("All devices are present: %s", devices)
-                return
-            log.debug("Waiting for builtin devices to appear: %s", devices)
-            time.sleep(0.1)
-        log.warning("Got only these devices: %s", get_dev_set())
+        self._wait_for_devices(self.REQUIRED_PORTS if required_ports is None else required_ports, devices_timeout)
 
     # noinspection PyTypeChecker
     def _handle_device_change(self, msg):
@@ -424,32 +785,25 @@ class RemoteHandset(Hub):
     PORT_VOLTAGE = 0x3B
     PORT_RSSI = 0x3C
 
-    def __init__(self, connection=None, address=None):
+    REQUIRED_PORTS = (PORT_A, PORT_B, PORT_RSSI, PORT_LED, PORT_VOLTAGE)
+
+    def __init__(self, connection=None, address=None, required_ports=None, devices_timeout=Hub.DEVICES_TIMEOUT):
+        """
+        :param required_ports: ports to wait for before returning, `REQUIRED_PORTS` by default
+        :param devices_timeout: seconds to wait for them, missing ones are only logged
+        """
         if connection is None:
             connection = get_connection_auto(hub_mac=address, hub_name=self.DEFAULT_NAME)
 
-        super().__init__(connection)
-
         self.led = None
         self.port_A = None
         self.port_B = None
         self.port_RSSI = None
         self.voltage = None
 
-        self._wait_for_devices()
-
-    def _wait_for_devices(self, get_dev_set=None):
-        if not get_dev_set:
-            get_dev_set = lambda: (self.port_A, self.port_B, self.port_RSSI, self.led, self.voltage)
+        super().__init__(connection)
 
-        for num in range(0, 100):
-            devices = get_dev_set()
-            if all(devices):
-                log.debug("All devices are present: %s", devices)
-                return
-            log.debug("Waiting for builtin devices to appear: %s", devices)
-            time.sleep(0.1)
-        log.warning("Got only these devices: %s", get_dev_set())
+        self._wait_for_devices(self.REQUIRED_PORTS if required_ports is None else required_ports, devices_timeout)
 
     # noinspection PyTypeChecker
     def _handle_device_change(self, msg):
@@ -1,6 +1,8 @@
+import logging
+
+from pylgbst import get_connection_auto
 from pylgbst.hub import SmartHub, MoveHub
 from pylgbst.peripherals import COLORS
-from pylgbst import *
 
 
 log = logging.getLogger("hubSpecific")
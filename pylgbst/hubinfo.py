@@ -0,0 +1,183 @@
+"""
+Hub properties: firmware and hardware versions, battery type, MAC addresses, RSSI and more. Usage::
+
+    hub = MoveHub(report_status=False)  # skip the probe on construction
+    info = hub.info.fetch()  # later, all properties requested at once
+    print(info[MsgHubProperties.FW_VERSION], hub.info.as_dict())
+
+Properties that never change for a hub are cached on disk per its primary MAC, next connects request only the volatile
+ones (name, RSSI, battery level) and firmware version. Firmware update may change other static properties too,
+so cache entry is dropped when firmware version differs from the cached one.
+"""
+import logging
+import time
+from struct import unpack
+
+from pylgbst.messages import MsgGenericError, MsgHubProperties
+from pylgbst.utilities import JsonCache, bcd_version, usbyte, ushort
+
+log = logging.getLogger('hubinfo')
+
+_props = MsgHubProperties
+
+
+def _string(data):
+    return data.decode("ascii", errors="replace").rstrip("\x00")
+
+
+def _version(data):
+    return bcd_version(data, 0)
+
+
+def _protocol_version(data):
+    """UInt16 BCD version, as major.minor"""
+    value = ushort(data, 0)
+    return "%x.%02x" % (value >> 12, value & 0x0FFF)
+
+
+def _mac(data):
+    return ":".join("%02x" % x for x in bytearray(data))
+
+
+# property => (name, decoder)
+PROPERTIES = {
+    _props.ADVERTISE_NAME: ("name", _string),
+    _props.FW_VERSION: ("fw_version", _version),
+    _props.HW_VERSION: ("hw_version", _version),
+    _props.RSSI: ("rssi", lambda data: unpack("<b", data[:1])[0]),
+    _props.VOLTAGE_PERC: ("voltage_perc", lambda data: usbyte(data, 0)),
+    _props.BATTERY_TYPE: ("battery_type", lambda data: usbyte(data, 0)),
+    _props.MANUFACTURER: ("manufacturer", _string),
+    _props.RADIO_FW_VERSION: ("radio_fw_version", _string),
+    _props.WIRELESS_PROTO_VERSION: ("wireless_proto_version", _protocol_version),
+    _props.SYSTEM_TYPE_ID: ("system_type_id", lambda data: usbyte(data, 0)),
+    _props.HW_NETW_ID: ("hw_network_id", lambda data: usbyte(data, 0)),
+    _props.PRIMARY_MAC: ("primary_mac", _mac),
+    _props.SECONDARY_MAC: ("secondary_mac", _mac),
+    _props.HARDWARE_NETWORK_FAMILY: ("hw_network_family", lambda data: usbyte(data, 0)),
+}
+
+STATIC = (_props.FW_VERSION, _props.HW_VERSION, _props.BATTERY_TYPE, _props.MANUFACTURER, _props.RADIO_FW_VERSION,
+          _props.WIRELESS_PROTO_VERSION, _props.SYSTEM_TYPE_ID, _props.SECONDARY_MAC, _props.HARDWARE_NETWORK_FAMILY)
+
+_cache = JsonCache("hubinfo.json")
+
+
+class HubInfo:
+    """
+    Hub properties decoded into str and int values, keyed by `MsgHubProperties` property codes.
+    Values are kept up to date with any property update hub sends.
+
+    :param use_cache: take static properties from disk cache when possible
+    """
+
+    TIMEOUT = 5
+
+    def __init__(self, hub, use_cache=True):
+        self.hub = hub
+        self.use_cache = use_cache
+        self.values = {}
+        self.unsupported = set()
+        hub.add_message_handler(MsgHubProperties, self._handle_property)
+
+    def get(self, prop, default=None):
+        return self.values.get(prop, default)
+
+    def as_dict(self):
+        """
+        :return: dict of property name => value
+        """
+        return {PROPERTIES[prop][0]: value for prop, value in self.values.items()}
+
+    def fetch(self, props=None, timeout=TIMEOUT, refresh=False):
+        """
+        Request properties in one burst and wait for all replies
+
+        :param props: property codes to fetch, all known ones by default
+        :param refresh: request static properties even if they are cached
+        :return: dict of property => value, for properties hub has replied to
+        """
+        props = list(PROPERTIES) if props is None else list(props)
+        cacheable = self.use_cache and not refresh
+        first = [prop for prop in props if not (cacheable and prop in STATIC and prop != _props.FW_VERSION)]
+        if len(first) < len(props):
+            if _props.PRIMARY_MAC not in first and _props.PRIMARY_MAC not in self.values:
+                first.append(_props.PRIMARY_MAC)  # cache key
+            if _props.FW_VERSION not in first:
+                first.append(_props.FW_VERSION)  # cache validity
+
+        deadline = time.time() + timeout
+        self._request(first, deadline)
+        rest = [prop for prop in props if prop not in first]
+        if rest and cacheable:
+            rest = self._load_static(rest)
+        if rest:
+            self._request(rest, deadline)
+        if self.use_cache and any(prop in STATIC for prop in props):
+            self._save_static()
+        return {prop: self.values[prop] for prop in props if prop in self.values}
+
+    def _request(self, props, deadline):
+        if not props:
+            return
+        msgs = [MsgHubProperties(prop, MsgHubProperties.UPD_REQUEST) for prop in props]
+        replies = self.hub.send_pipelined(msgs, max(0, deadline - time.time()))
+        missing = []
+        for prop, reply in zip(props, replies):
+            if reply is None:
+                missing.append(PROPERTIES[prop][0])
+            elif isinstance(reply, MsgGenericError):
+                self.unsupported.add(prop)
+            else:
+                self._handle_property(reply)  # its handler may not have run yet
+        if missing:
+            log.warning("No reply for hub properties: %s", missing)
+
+    def _cache_key(self):
+        mac = self.values.get(_props.PRIMARY_MAC)
+        return "mac:%s" % mac if mac else None
+
+    def _load_static(self, props):
+        """
+        :return: properties not found in cache
+        """
+        key = self._cache_key()
+        record = (_cache.get(key) if key else None) or {}
+        fw_name = PROPERTIES[_props.FW_VERSION][0]
+        if fw_name in record and record[fw_name] != self.values.get(_props.FW_VERSION):
+            log.info("Hub firmware has changed from %s to %s, dropping its cached properties",
+                     record[fw_name], self.values.get(_props.FW_VERSION))
+            _cache.delete(key)
+            return list(props)
+
+        missing = []
+        for prop in props:
+            name = PROPERTIES[prop][0]
+            if name not in record:
+                missing.append(prop)
+            elif record[name] is None:
+                self.unsupported.add(prop)
+            else:
+                self.values[prop] = record[name]
+        return missing
+
+    def _save_static(self):
+        key = self._cache_key()
+        if not key:
+            return
+        record = {PROPERTIES[prop][0]: self.values[prop] for prop in STATIC if prop in self.values}
+        record.update({PROPERTIES[prop][0]: None for prop in STATIC if prop in self.unsupported})
+        if record and record != _cache.get(key):
+            _cache.set(key, record)
+
+    def _handle_property(self, msg):
+        if msg.operation != MsgHubProperties.UPSTREAM_UPDATE or msg.property not in PROPERTIES:
+            return
+        name, decoder = PROPERTIES[msg.property]
+        try:
+            value = decoder(msg.parameters)
+        except Exception:
+            log.warning("Failed to decode hub property %s: %r", name, msg.parameters)
+            return
+
+        self.values[msg.property] = value
@@ -37,6 +37,7 @@ class DownstreamMsg(Message):
     def __init__(self):
         super().__init__()
         self.needs_reply = False
+        self.needs_write_response = True  # False allows BLE write without response
 
     def is_reply(self, msg):
         del msg
@@ -762,6 +763,7 @@ class MsgPortOutput(DownstreamMsg):
         if self.do_feedback:
             startup_completion_flags |= self.SC_FEEDBACK
             self.needs_reply = True
+            self.needs_write_response = False  # feedback message confirms delivery
 
         self.payload = (
             pack("<B", self.port)
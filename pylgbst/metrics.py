@@ -0,0 +1,256 @@
+"""
+Metrics of hubs, peripherals and connections, exported in Prometheus/OpenMetrics text format. Usage::
+
+    from pylgbst import metrics
+
+    metrics.start_http_server(9464)  # also enables collection
+    hub = MoveHub()
+
+Then scrape ``http://localhost:9464/metrics``. Collection is off by default and costs only a flag check then.
+Hubs are labeled with `Hub.metrics_label`, set it to tell hubs of a fleet apart.
+
+Any callable added with `registry.add_hook()` is called with (metric name, label values, value) on every update,
+to forward metrics elsewhere.
+"""
+import logging
+import threading
+
+from pylgbst.utilities import Histogram
+
+log = logging.getLogger('metrics')
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    TYPE = None
+
+    def __init__(self, registry, name, description, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values tuple => value
+        self._lock = threading.Lock()
+
+    def _labels(self, labels, extra=()):
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+    def _hooks(self, labels, value):
+        for hook in self.registry.hooks:
+            try:
+                hook(self.name, labels, value)
+            except Exception:
+                log.exception("Metrics hook failed")
+
+    def get(self, labels=()):
+        return self._values.get(tuple(labels))
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.description), "# TYPE %s %s" % (self.name, self.TYPE)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.extend(self._samples(labels, value))
+        return lines
+
+    def _samples(self, labels, value):
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            value = self._values.get(labels, 0) + amount
+            self._values[labels] = value
+        if self.registry.hooks:
+            self._hooks(labels, value)
+
+    def _samples(self, labels, value):
+        return ["%s_total%s %s" % (self.name, self._labels(labels), value)]
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            value = self._values.get(labels, 0) + amount
+            self._values[labels] = value
+        if self.registry.hooks:
+            self._hooks(labels, value)
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self._values[labels] = value
+        if self.registry.hooks:
+            self._hooks(labels, value)
+
+    def _samples(self, labels, value):
+        return ["%s%s %s" % (self.name, self._labels(labels), value)]
+
+
+class HistogramMetric(Metric):
+    """Durations in seconds, with buckets of `pylgbst.utilities.Histogram`"""
+    TYPE = "histogram"
+
+    def observe(self, labels=(), value=0.0):
+        with self._lock:
+            hist = self._values.get(labels)
+            if hist is None:
+                hist = self._values[labels] = Histogram()
+            hist.add(value)
+        if self.registry.hooks:
+            self._hooks(labels, value)
+
+    def _samples(self, labels, hist):
+        lines = []
+        accumulated = 0
+        for bound, count in zip(hist.bounds, hist.counts):
+            accumulated += count
+            lines.append("%s_bucket%s %s" % (self.name, self._labels(labels, [("le", bound)]), accumulated))
+        lines.append("%s_bucket%s %s" % (self.name, self._labels(labels, [("le", "+Inf")]), hist.count))
+        lines.append("%s_count%s %s" % (self.name, self._labels(labels), hist.count))
+        lines.append("%s_sum%s %s" % (self.name, self._labels(labels), hist.total))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.enabled = False
+        self.hooks = []
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, labelnames=()):
+        return self._add(Counter(self, name, description, labelnames))
+
+    def gauge(self, name, description, labelnames=()):
+        return self._add(Gauge(self, name, description, labelnames))
+
+    def histogram(self, name, description, labelnames=()):
+        return self._add(HistogramMetric(self, name, description, labelnames))
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def reset(self):
+        for metric in self._metrics:
+            with metric._lock:
+                metric._values.clear()
+
+    def render(self):
+        """Text in OpenMetrics exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+messages_in = registry.counter("pylgbst_messages_in", "Messages received from hubs", ("hub", "type"))
+messages_out = registry.counter("pylgbst_messages_out", "Messages sent to hubs", ("hub", "type"))
+bytes_in = registry.counter("pylgbst_bytes_in", "Bytes received from hubs", ("hub", "backend"))
+bytes_out = registry.counter("pylgbst_bytes_out", "Bytes sent to hubs", ("hub", "backend"))
+decode_errors = registry.counter("pylgbst_decode_errors", "Notifications failed to decode", ("hub",))
+dropped_samples = registry.counter("pylgbst_dropped_samples", "Port values dropped because peripheral lags behind",
+                                   ("hub", "port"))
+in_flight = registry.gauge("pylgbst_requests_in_flight", "Requests waiting for reply", ("hub",))
+reply_latency = registry.histogram("pylgbst_reply_latency_seconds", "Time from request to its reply",
+                                   ("hub", "type"))
+reconnects = registry.counter("pylgbst_reconnects", "Reconnect attempts", ("hub", "result"))
+callback_time = registry.histogram("pylgbst_callback_seconds", "Time to handle port value, subscribers included",
+                                   ("hub", "port", "peripheral"))
+
+
+def enable():
+    registry.enabled = True
+
+
+def disable():
+    registry.enabled = False
+
+
+_server_class = None
+
+
+def _get_server_class():
+    """HTTP server classes are built on first use, http.server import is too slow to pay for at startup"""
+    global _server_class
+    if _server_class is not None:
+        return _server_class
+
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+
+            body = self.server.registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            log.debug(fmt, *args)
+
+    class _Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    _server_class = _Server, _Handler
+    return _server_class
+
+
+class MetricsServer:
+    """Serves metrics over HTTP in background thread"""
+
+    def __init__(self, host="localhost", port=9464, metrics_registry=registry):
+        server_class, handler = _get_server_class()
+        self._server = server_class((host, port), handler)
+        self._server.registry = metrics_registry
+        self.registry = metrics_registry
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.name = "Metrics HTTP server"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def start_http_server(port=9464, host="localhost"):
+    """Enable metrics collection and serve them in background thread"""
+    enable()
+    server = MetricsServer(host, port).start()
+    log.info("Serving metrics at http://%s:%s/metrics", host, server.port)
+    return server
@@ -0,0 +1,202 @@
+"""
+Dead reckoning for differential drive bases, based on motor rotation sensors.
+
+Each motor sample updates pose incrementally, so cost per sample does not depend on history length.
+Motors of a drive report separately, so readings are paired before integration: a step is integrated once every
+motor has a new reading, or when a motor reports again before the others, meaning they stand still.
+Until then pose is published as if other motors kept their last readings.
+Current pose is published as immutable tuple, readers just take ``odometry.pose`` without any locking.
+"""
+import logging
+import math
+import threading
+import time
+from collections import namedtuple
+
+from pylgbst.peripherals import EncodedMotor
+
+log = logging.getLogger('odometry')
+
+Pose = namedtuple("Pose", ("x", "y", "heading", "linear_speed", "angular_speed", "timestamp"))
+
+INT32_RANGE = 2 ** 32
+INT32_HALF = 2 ** 31
+
+
+def unwrap_int32(previous, current):
+    """Return smallest signed difference between two int32 counter readings, handling wraparound"""
+    return (current - previous + INT32_HALF) % INT32_RANGE - INT32_HALF
+
+
+class _Wheel:
+    def __init__(self, side, direction, scale):
+        self.side = side
+        self.direction = direction
+        self.scale = scale  # distance per degree of motor rotation
+        self.last_angle = None
+        self.last_time = None
+        self.speed = 0.0
+
+
+class Odometry:
+    """
+    Tracks pose (x, y, heading in radians) and filtered velocities of a differential drive.
+
+    Motors are registered with side and direction, several motors per side are averaged.
+    Distances are in the same units as ``wheel_diameter`` and ``track_width``.
+
+    Usage::
+
+        odo = Odometry(wheel_diameter=5.6, track_width=12.0)
+        odo.attach(hub.motor_A, Odometry.LEFT)
+        odo.attach(hub.motor_B, Odometry.RIGHT)
+        ...
+        print(odo.pose)
+        odo.detach()
+    """
+
+    LEFT = "left"
+    RIGHT = "right"
+
+    def __init__(self, wheel_diameter, track_width, smoothing=0.3):
+        """
+        :param smoothing: weight of the newest sample in exponential moving average of velocities, 0..1
+        """
+        self.wheel_diameter = wheel_diameter
+        self.track_width = track_width
+        self.smoothing = smoothing
+
+        self._wheels = {}
+        self._callbacks = {}  # motor => angle callback
+        self._pending = {self.LEFT: 0.0, self.RIGHT: 0.0}  # side travel not integrated yet
+        self._fresh = set()  # motors with pending readings
+        self._side_count = {self.LEFT: 0, self.RIGHT: 0}
+        self._side_speed = {self.LEFT: 0.0, self.RIGHT: 0.0}
+        self._lock = threading.Lock()  # serializes writers, readers don't need it
+        self._x = 0.0
+        self._y = 0.0
+        self._heading = 0.0
+        self.pose = Pose(0.0, 0.0, 0.0, 0.0, 0.0, None)
+
+    def add_motor(self, name, side, direction=1, gear_ratio=1.0):
+        """
+        :param name: any hashable to identify the motor in `update` calls
+        :param side: `LEFT` or `RIGHT`
+        :param direction: -1 if motor rotates backwards when base moves forward
+        :param gear_ratio: wheel turns per one motor turn
+        """
+        assert side in self._side_count, "Unknown side: %s" % side
+        scale = math.pi * self.wheel_diameter * gear_ratio / 360.0
+        with self._lock:
+            self._wheels[name] = _Wheel(side, direction, scale)
+            self._side_count[side] += 1
+
+    def attach(self, motor, side, direction=1, gear_ratio=1.0, granularity=1):
+        """
+        Register motor and subscribe to its angle sensor
+
+        :type motor: EncodedMotor
+        """
+        self.add_motor(motor, side, direction, gear_ratio)
+        callback = self._callbacks[motor] = lambda angle: self.update(motor, angle)
+        motor.subscribe(callback, EncodedMotor.SENSOR_ANGLE, granularity)
+
+    def detach(self, motor=None):
+        """
+        Unsubscribe from angle sensor of motor and unregister it
+
+        :param motor: motor passed to `attach`, all attached motors by default
+        """
+        motors = list(self._callbacks) if motor is None else [motor]
+        for item in motors:
+            item.unsubscribe(self._callbacks.pop(item))
+            self.remove_motor(item)
+
+    def remove_motor(self, name):
+        """Unregister motor added by `add_motor`"""
+        with self._lock:
+            wheel = self._wheels.pop(name)
+            count = self._side_count[wheel.side]
+            self._side_count[wheel.side] = count - 1
+            if count > 1:
+                self._side_speed[wheel.side] = (self._side_speed[wheel.side] * count - wheel.speed) / (count - 1)
+            else:
+                self._side_speed[wheel.side] = 0.0
+            self._fresh.discard(name)
+
+    def reset(self, x=0.0, y=0.0, heading=0.0):
+        with self._lock:
+            self._x, self._y, self._heading = x, y, heading
+            self._pending = {self.LEFT: 0.0, self.RIGHT: 0.0}
+            self._fresh.clear()
+            self.pose = Pose(x, y, heading, self.pose.linear_speed, self.pose.angular_speed, self.pose.timestamp)
+
+    def update(self, name, angle, timestamp=None):
+        """
+        Feed single motor angle reading
+
+        :param angle: raw motor angle in degrees, int32 counter
+        :param timestamp: reading time from `time.monotonic()`, defaults to now
+        """
+        self.update_many({name: angle}, timestamp)
+
+    def update_many(self, angles, timestamp=None):
+        """
+        Feed readings of several motors taken at once, e.g. from combined-mode value
+
+        :type angles: dict
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        with self._lock:
+            for name, angle in angles.items():
+                wheel = self._wheels[name]
+                if wheel.last_angle is None:
+                    wheel.last_angle = angle
+                    wheel.last_time = timestamp
+                    continue
+
+                if name in self._fresh:  # others have not moved since its previous reading
+                    self._commit()
+
+                distance = unwrap_int32(wheel.last_angle, angle) * wheel.direction * wheel.scale
+                dt = timestamp - wheel.last_time
+                wheel.last_angle = angle
+                wheel.last_time = timestamp
+
+                count = self._side_count[wheel.side]
+                self._pending[wheel.side] += distance / count
+                self._fresh.add(name)
+                if dt > 0:
+                    speed = self.smoothing * distance / dt + (1.0 - self.smoothing) * wheel.speed
+                    self._side_speed[wheel.side] += (speed - wheel.speed) / count
+                    wheel.speed = speed
+
+            if all(name in self._fresh for name, wheel in self._wheels.items() if wheel.last_angle is not None):
+                self._commit()
+            self._publish(timestamp)
+
+    def _advance(self, left, right):
+        """
+        :return: x, y and heading after both sides travel given distances from integrated pose
+        """
+        distance = (left + right) / 2.0
+        rotation = (right - left) / self.track_width
+        mid_heading = self._heading + rotation / 2.0
+        heading = (self._heading + rotation + math.pi) % (2 * math.pi) - math.pi
+        return self._x + distance * math.cos(mid_heading), self._y + distance * math.sin(mid_heading), heading
+
+    def _commit(self):
+        self._x, self._y, self._heading = self._advance(self._pending[self.LEFT], self._pending[self.RIGHT])
+        self._pending = {self.LEFT: 0.0, self.RIGHT: 0.0}
+        self._fresh.clear()
+
+    def _publish(self, timestamp):
+        x, y, heading = self._advance(self._pending[self.LEFT], self._pending[self.RIGHT])
+        left_speed = self._side_speed[self.LEFT]
+        right_speed = self._side_speed[self.RIGHT]
+        self.pose = Pose(x, y, heading,
+                         (left_speed + right_speed) / 2.0,
+                         (right_speed - left_speed) / self.track_width,
+                         timestamp)
@@ -0,0 +1,80 @@
+"""
+Packet trace: every packet sent to or received from a hub, as structured records. Usage::
+
+    from pylgbst import packets
+
+    packets.enable()  # log packets to 'packets' logger at DEBUG level
+    packets.enable(my_sink)  # or pass records to your callable
+
+Hot paths only check `packets.enabled` flag, so nothing is formatted while trace is off.
+Records carry raw bytes and decoded message (if any); hex and repr are built only when a sink asks for them.
+"""
+import logging
+import time
+
+from pylgbst.utilities import str2hex
+
+log = logging.getLogger('packets')
+
+IN = "in"
+OUT = "out"
+
+enabled = False
+sinks = []
+
+
+class PacketRecord:
+    """
+    :param source: "hub" for packets seen by `Hub`, backend name for packets seen by connection
+    :param msg: decoded message, if there is one
+    """
+    __slots__ = ("timestamp", "direction", "source", "handle", "data", "msg")
+
+    def __init__(self, direction, source, handle, data, msg=None):
+        self.timestamp = time.time()
+        self.direction = direction
+        self.source = source
+        self.handle = handle
+        self.data = data
+        self.msg = msg
+
+    @property
+    def hex(self):
+        return str2hex(self.data).decode("ascii")
+
+    def __str__(self):
+        text = "%s %-3s 0x%02x %s" % (self.source, self.direction, self.handle or 0, self.hex)
+        if self.msg is not None:
+            text += " %r" % self.msg
+        return text
+
+
+def log_sink(record):
+    log.debug("%s", record)
+
+
+def enable(sink=log_sink):
+    global enabled
+    if sink not in sinks:
+        sinks.append(sink)
+    enabled = True
+
+
+def disable(sink=None):
+    """Remove given sink, or all of them"""
+    global enabled
+    if sink is None:
+        del sinks[:]
+    elif sink in sinks:
+        sinks.remove(sink)
+    enabled = bool(sinks)
+
+
+def trace(direction, source, handle, data, msg=None):
+    """Call only when `enabled` is set"""
+    record = PacketRecord(direction, source, handle, data, msg)
+    for sink in list(sinks):
+        try:
+            sink(record)
+        except Exception:
+            log.exception("Packet trace sink failed")
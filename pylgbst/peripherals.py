@@ -1,9 +1,12 @@
+import binascii
 import logging
 import time
 import traceback
+from collections import OrderedDict
 from struct import pack, unpack
-from threading import Thread
+from threading import Thread, Lock
 
+from pylgbst import metrics
 from pylgbst.messages import (
     MsgHubProperties,
     MsgPortOutput,
@@ -14,10 +17,35 @@ from pylgbst.messages import (
     MsgPortModeInfo,
     MsgPortInputFmtSingle,
 )
-from pylgbst.utilities import queue, str2hex, usbyte, ushort, usint, abs_scaled_100
+from pylgbst.utilities import JsonCache, queue, str2hex, usbyte, ushort, usint, abs_scaled_100
 
 log = logging.getLogger("peripherals")
 
+_modes_cache = JsonCache("modes.json")  # mode descriptions by device type and revisions
+
+
+def _modes_to_json(value):
+    """
+    Mode description as stored in `_modes_cache`, raw bytes values turn into {"hex": ...}
+    """
+    if isinstance(value, bytes):
+        return {"hex": str2hex(value).decode("ascii")}
+    elif isinstance(value, dict):
+        return {key: _modes_to_json(val) for key, val in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_modes_to_json(val) for val in value]
+    return value
+
+
+def _modes_from_json(value):
+    if isinstance(value, dict):
+        if list(value) == ["hex"]:
+            return binascii.unhexlify(value["hex"])
+        return {key: _modes_from_json(val) for key, val in value.items()}
+    elif isinstance(value, list):
+        return [_modes_from_json(val) for val in value]
+    return value
+
 # COLORS
 COLOR_BLACK = 0x00
 COLOR_PINK = 0x01
@@ -66,11 +94,16 @@ class Peripheral:
         self.virtual_ports = ()
         self.hub = parent
         self.port = port
+        self.dev_type = None  # type id and revisions are set by hub when device is attached
+        self.hw_revision = None
+        self.fw_revision = None
 
         self.is_buffered = False
 
         self._subscribers = set()
         self._port_mode = MsgPortInputFmtSingle(self.port, None, False, 1)
+        self._output_channel = None
+        self._output_state = {}  # method name => args of the last output acknowledged by hub
 
         self._incoming_port_data = queue.Queue(1)  # limit 1 means we drop data if we can't handle it fast enough
         thr = Thread(target=self._queue_reader)
@@ -108,10 +141,73 @@ class Peripheral:
             assert isinstance(resp, MsgPortInputFmtSingle)
             self._port_mode = resp
 
-    def _send_output(self, msg):
+    def restore_state(self, timeout=None):
+        """Re-apply port mode after reconnect, hub forgets it together with the link"""
+        mode = self._port_mode
+        if mode.mode is None or self.virtual_ports:
+            return
+
+        log.debug("Restoring port mode on %s: %r", self, mode)
+        msg = MsgPortInputFmtSetupSingle(self.port, mode.mode, mode.upd_delta, mode.upd_enabled)
+        resp = self.hub.send(msg, timeout)
+        assert isinstance(resp, MsgPortInputFmtSingle)
+        self._port_mode = resp
+
+    def set_coalescing(self, enabled=True):
+        """
+        Enable coalescing of continuous-control outputs (like ``start_power`` or ``set_color``).
+        When enabled, such calls return immediately, and the newest value replaces pending one
+        while previous command is still in flight.
+        """
+        if enabled and not self._output_channel:
+            from pylgbst.control import OutputChannel  # control module is not needed unless coalescing
+
+            self._output_channel = OutputChannel(self)
+        elif not enabled and self._output_channel:
+            channel, self._output_channel = self._output_channel, None
+            channel.flush()
+            channel.stop()
+
+    def _send_output(self, msg, coalescable=False, state=None):
+        """
+        :param state: tuple of (method name, args) to record as shadow state once hub acknowledges the output
+        """
         assert isinstance(msg, MsgPortOutput)
         msg.is_buffered = self.is_buffered  # TODO: support buffering
+        channel = self._output_channel
+        if channel and coalescable:
+            channel.put(msg, state)
+            return
+
+        if channel:
+            channel.flush()  # keep the order with commands that can't be coalesced
+        self._deliver_output(msg, state)
+
+    def _deliver_output(self, msg, state=None):
+        self._output_state = {}  # unknown until acknowledged
         self.hub.send(msg)
+        if state:
+            self._output_state = {state[0]: state[1]}
+
+    def _is_redundant_output(self, method, args):
+        """Check if hub has already confirmed being in the same output state"""
+        channel = self._output_channel
+        if channel and channel.is_busy():
+            return False  # confirmed state is about to change
+
+        if self._output_state.get(method) == args:
+            log.debug("Skipping redundant %s%r on %s", method, args, self)
+            return True
+        return False
+
+    def invalidate_output_state(self):
+        self._output_state = {}
+
+    def resync_output(self):
+        """Re-send the last acknowledged output state, for example after reconnect"""
+        for method, args in list(self._output_state.items()):
+            log.debug("Re-syncing %s%r on %s", method, args, self)
+            getattr(self, method)(*args, force=True)
 
     def get_sensor_data(self, mode):
         self.set_port_mode(mode)
@@ -148,6 +244,8 @@ class Peripheral:
             self._incoming_port_data.put_nowait(msg)
         except queue.Full:
             log.debug("Dropped port data: %r", msg)
+            if metrics.registry.enabled:
+                metrics.dropped_samples.inc((self.hub.metrics_label, "0x%02x" % self.port))
 
     def _decode_port_data(self, msg):
         """Return the sensor value according to the current sensor mode
@@ -167,13 +265,30 @@ class Peripheral:
     def _queue_reader(self):
         while True:
             msg = self._incoming_port_data.get()
+            started = time.perf_counter() if metrics.registry.enabled else None
             try:
                 self._handle_port_data(msg)
             except BaseException:
                 log.warning("%s", traceback.format_exc())
                 log.warning("Failed to handle port data by %s: %r", self, msg)
 
-    def describe_possible_modes(self):
+            if started is not None:
+                labels = (self.hub.metrics_label, "0x%02x" % self.port, self.__class__.__name__)
+                metrics.callback_time.observe(labels, time.perf_counter() - started)
+
+    def describe_possible_modes(self, use_cache=True):
+        """
+        Ask hub about port capabilities and each of its modes
+
+        :param use_cache: reuse description of the same device type and revisions, probed earlier
+        """
+        cache_key = self._modes_cache_key() if use_cache else None
+        if cache_key:
+            info = _modes_cache.get(cache_key)
+            if info:
+                log.debug("Port info for 0x%x is taken from cache: %s", self.port, cache_key)
+                return _modes_from_json(info)
+
         mode_info = self.hub.send(MsgPortInfoRequest(self.port, MsgPortInfoRequest.INFO_MODE_INFO))
         assert isinstance(mode_info, MsgPortInfo)
         info = {
@@ -195,30 +310,39 @@ class Peripheral:
             assert isinstance(mode_combinations, MsgPortInfo)
             info['possible_mode_combinations'] = mode_combinations.possible_mode_combinations
 
-        info["modes"] = []
-        for mode in range(256):
-            info["modes"].append(self._describe_mode(mode))
+        modes = {}
+        for mode in sorted(set(range(mode_info.total_modes)) | set(mode_info.input_modes + mode_info.output_modes)):
+            modes[mode] = self._describe_mode(mode)
 
-        for mode in mode_info.output_modes:
-            info["output_modes"].append(self._describe_mode(mode))
-
-        for mode in mode_info.input_modes:
-            info["input_modes"].append(self._describe_mode(mode))
+        info["modes"] = [modes[mode] for mode in range(mode_info.total_modes)]
+        info["output_modes"] = [modes[mode] for mode in mode_info.output_modes]
+        info["input_modes"] = [modes[mode] for mode in mode_info.input_modes]
 
         log.debug("Port info for 0x%x: %s", self.port, info)
+        if cache_key:
+            _modes_cache.set(cache_key, _modes_to_json(info))
         return info
 
+    def _modes_cache_key(self):
+        if self.dev_type is None or self.hw_revision is None or self.fw_revision is None:
+            return None  # virtual ports have no revisions
+        return "type:0x%04x hw:%s fw:%s" % (self.dev_type, self.hw_revision, self.fw_revision)
+
     def _describe_mode(self, mode):
+        """
+        Requests all info types of the mode at once
+        """
+        info_types = list(MsgPortModeInfoRequest.INFO_TYPES)
+        replies = self.hub.send_pipelined([MsgPortModeInfoRequest(self.port, mode, info) for info in info_types])
+
         descr = {"Mode": mode}
-        for info in MsgPortModeInfoRequest.INFO_TYPES:
-            try:
-                resp = self.hub.send(MsgPortModeInfoRequest(self.port, mode, info))
-                assert isinstance(resp, MsgPortModeInfo)
-                descr[MsgPortModeInfoRequest.INFO_TYPES[info]] = resp.value
-            except RuntimeError:
-                log.debug("Got error while requesting info 0x%x: %s", info, traceback.format_exc())
+        for info, resp in zip(info_types, replies):
+            if not isinstance(resp, MsgPortModeInfo):
+                log.debug("Got error while requesting info 0x%x of mode %s: %r", info, mode, resp)
                 if info == MsgPortModeInfoRequest.INFO_NAME:
-                    break
+                    return descr
+                continue
+            descr[MsgPortModeInfoRequest.INFO_TYPES[info]] = resp.value
         return descr
 
 
@@ -229,7 +353,7 @@ class LEDRGB(Peripheral):
     def __init__(self, parent, port):
         super().__init__(parent, port)
 
-    def set_color(self, color):
+    def set_color(self, color, force=False):
         """Set color of the RGB LED
 
         :param color: Accept 2 types of data:
@@ -240,9 +364,14 @@ class LEDRGB(Peripheral):
             COLOR_WHITE, COLOR_NONE`.
             Note that `COLOR_BLACK` and `COLOR_NONE` turn LED off.
         :type color: <tuple> or <int> or constant
+        :param force: send the command even if hub has already confirmed the same color
         """
         if isinstance(color, (list, tuple)):
             assert len(color) == 3, "RGB color has to have 3 values"
+            color = tuple(color)
+            if not force and self._is_redundant_output("set_color", (color,)):
+                return
+
             self.set_port_mode(self.MODE_RGB)
             payload = (
                     pack("<B", self.MODE_RGB)
@@ -257,11 +386,14 @@ class LEDRGB(Peripheral):
             if color not in COLORS:
                 raise ValueError("Color %s is not in list of available colors" % color)
 
+            if not force and self._is_redundant_output("set_color", (color,)):
+                return
+
             self.set_port_mode(self.MODE_INDEX)
             payload = pack("<B", self.MODE_INDEX) + pack("<B", color)
 
         msg = MsgPortOutput(self.port, MsgPortOutput.WRITE_DIRECT_MODE_DATA, payload)
-        self._send_output(msg)
+        self._send_output(msg, coalescable=True, state=("set_color", (color,)))
 
     def _decode_port_data(self, msg):
         """Decode data emitted by the hub
@@ -296,11 +428,12 @@ class LEDLight(Peripheral):
     def __init__(self, parent, port):
         super().__init__(parent, port)
 
-    def set_brightness(self, brightness):
+    def set_brightness(self, brightness, force=False):
         """Set brightness of LEDs
 
         :param brightness: Number between 0 and 100%.
         :type brightness: <int> or <float>
+        :param force: send the command even if hub has already confirmed the same brightness
         """
         if (
                 not isinstance(brightness, (int, float))
@@ -309,11 +442,15 @@ class LEDLight(Peripheral):
         ):
             raise ValueError("Brightness must be a number between 0 and 100")
 
+        brightness = int(brightness)
+        if not force and self._is_redundant_output("set_brightness", (brightness,)):
+            return
+
         self.set_port_mode(self.MODE_BRIGHTNESS)
-        payload = pack("<B", self.MODE_BRIGHTNESS) + pack("<B", int(brightness))
+        payload = pack("<B", self.MODE_BRIGHTNESS) + pack("<B", brightness)
 
         msg = MsgPortOutput(self.port, MsgPortOutput.WRITE_DIRECT_MODE_DATA, payload)
-        self._send_output(msg)
+        self._send_output(msg, state=("set_brightness", (brightness,)))
 
     @property
     def brightness(self):
@@ -334,10 +471,10 @@ class LEDLight(Peripheral):
 
 
 class BaseMotor(Peripheral):
-    def _write_direct_mode(self, subcmd, params):
+    def _write_direct_mode(self, subcmd, params, coalescable=False):
         params = pack("<B", subcmd) + params
         msg = MsgPortOutput(self.port, MsgPortOutput.WRITE_DIRECT_MODE_DATA, params)
-        self._send_output(msg)
+        self._send_output(msg, coalescable)
 
 
 class TrainMotor(BaseMotor):
@@ -353,12 +490,78 @@ class TrainMotor(BaseMotor):
         Power the motor, with value -1.0..1.0
         """
         params = pack("<b", abs_scaled_100(param))
-        self._write_direct_mode(self.SUBCMD_POWER, params)
+        self._write_direct_mode(self.SUBCMD_POWER, params, coalescable=True)
 
     def stop(self):
         self.power(0)
 
 
+class ProfileManager:
+    """
+    Remembers which acceleration/deceleration ramp durations the hub holds in its profile slots for a motor,
+    so moves with the same ramp don't re-send profile commands. When all slots are taken,
+    the least recently used one gets overwritten.
+
+    Note that `use_profile` field of motor commands only selects whether acc/dec profiles are used, not their slot,
+    so with default single slot the cache just avoids rewriting the duration that hub already holds.
+    """
+
+    ACC = "acc"
+    DEC = "dec"
+
+    def __init__(self, motor, slots=1):
+        """
+        :type motor: Motor
+        """
+        self.motor = motor
+        self.slots = slots
+        self._lock = Lock()
+        self._cache = {self.ACC: OrderedDict(), self.DEC: OrderedDict()}  # duration in ms => slot, LRU first
+
+    @staticmethod
+    def _duration(seconds):
+        return int(seconds * 1000)
+
+    def record(self, kind, seconds, slot):
+        """Register that hub's profile slot holds given duration"""
+        with self._lock:
+            cache = self._cache[kind]
+            for duration, used_slot in list(cache.items()):
+                if used_slot == slot:
+                    del cache[duration]
+            cache[self._duration(seconds)] = slot
+
+    def invalidate(self):
+        with self._lock:
+            for cache in self._cache.values():
+                cache.clear()
+
+    def acquire(self, kind, seconds):
+        """
+        Get slot number holding given ramp duration, writing it to the hub if needed
+
+        :rtype: int
+        """
+        duration = self._duration(seconds)
+        with self._lock:
+            cache = self._cache[kind]
+            if duration in cache:
+                cache.move_to_end(duration)
+                return cache[duration]
+
+            if len(cache) < self.slots:
+                slot = min(set(range(self.slots)) - set(cache.values()))
+            else:
+                evicted, slot = cache.popitem(last=False)
+                log.debug("Evicting %s profile of %sms from slot %s", kind, evicted, slot)
+
+        if kind == self.ACC:
+            self.motor.set_acc_profile(seconds, slot)
+        else:
+            self.motor.set_dec_profile(seconds, slot)
+        return slot
+
+
 class Motor(BaseMotor):
     SUBCMD_START_POWER = 0x01
     SUBCMD_START_POWER_GROUPED = 0x02
@@ -373,9 +576,31 @@ class Motor(BaseMotor):
     END_STATE_HOLD = 126
     END_STATE_FLOAT = 0
 
+    USE_ACC_PROFILE = 0b01
+    USE_DEC_PROFILE = 0b10
+
     def __init__(self, parent, port):
         super().__init__(parent, port)
         self.cmd_in_progress = False
+        self.profiles = ProfileManager(self)
+
+    def invalidate_output_state(self):
+        super().invalidate_output_state()
+        self.profiles.invalidate()
+
+    def restore_state(self, timeout=None):
+        self.profiles.invalidate()  # hub has lost the profiles, they will be re-sent when needed
+        super().restore_state(timeout)
+
+    def _use_ramps(self, use_profile, acc_time, dec_time):
+        """Make sure hub holds requested ramp durations, return `use_profile` value to apply them"""
+        if acc_time is not None:
+            self.profiles.acquire(ProfileManager.ACC, acc_time)
+            use_profile |= self.USE_ACC_PROFILE
+        if dec_time is not None:
+            self.profiles.acquire(ProfileManager.DEC, dec_time)
+            use_profile |= self.USE_DEC_PROFILE
+        return use_profile
 
     def _speed_abs(self, relative):  # FIXME: it's not "speed", rather it's a "power"
         if relative == Motor.END_STATE_BRAKE or relative == Motor.END_STATE_HOLD:
@@ -385,20 +610,25 @@ class Motor(BaseMotor):
 
         return abs_scaled_100(relative)
 
-    def _send_cmd(self, subcmd, params, wait_complete=True):
+    def _send_cmd(self, subcmd, params, wait_complete=True, coalescable=False, state=None):
         if self.virtual_ports:
             subcmd += 1  # de-facto rule
 
         msg = MsgPortOutput(self.port, subcmd, params, wait_complete)
-        self._send_output(msg)
+        self._send_output(msg, coalescable, state)
 
-    def start_power(self, power_primary=1.0, power_secondary=None):
+    def start_power(self, power_primary=1.0, power_secondary=None, force=False):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-startpower-power
+
+        :param force: send the command even if hub has already confirmed the same power
         """
         if power_secondary is None:
             power_secondary = power_primary
 
+        if not force and self._is_redundant_output("start_power", (power_primary, power_secondary)):
+            return
+
         if self.virtual_ports:
             cmd = self.SUBCMD_START_POWER_GROUPED - 1  # because _send_cmd will do +1
         else:
@@ -409,7 +639,7 @@ class Motor(BaseMotor):
         if self.virtual_ports:
             params += pack("<b", self._speed_abs(power_secondary))
 
-        self._send_cmd(cmd, params)
+        self._send_cmd(cmd, params, coalescable=True, state=("start_power", (power_primary, power_secondary)))
 
     def stop(self):
         self.timed(0)
@@ -423,6 +653,7 @@ class Motor(BaseMotor):
         params += pack("<B", profile_no)
 
         self._send_cmd(self.SUBCMD_SET_ACC_TIME, params)
+        self.profiles.record(ProfileManager.ACC, seconds, profile_no)
 
     def set_dec_profile(self, seconds, profile_no=0x00):
         """
@@ -433,14 +664,21 @@ class Motor(BaseMotor):
         params += pack("<B", profile_no)
 
         self._send_cmd(self.SUBCMD_SET_DEC_TIME, params)
+        self.profiles.record(ProfileManager.DEC, seconds, profile_no)
 
-    def start_speed(self, speed_primary=1.0, speed_secondary=None, max_power=1.0, use_profile=0b11):
+    def start_speed(self, speed_primary=1.0, speed_secondary=None, max_power=1.0, use_profile=0b11, acc_time=None,
+                    dec_time=None):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-startspeed-speed-maxpower-useprofile-0x07
+
+        :param acc_time: optional acceleration ramp in seconds, profile is written to the hub only if not there yet
+        :param dec_time: optional deceleration ramp in seconds
         """
         if speed_secondary is None:
             speed_secondary = speed_primary
 
+        use_profile = self._use_ramps(use_profile, acc_time, dec_time)
+
         params = b""
         params += pack("<b", self._speed_abs(speed_primary))
         if self.virtual_ports:
@@ -449,16 +687,21 @@ class Motor(BaseMotor):
         params += pack("<B", int(100 * max_power))
         params += pack("<B", use_profile)
 
-        self._send_cmd(self.SUBCMD_START_SPEED, params)
+        self._send_cmd(self.SUBCMD_START_SPEED, params, coalescable=True)
 
     def timed(self, seconds, speed_primary=1.0, speed_secondary=None, max_power=1.0, end_state=END_STATE_BRAKE,
-              use_profile=0b11, wait_complete=True):
+              use_profile=0b11, wait_complete=True, acc_time=None, dec_time=None):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-startspeedfortime-time-speed-maxpower-endstate-useprofile-0x09
+
+        :param acc_time: optional acceleration ramp in seconds, profile is written to the hub only if not there yet
+        :param dec_time: optional deceleration ramp in seconds
         """
         if speed_secondary is None:
             speed_secondary = speed_primary
 
+        use_profile = self._use_ramps(use_profile, acc_time, dec_time)
+
         params = b""
         params += pack("<H", int(seconds * 1000))
         params += pack("<b", self._speed_abs(speed_primary))
@@ -489,15 +732,19 @@ class EncodedMotor(Motor):
     SENSOR_TEST = 0x03  # exists, but neither input nor output mode
 
     def angled(self, degrees, speed_primary=1.0, speed_secondary=None, max_power=1.0, end_state=Motor.END_STATE_BRAKE,
-               use_profile=0b11, wait_complete=True):
+               use_profile=0b11, wait_complete=True, acc_time=None, dec_time=None):
         """
         https://lego.github.io/lego-ble-wireless-protocol-docs/index.html#output-sub-command-startspeedfordegrees-degrees-speed-maxpower-endstate-useprofile-0x0b
         :type degrees: int
         :type speed_primary: float
+        :param acc_time: optional acceleration ramp in seconds, profile is written to the hub only if not there yet
+        :param dec_time: optional deceleration ramp in seconds
         """
         if speed_secondary is None:
             speed_secondary = speed_primary
 
+        use_profile = self._use_ramps(use_profile, acc_time, dec_time)
+
         degrees = int(round(degrees))
         if degrees < 0:
             degrees = -degrees
@@ -705,11 +952,12 @@ class VisionSensor(Peripheral):
             log.debug("Unhandled VisionSensor data in mode %s: %s", self._port_mode.mode, str2hex(data))
             return ()
 
-    def set_color(self, color):
+    def set_color(self, color, force=False):
         """Set color of the RGB LED on the sensor
 
         :param color:
             Note that `COLOR_BLACK` and `COLOR_NONE` turn LED off.
+        :param force: send the command even if hub has already confirmed the same color
         """
         if color == COLOR_NONE:
             color = COLOR_BLACK
@@ -717,19 +965,25 @@ class VisionSensor(Peripheral):
         if color not in COLORS:
             raise ValueError("Color %s is not in list of available colors" % color)
 
+        if not force and self._is_redundant_output("set_color", (color,)):
+            return
+
         self.set_port_mode(self.SET_COLOR)
         payload = pack("<B", self.SET_COLOR) + pack("<B", color)
 
         msg = MsgPortOutput(self.port, MsgPortOutput.WRITE_DIRECT_MODE_DATA, payload)
-        self._send_output(msg)
+        self._send_output(msg, coalescable=True, state=("set_color", (color,)))
 
-    def set_ir_tx(self, level=1.0):
+    def set_ir_tx(self, level=1.0, force=False):
         assert 0 <= level <= 1.0
+        if not force and self._is_redundant_output("set_ir_tx", (level,)):
+            return
+
         self.set_port_mode(self.SET_IR_TX)
         payload = pack("<B", self.SET_IR_TX) + pack("<H", int(level * 65535))
 
         msg = MsgPortOutput(self.port, MsgPortOutput.WRITE_DIRECT_MODE_DATA, payload)
-        self._send_output(msg)
+        self._send_output(msg, state=("set_ir_tx", (level,)))
 
     @property
     def color(self):
@@ -852,6 +1106,10 @@ class Button(Peripheral):
         if not self._subscribers:
             self.hub.send(MsgHubProperties(MsgHubProperties.BUTTON, MsgHubProperties.UPD_DISABLE))
 
+    def restore_state(self, timeout=None):
+        if self._subscribers:
+            self.hub.send(MsgHubProperties(MsgHubProperties.BUTTON, MsgHubProperties.UPD_ENABLE))
+
     def _props_msg(self, msg):
         """
         :type msg: MsgHubProperties
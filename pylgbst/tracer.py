@@ -0,0 +1,158 @@
+"""
+Opt-in tracer of request latency, stamping each stage a request goes through::
+
+    encode  - building message bytes
+    submit  - connection's write call returned
+    queue   - backend took request from its queue (bleak only)
+    write   - BLE write is done (bleak only, for other backends it is part of `submit`)
+    hub     - hub executed the request and its reply notification arrived
+    decode  - reply is decoded
+    match   - reply is matched to the request
+    wakeup  - waiting caller got the reply
+
+Each stage's duration is time since previous stamp. Usage::
+
+    from pylgbst.tracer import tracer
+
+    tracer.enable()
+    hub.motor_A.angled(90)
+    tracer.export_chrome("trace.json")  # open in chrome://tracing or ui.perfetto.dev
+    print(tracer.summary())
+
+When disabled, hot paths only check `tracer.enabled` flag.
+"""
+import collections
+import itertools
+import logging
+import threading
+import time
+
+from pylgbst.utilities import Histogram
+
+log = logging.getLogger('tracer')
+
+
+class Span:
+    """Stamps of one request"""
+
+    def __init__(self, request_id, msg):
+        self.id = request_id
+        self.msg_type = msg.__class__.__name__
+        self.port = getattr(msg, "port", None)
+        self.failed = False
+        self.stamps = [("start", time.perf_counter())]
+
+    def stamp(self, stage, moment=None):
+        self.stamps.append((stage, time.perf_counter() if moment is None else moment))
+
+    def stages(self):
+        """
+        Stamps are taken in pipeline order, but some carry the moment of an earlier event (like reply arrival),
+        which can precede previous stamp. Such stamp is clamped to previous one, so its stage gets zero duration
+        and time is never attributed to the wrong stage.
+
+        :return: list of (stage, start, duration) tuples, in pipeline order
+        """
+        result = []
+        previous = self.stamps[0][1]
+        for stage, moment in self.stamps[1:]:
+            moment = max(moment, previous)
+            result.append((stage, previous, moment - previous))
+            previous = moment
+        return result
+
+    @property
+    def total(self):
+        return max(moment for _, moment in self.stamps) - self.stamps[0][1]
+
+    @property
+    def key(self):
+        return self.msg_type if self.port is None else "%s port 0x%02x" % (self.msg_type, self.port)
+
+
+class Tracer:
+    """
+    :param max_spans: how many finished requests to keep for timeline export
+    """
+
+    def __init__(self, max_spans=100000):
+        self.enabled = False
+        self.spans = collections.deque(maxlen=max_spans)
+        self.histograms = {}  # span key => stage => Histogram
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.histograms = {}
+
+    def begin(self, msg):
+        """Start span for request and make it current for this thread, so backend can stamp it"""
+        span = Span(next(self._ids), msg)
+        self._local.span = span
+        return span
+
+    def current(self):
+        """Span of request being sent by this thread"""
+        return getattr(self._local, "span", None)
+
+    def finish(self, span, failed=False):
+        span.failed = failed
+        self._local.span = None
+        with self._lock:
+            self.spans.append(span)
+            stages = self.histograms.setdefault(span.key, {})
+            for stage, _, duration in span.stages():
+                if stage not in stages:
+                    stages[stage] = Histogram()
+                stages[stage].add(duration)
+            if "total" not in stages:
+                stages["total"] = Histogram()
+            stages["total"].add(span.total)
+
+    def summary(self):
+        """
+        :return: dict of message type and port => stage => histogram summary
+        """
+        with self._lock:
+            return {key: {stage: hist.summary() for stage, hist in stages.items()}
+                    for key, stages in self.histograms.items()}
+
+    def chrome_events(self):
+        events = []
+        with self._lock:
+            spans = list(self.spans)
+
+        for span in spans:
+            thread = span.port if span.port is not None else 0xFF
+            start = span.stamps[0][1]
+            events.append({
+                "name": span.key, "cat": "request", "ph": "X", "pid": 0, "tid": thread,
+                "ts": start * 1000000.0, "dur": span.total * 1000000.0,
+                "args": {"id": span.id, "failed": span.failed},
+            })
+            for stage, moment, duration in span.stages():
+                events.append({
+                    "name": stage, "cat": span.msg_type, "ph": "X", "pid": 0, "tid": thread,
+                    "ts": moment * 1000000.0, "dur": duration * 1000000.0, "args": {"id": span.id},
+                })
+        return events
+
+    def export_chrome(self, path):
+        """Write timelines in Chrome trace event format, one row per port"""
+        import json
+
+        with open(path, "w") as fhd:
+            json.dump({"traceEvents": self.chrome_events(), "displayTimeUnit": "ms"}, fhd)
+        log.info("Exported %s requests into %s", len(self.spans), path)
+
+
+tracer = Tracer()
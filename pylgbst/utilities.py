@@ -3,9 +3,12 @@ This module offers some utilities, in a way they are work in both Python 2 and 3
 """
 
 import binascii
+import bisect
 import logging
 import math
+import os
 import sys
+import threading
 from struct import unpack
 
 log = logging.getLogger(__name__)
@@ -17,6 +20,8 @@ else:
 
 queue = queue  # just to use it
 
+CACHE_DIR_ENV = "PYLGBST_CACHE_DIR"
+
 
 def check_unpack(seq, index, pattern, size):
     """Check that we got size bytes, if so, unpack using pattern"""
@@ -37,6 +42,12 @@ def usint(seq, index):
     return check_unpack(seq, index, "<I", 4)
 
 
+def bcd_version(seq, index):
+    """Int32 BCD version number, as major.minor.bugfix.build"""
+    value = usint(seq, index)
+    return "%x.%x.%02x.%04x" % ((value >> 28) & 0x07, (value >> 24) & 0x0F, (value >> 16) & 0xFF, value & 0xFFFF)
+
+
 def str2hex(data):  # we need it for python 2+3 compatibility
     # if sys.version_info[0] == 3:
     # data = bytes(data, 'ascii')
@@ -57,3 +68,119 @@ def abs_scaled_100(relative):
 
     absolute = math.ceil(relative * 100)  # scale of 100 is proven by experiments
     return int(absolute)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram of durations (in seconds), cheap enough to be updated from hot paths.
+    Bucket bounds are upper bounds; values above the last bound fall into the overflow bucket.
+    """
+
+    DEFAULT_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                      5.0, 10.0)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        idx = bisect.bisect_left(self.bounds, value)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, perc):
+        """Return upper bound of the bucket holding given percentile (0..100), None if there's no data"""
+        if not self.count:
+            return None
+
+        threshold = self.count * perc / 100.0
+        accumulated = 0
+        for idx, cnt in enumerate(self.counts):
+            accumulated += cnt
+            if cnt and accumulated >= threshold:
+                return self.bounds[idx] if idx < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+def get_cache_dir():
+    """Directory for persistent caches, can be overridden with PYLGBST_CACHE_DIR environment variable"""
+    return os.environ.get(CACHE_DIR_ENV) or os.path.join(os.path.expanduser("~"), ".cache", "pylgbst")
+
+
+class JsonCache:
+    """
+    Small key-value storage persisted as JSON file inside cache dir, so it survives process restarts.
+    File is re-read before each modification to merge changes made by other processes.
+    Cache is only an optimization, so failures to read or write it are logged and ignored.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._data = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(get_cache_dir(), self.name)
+
+    def _load(self):
+        import json
+
+        try:
+            with open(self.path) as fhd:
+                data = json.load(fhd)
+            self._data = data if isinstance(data, dict) else {}
+        except (IOError, OSError, ValueError):
+            self._data = {}
+        return self._data
+
+    def _save(self):
+        import json
+
+        path = self.path
+        tmp_path = "%s.%s.tmp" % (path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as fhd:
+                json.dump(self._data, fhd, indent=1, sort_keys=True)
+            os.replace(tmp_path, path)
+        except (IOError, OSError) as exc:
+            log.warning("Failed to save cache file %s: %s", path, exc)
+
+    def get(self, key, default=None):
+        with self._lock:
+            data = self._data if self._data is not None else self._load()
+            return data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._load()[key] = value
+            self._save()
+
+    def delete(self, key):
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
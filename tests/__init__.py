@@ -1,7 +1,13 @@
+import os
 import sys
+import tempfile
 import time
 from binascii import unhexlify
 
+from pylgbst.utilities import CACHE_DIR_ENV
+
+os.environ[CACHE_DIR_ENV] = tempfile.mkdtemp(prefix="pylgbst-test-")  # keep tests away from user's cache
+
 from pylgbst.comms import Connection
 from pylgbst.hub import MoveHub, Hub
 from pylgbst.peripherals import *
@@ -56,7 +62,6 @@ class ConnectionMock(Connection):
         self.finished = True
 
     def write(self, handle, data):
-        log.debug("Writing to %s: %s", handle, str2hex(data))
         self.writes.append((handle, str2hex(data)))
 
     def connect(self, hub_mac=None):
@@ -0,0 +1,27 @@
+import unittest
+
+import benchmarks
+import benchmarks.cases  # registers benchmarks
+
+
+class BenchmarksTest(unittest.TestCase):
+    def test_run_and_compare(self):
+        report = benchmarks.run(0.01, "encode")
+        self.assertIn("encode.MsgPortOutput", report["results"])
+        self.assertGreater(report["results"]["encode.MsgPortOutput"]["value"], 0)
+
+        baseline = {"results": {
+            "fast": benchmarks.result(100.0, "msg/s"),
+            "slow": benchmarks.result(10.0, "us", "lower"),
+        }}
+        report = {"results": {
+            "fast": benchmarks.result(70.0, "msg/s"),
+            "slow": benchmarks.result(9.0, "us", "lower"),
+            "new": benchmarks.result(1.0, "us", "lower"),
+        }}
+        rows = benchmarks.compare(baseline, report, threshold=0.2)
+        self.assertEqual([("fast", True), ("slow", False)], [(row[0], row[4]) for row in rows])
+
+    def test_startup_imports(self):
+        self.assertEqual([], benchmarks.cases.slow_imports("import pylgbst.hub"))
+        self.assertEqual(["json"], benchmarks.cases.slow_imports("import json"))
@@ -1,6 +1,8 @@
+import asyncio
 import sys
 import time
 import unittest
+from collections import namedtuple
 
 import bleak
 from packaging import version
@@ -28,11 +30,11 @@ class BleakDriverTest(unittest.TestCase):
         async def fake_thread():
             print('Fake thread initialized')
             while not driver._abort:
-                time.sleep(0.1)
-                if driver.req_queue.qsize() != 0:
-                    print('Received data, sending back')
-                    data = driver.req_queue.get()
-                    driver.resp_queue.put(data)
+                data = await driver.req_queue.get()
+                if data is None:
+                    break
+                print('Received data, sending back')
+                driver.resp_queue.put(data)
 
         driver._bleak_thread = fake_thread
         driver.set_notify_handler(BleakDriverTest.validation_handler)
@@ -47,10 +49,109 @@ class BleakDriverTest(unittest.TestCase):
         self.assertEqual(handle, last_response[0], 'Verifying response handle')
         self.assertEqual(bytes(data), last_response[1], 'Verifying response data')
 
+        # writes are delivered back to back, not one per polling tick
+        start = time.time()
+        for x in range(50):
+            driver.write(handle, [x])
+        while last_response[1] != bytes([49]) and time.time() - start < 1:
+            time.sleep(0.001)
+        self.assertLess(time.time() - start, 0.5)
+
         driver.disconnect()
         time.sleep(0.5)  # processing time
         self.assertFalse(driver.is_alive())
 
+    @unittest.skipIf(lt37, "Python version is too low")
+    def test_session_shared_scanner(self):
+        scanners = []
+
+        class FakeScanner:
+            def __init__(self, detection_callback, **kwargs):
+                self.callback = detection_callback
+                self.running = False
+                scanners.append(self)
+
+            async def start(self):
+                self.running = True
+
+            async def stop(self):
+                self.running = False
+
+        Device = namedtuple("Device", ("address", "name"))
+        orig_scanner = cbleak.bleak.BleakScanner
+        cbleak.bleak.BleakScanner = FakeScanner
+        session = cbleak.BleakSession()
+        try:
+            conn1 = cbleak.BleakConnection(session)
+            conn2 = cbleak.BleakConnection(session)
+            fut1 = asyncio.run_coroutine_threadsafe(conn1.find_device(hub_name="Hub 1"), session.loop)
+            fut2 = asyncio.run_coroutine_threadsafe(conn2.find_device(hub_name="Hub 2"), session.loop)
+            time.sleep(0.1)
+            self.assertEqual(1, len(scanners), 'Single scanner for all requests')
+            self.assertTrue(scanners[0].running)
+
+            devices = [Device("AA", "Other"), Device("BB", "Hub 2"), Device("BB", "Hub 2"), Device("CC", "Hub 1")]
+            for device in devices:
+                session.loop.call_soon_threadsafe(scanners[0].callback, device, None)
+
+            self.assertEqual("CC", fut1.result(1).address)
+            self.assertEqual("BB", fut2.result(1).address)
+            self.assertFalse(session.claim("CC"), 'Found device is not connected directly again')
+            self.assertTrue(session.claim("DD"))
+            time.sleep(0.1)
+            self.assertFalse(scanners[0].running, 'Scanner stops when nothing is left to find')
+        finally:
+            cbleak.bleak.BleakScanner = orig_scanner
+            session.close()
+
+    @unittest.skipIf(lt37, "Python version is too low")
+    def test_session_cached_connect_fails(self):
+        scanners = []
+
+        class FakeScanner:
+            def __init__(self, detection_callback, **kwargs):
+                self.callback = detection_callback
+                scanners.append(self)
+
+            async def start(self):
+                pass
+
+            async def stop(self):
+                pass
+
+        class FakeClient:
+            def __init__(self, device):
+                self.address = getattr(device, "address", device)
+                self.direct = isinstance(device, str)
+                self.services = namedtuple("Services", ("get_characteristic",))(lambda uuid: None)
+
+            async def connect(self, **kwargs):
+                if self.direct:
+                    raise ConnectionError("Hub is switched off")
+                return True
+
+        Device = namedtuple("Device", ("address", "name"))
+        orig = cbleak.bleak.BleakScanner, cbleak.bleak.BleakClient
+        cbleak.bleak.BleakScanner, cbleak.bleak.BleakClient = FakeScanner, FakeClient
+        cbleak.discovery_cache.remember("AA:BB:CC:DD:EE:FF", None, "AA:BB:CC:DD:EE:FF", "bleak")
+        session = cbleak.BleakSession()
+        try:
+            conn = cbleak.BleakConnection(session)
+            fut = asyncio.run_coroutine_threadsafe(conn.connect("AA:BB:CC:DD:EE:FF"), session.loop)
+            for _ in range(100):
+                if scanners:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(1, len(scanners), "Falls back to scanning")
+            device = Device("AA:BB:CC:DD:EE:FF", "LEGO Move Hub")
+            session.loop.call_soon_threadsafe(scanners[0].callback, device, None)
+            fut.result(1)
+            self.assertEqual("AA:BB:CC:DD:EE:FF", conn._client.address, "Scan finds the hub despite failed claim")
+        finally:
+            cbleak.bleak.BleakScanner, cbleak.bleak.BleakClient = orig
+            cbleak.discovery_cache.forget("AA:BB:CC:DD:EE:FF")
+            session.close()
+
     @staticmethod
     def validation_handler(handle, data):
         global last_response
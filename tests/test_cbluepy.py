@@ -1,3 +1,4 @@
+import time
 import unittest
 
 import pylgbst.comms.cbluepy as bp_backend
@@ -59,3 +60,21 @@ class BluepyTestCase(unittest.TestCase):
 
         tp._dispatcher_thread.join(2)
         self.assertEqual(tp._dispatcher_thread.is_alive(), False)
+        tp.write(123, 'qwe')  # wake pipe is closed by now, write must not touch its descriptor
+        tp._close_wake_pipe()
+
+    def test_writes_drained(self):
+        tp = bp_backend.BluepyThreadedPeripheral('address', 'addrType', 'hci0')
+        for x in range(20):
+            tp.write(123, bytes([x]))
+
+        for _ in range(100):
+            if tp.write_latency.count == 20:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(20, tp.write_latency.count)
+        self.assertLess(tp.write_latency.max, 0.5, "Writes don't wait behind notification polling")
+        tp.disconnect()
+        tp._dispatcher_thread.join(1)
+        self.assertFalse(tp._dispatcher_thread.is_alive())
@@ -1,5 +1,8 @@
+import socket
+import time
 import unittest
 
+import pylgbst
 from pylgbst.comms import *
 
 
@@ -38,3 +41,101 @@ class ConnectionTestCase(unittest.TestCase):
         for address, name, hub_mac, fname, expected in test_matrix:
             matched = conn._is_device_matched(address=address, dev_name=name, hub_mac=hub_mac, find_name=fname)
             self.assertEqual(matched, expected)
+
+    def test_discovery_cache(self):
+        cache = DiscoveryCache("test-discovery.json", ttl=100)
+        cache.remember("AA:BB", "LEGO Move Hub", "AA:BB", "bluepy", "random")
+        self.assertEqual("AA:BB", cache.lookup("aa:bb", "LEGO Move Hub")["address"])
+        self.assertEqual("random", cache.lookup("AA:BB", None, "bluepy")["address_type"])
+        self.assertIsNone(cache.lookup("AA:BB", None, "bleak"))
+        self.assertIsNone(cache.lookup(None, "LEGO Move Hub"), "Names are ambiguous, not cached")
+
+        cache.remember(None, "LEGO Move Hub", "CC:DD", "bluepy")
+        self.assertIsNone(cache.lookup(None, "LEGO Move Hub"))
+
+        # survives restart
+        self.assertEqual("AA:BB", DiscoveryCache("test-discovery.json").lookup("AA:BB")["address"])
+
+        cache.ttl = -1
+        self.assertIsNone(cache.lookup("AA:BB"))
+
+    def test_connect_cached(self):
+        conn = Connection()
+        discovery_cache.remember("AA:BB", None, "AA:BB", "test")
+
+        def _fail(record):
+            raise ConnectionError()
+
+        self.assertTrue(conn._connect_cached("aa:bb", None, "test", lambda record: None))
+        self.assertFalse(conn._connect_cached("aa:bb", None, "test", _fail))
+        self.assertIsNone(discovery_cache.lookup("AA:BB", None), "Failed entry is dropped")
+
+
+class BackendAutodetectTestCase(unittest.TestCase):
+    def setUp(self):
+        self.orig_backends = pylgbst.BACKENDS
+        self.disconnected = []
+        pylgbst._backend_cache.delete("%s:%s" % (socket.gethostname(), None))
+
+    def tearDown(self):
+        pylgbst.BACKENDS = self.orig_backends
+
+    def _factory(self, delay, fail=False, scan_forever=False):
+        test = self
+
+        class Conn(Connection):
+            def connect(self, hub_mac=None, hub_name=None):
+                time.sleep(delay)
+                while scan_forever:
+                    self._check_cancelled()
+                    time.sleep(0.01)
+                if fail:
+                    raise ConnectionError()
+                return self
+
+            def disconnect(self):
+                test.disconnected.append(self)
+
+        return lambda controller: Conn()
+
+    def test_probe(self):
+        pylgbst.BACKENDS = [
+            ("json", "json", False, None),
+            ("missing", "no_such_module_for_sure", False, None),
+            ("adapter", "json", True, None),
+        ]
+        self.assertEqual(["json"], pylgbst.probe_backends("no-such-controller"))
+
+    def test_race_and_cache(self):
+        pylgbst.BACKENDS = [
+            ("failing", "json", False, self._factory(0, fail=True)),
+            ("slow", "json", False, self._factory(0.3)),
+            ("fast", "json", False, self._factory(0.05)),
+        ]
+        conn = pylgbst.get_connection_auto(None, hub_name="test")
+        time.sleep(0.5)
+        self.assertEqual(1, len(self.disconnected), "Loser gets disconnected")
+        self.assertIsNot(conn, self.disconnected[0])
+
+        # cached backend is tried alone, even if it's the slower one
+        pylgbst._backend_cache.set("%s:%s" % (socket.gethostname(), None), "slow")
+        start = time.time()
+        pylgbst.get_connection_auto(None, hub_name="test")
+        self.assertGreater(time.time() - start, 0.25)
+        time.sleep(0.1)
+        self.assertEqual(1, len(self.disconnected))
+
+        pylgbst.BACKENDS[1] = ("slow", "json", False, self._factory(0, fail=True))
+        pylgbst.get_connection_auto(None, hub_name="test")
+        self.assertEqual("fast", pylgbst._backend_cache.get("%s:%s" % (socket.gethostname(), None)))
+
+    def test_losers_cancelled(self):
+        scanning = self._factory(0, scan_forever=True)
+        conns = []
+        pylgbst.BACKENDS = [
+            ("scanning", "json", False, lambda controller: conns.append(scanning(controller)) or conns[-1]),
+            ("fast", "json", False, self._factory(0.05)),
+        ]
+        pylgbst.get_connection_auto(None, hub_name="test")
+        self.assertTrue(conns[0].cancelled, "Loser still scanning is cancelled")
+        self.assertEqual("fast", pylgbst._backend_cache.get("%s:%s" % (socket.gethostname(), None)))
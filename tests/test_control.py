@@ -0,0 +1,104 @@
+import threading
+import time
+import unittest
+
+from pylgbst.control import PID, ControlLoop, ActuatorOutput, pid_controller
+from pylgbst.utilities import Histogram
+
+
+class PeripheralStub:
+    def __init__(self, write_delay=0.0):
+        self.callback = None
+        self.powers = []
+        self.write_delay = write_delay
+
+    def subscribe(self, callback, mode=None, granularity=1):
+        self.callback = callback
+
+    def unsubscribe(self, callback=None):
+        self.callback = None
+
+    def start_power(self, value):
+        time.sleep(self.write_delay)
+        self.powers.append(value)
+
+
+class PIDTest(unittest.TestCase):
+    def test_proportional(self):
+        pid = PID(0.5, setpoint=1.0)
+        self.assertEqual(0.5, pid.update(0.0, 0.1))
+        self.assertEqual(1.0, pid.update(-10.0, 0.1))  # clamped
+
+    def test_integral_windup(self):
+        pid = PID(0.0, ki=1.0, setpoint=10.0)
+        for _ in range(100):
+            self.assertEqual(1.0, pid.update(0.0, 1.0))
+        # integral did not wind up, so output reacts as soon as error changes sign
+        self.assertLess(pid.update(20.0, 1.0), 1.0)
+
+    def test_derivative(self):
+        pid = PID(0.0, kd=1.0, output_limits=(None, None))
+        pid.update(0.0, 0.1)
+        self.assertAlmostEqual(-10.0, pid.update(1.0, 0.1))
+
+
+class ControlLoopTest(unittest.TestCase):
+    def test_loop(self):
+        sensor = PeripheralStub()
+        motor = PeripheralStub()
+
+        loop = ControlLoop(rate=100)
+        loop.add_input("angle", sensor)
+        loop.add_output("motor", motor)
+        loop.controller = pid_controller(PID(0.1, setpoint=5), "angle", "motor")
+        loop.start()
+
+        sensor.callback(0)
+        time.sleep(0.2)
+        loop.stop(1)
+
+        self.assertFalse(loop.is_running())
+        self.assertEqual(0.5, motor.powers[-1])
+        stats = loop.stats.summary()
+        self.assertGreater(stats["ticks"], 5)
+        self.assertGreater(stats["latency"]["count"], 0)
+        self.assertGreater(stats["jitter"]["count"], 0)
+
+    def test_missed_deadlines(self):
+        loop = ControlLoop(rate=100)
+        loop.controller = lambda samples, dt: time.sleep(0.025) or {}
+        loop.start()
+        time.sleep(0.2)
+        loop.stop(1)
+
+        stats = loop.stats.summary()
+        self.assertGreater(stats["ticks"], 0)
+        self.assertGreaterEqual(stats["missed_deadlines"], stats["ticks"])
+
+    def test_latest_wins(self):
+        motor = PeripheralStub(write_delay=0.1)
+        written = threading.Event()
+        out = ActuatorOutput(motor, on_written=lambda ts: written.set())
+        out.start()
+        out.put(0.1)
+        time.sleep(0.02)  # first write is in flight now
+        for val in (0.2, 0.3, 0.4):
+            out.put(val)
+        time.sleep(0.3)
+        out.stop()
+
+        self.assertEqual([0.1, 0.4], motor.powers)
+        self.assertEqual(2, out.replaced)
+        self.assertTrue(written.is_set())
+
+
+class HistogramTest(unittest.TestCase):
+    def test_percentiles(self):
+        hist = Histogram(bounds=(1, 2, 3))
+        self.assertIsNone(hist.percentile(50))
+        for val in (0.5, 1.5, 1.5, 2.5, 100):
+            hist.add(val)
+        self.assertEqual(5, hist.count)
+        self.assertEqual(2, hist.percentile(50))
+        self.assertEqual(100, hist.percentile(100))
+        self.assertEqual(0.5, hist.min)
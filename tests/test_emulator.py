@@ -0,0 +1,83 @@
+import time
+import unittest
+
+from pylgbst.comms.cemulator import HubEmulator
+from pylgbst.hub import MoveHub, SmartHub, RemoteHandset
+from pylgbst.messages import MsgHubProperties
+from pylgbst.peripherals import EncodedMotor, VisionSensor, COLOR_RED
+
+
+class EmulatorTest(unittest.TestCase):
+    def test_move_hub(self):
+        conn = HubEmulator(HubEmulator.MOVE_HUB, mac="00:16:53:AA:BB:CC")
+        start = time.time()
+        hub = MoveHub(conn)
+        self.assertLess(time.time() - start, 1)
+        self.assertIsInstance(hub.motor_AB, EncodedMotor)
+        self.assertIsInstance(hub.vision_sensor, VisionSensor)
+        self.assertIsInstance(hub.motor_external, EncodedMotor)
+
+        mac = hub.send(MsgHubProperties(MsgHubProperties.PRIMARY_MAC, MsgHubProperties.UPD_REQUEST))
+        self.assertEqual(b"\x00\x16\x53\xaa\xbb\xcc", mac.parameters)
+
+        angles = []
+        hub.motor_A.subscribe(lambda angle: angles.append(angle), granularity=10)
+
+        start = time.time()
+        hub.motor_A.angled(90, 0.5)
+        self.assertGreaterEqual(time.time() - start, 0.17)
+        self.assertAlmostEqual(90, conn.get_position(hub.PORT_A), delta=1)
+
+        hub.motor_AB.timed(0.1, 1.0, -1.0)
+        self.assertAlmostEqual(190, conn.get_position(hub.PORT_A), delta=5)
+        self.assertAlmostEqual(-100, conn.get_position(hub.PORT_B), delta=5)
+
+        hub.motor_A.goto_position(0)
+        self.assertAlmostEqual(0, conn.get_position(hub.PORT_A), delta=1)
+        time.sleep(0.1)
+        self.assertTrue(angles)
+        self.assertEqual(0, angles[-1])
+
+        hub.disconnect()
+        time.sleep(0.05)
+        self.assertFalse(conn.is_alive())
+
+    def test_small_hubs(self):
+        hub = SmartHub(HubEmulator(HubEmulator.SMART_HUB))
+        self.assertIsNotNone(hub.port_A)
+        hub.voltage.get_sensor_data(hub.voltage.VOLTAGE_L)
+
+        presses = []
+        remote = RemoteHandset(HubEmulator(HubEmulator.REMOTE_HANDSET))
+        remote.port_A.subscribe(lambda button, side: presses.append((button, side)))
+        remote.connection.set_sensor_value(remote.PORT_A, 0, b"\x01")
+        time.sleep(0.2)
+        self.assertEqual(("PLUS", "LEFT"), presses[-1])
+
+    def test_describe_modes(self):
+        hub = MoveHub(HubEmulator())
+        self.assertEqual("1.0.00.0000", hub.vision_sensor.fw_revision)
+
+        info = hub.vision_sensor.describe_possible_modes()
+        self.assertEqual(info["mode_count"], len(info["modes"]))
+        self.assertEqual("MODE1", info["modes"][1]["Name"])
+        self.assertEqual(b"\x00" * 6, info["modes"][1]["Capabilities"])
+
+        # same device type and revisions on another hub are not probed again
+        conn = HubEmulator(mac="00:16:53:00:00:02")
+        other = MoveHub(conn)
+        received = conn.received
+        self.assertEqual(info, other.vision_sensor.describe_possible_modes())
+        self.assertEqual(received, conn.received)
+
+        self.assertEqual(info["modes"], other.vision_sensor.describe_possible_modes(use_cache=False)["modes"])
+        self.assertGreater(conn.received, received)
+
+    def test_link_simulation(self):
+        conn = HubEmulator(latency=0.02, jitter=0.01, seed=1)
+        start = time.time()
+        hub = MoveHub(conn)
+        self.assertGreaterEqual(time.time() - start, 0.04)
+        self.assertEqual(0, conn.lost)
+        self.assertGreater(conn.sent, 0)
+        hub.led.set_color(COLOR_RED)
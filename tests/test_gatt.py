@@ -4,7 +4,7 @@ import unittest
 
 from gatt import DeviceManager
 
-from pylgbst.comms.cgatt import CustomDevice, GattConnection
+from pylgbst.comms.cgatt import CustomDevice, GattConnection, HubDeviceManager
 from tests import log, str2hex
 
 
@@ -25,6 +25,20 @@ class DeviceManagerMock(DeviceManager, object):
         pass
 
 
+class HubDeviceManagerMock(HubDeviceManager):
+    def update_devices(self):
+        pass
+
+
+class DeviceMock(object):
+    def __init__(self, mac_address, name):
+        self.mac_address = mac_address
+        self.name = name
+
+    def alias(self):
+        return self.name
+
+
 class TestGatt(unittest.TestCase):
     def test_one(self):
         log.debug("")
@@ -48,3 +62,20 @@ class TestGatt(unittest.TestCase):
             obj.connect()
         except AttributeError:
             pass
+
+    def test_discover_timeout(self):
+        conn = GattConnection(timeout=0.1)
+        manager = conn._manager
+        manager.start_discovery = manager.stop_discovery = lambda: None
+        manager.devices = lambda: []
+        with self.assertRaises(ConnectionError):
+            conn._discover("AA:BB:CC:DD:EE:FF", None)
+
+    def test_discovery_callback(self):
+        manager = HubDeviceManagerMock("hci0")
+        manager.matcher = lambda address, name: name == "LEGO Move Hub"
+        manager.device_discovered(DeviceMock("AA", "Other"))
+        self.assertFalse(manager.found_event.is_set())
+        manager.device_discovered(DeviceMock("BB", "LEGO Move Hub"))
+        self.assertTrue(manager.found_event.wait(0))
+        self.assertEqual("BB", manager.found_address)
@@ -1,13 +1,39 @@
+import threading
 import time
 import unittest
 
 from pylgbst.hub import Hub, MoveHub
-from pylgbst.messages import MsgHubAction, MsgHubAlert, MsgHubProperties
-from pylgbst.peripherals import VisionSensor
-from pylgbst.utilities import usbyte
+from pylgbst.messages import MsgGenericError, MsgHubAction, MsgHubAlert, MsgHubProperties, MsgPortOutput
+from pylgbst.peripherals import VisionSensor, EncodedMotor
+from pylgbst.utilities import usbyte, str2hex
 from tests import ConnectionMock
 
 
+class RespondingConnectionMock(ConnectionMock):
+    """
+    Announces given devices once connected and acknowledges port mode setups, like a real hub does
+
+    :param replies: dict of request hex => reply hex, other hub property requests are answered with error
+    """
+
+    def __init__(self, attached=(), replies=None):
+        super().__init__()
+        self.attached = list(attached)
+        self.replies = replies or {}
+
+    def enable_notifications(self):
+        self.notifications.extend(self.attached)
+
+    def write(self, handle, data):
+        super().write(handle, data)
+        if data[2] == 0x41:  # port input format setup
+            self.notifications.append("0a0047" + str2hex(data[3:]).decode())
+        elif str2hex(data).decode() in self.replies:
+            self.notifications.append(self.replies[str2hex(data).decode()])
+        elif data[2] == 0x01:
+            self.notifications.append("0500050106")
+
+
 class HubTest(unittest.TestCase):
     def test_hub_properties(self):
         conn = ConnectionMock().connect()
@@ -45,6 +71,22 @@ class HubTest(unittest.TestCase):
         del hub
         conn.wait_notifications_handled()
 
+    def test_wait_for_devices(self):
+        conn = ConnectionMock().connect()
+        hub = Hub(conn)
+
+        conn.notification_delayed('0f0004010126000000001000000010', 0.2)
+        start = time.time()
+        self.assertEqual(set(), hub._wait_for_devices([0x01], 5))
+        self.assertLess(time.time() - start, 1, "Returns once the device is attached")
+        self.assertIsInstance(hub.peripherals[0x01], EncodedMotor)
+
+        self.assertEqual({0x02}, hub._wait_for_devices([0x01, 0x02], 0.1))
+
+        conn.notifications.append('0500040100')
+        conn.wait_notifications_handled()
+        self.assertEqual({0x01}, hub._wait_for_devices([0x01], 0))
+
     def test_hub_actions(self):
         conn = ConnectionMock().connect()
         hub = Hub(conn)
@@ -75,6 +117,42 @@ class HubTest(unittest.TestCase):
         time.sleep(0.2)
         conn.wait_notifications_handled()
 
+    def test_pipelined_error(self):
+        conn = ConnectionMock().connect()
+        hub = Hub(conn)
+
+        # hold notification thread before error handlers until next request is written
+        next_written = threading.Event()
+        hub._msg_handlers.insert(0, (MsgGenericError, lambda msg: next_written.wait(1)))
+
+        conn.notification_delayed("0500050106", 0.1)  # hub rejects property request
+        msg = MsgHubProperties(MsgHubProperties.HARDWARE_NETWORK_FAMILY, MsgHubProperties.UPD_REQUEST)
+        replies = hub.send_pipelined([msg], 1)
+        self.assertIsInstance(replies[0], MsgGenericError)
+
+        write = conn.write
+
+        def _write(handle, data):
+            write(handle, data)
+            next_written.set()
+
+        conn.write = _write
+        conn.notification_delayed("0600030104ff", 0.2)
+        resp = hub.send(MsgHubAlert(MsgHubAlert.LOW_VOLTAGE, MsgHubAlert.UPD_REQUEST), timeout=1)
+        self.assertIsInstance(resp, MsgHubAlert, "Error of pipelined request does not fail the next one")
+        conn.wait_notifications_handled()
+
+    def test_late_error(self):
+        conn = ConnectionMock().connect()
+        hub = Hub(conn)
+        self.assertEqual({}, hub.info.fetch([MsgHubProperties.RSSI], timeout=0.1))
+
+        conn.notification_delayed("0500050106", 0.1)  # property request is rejected after fetch gave up
+        conn.notification_delayed("0600030104ff", 0.3)
+        resp = hub.send(MsgHubAlert(MsgHubAlert.LOW_VOLTAGE, MsgHubAlert.UPD_REQUEST), timeout=1)
+        self.assertIsInstance(resp, MsgHubAlert, "Error of other command type does not fail the request")
+        conn.wait_notifications_handled()
+
     def test_disconnect_off(self):
         conn = ConnectionMock().connect()
         hub = Hub(conn)
@@ -88,6 +166,22 @@ class HubTest(unittest.TestCase):
         hub.switch_off()
         self.assertEqual(b"04000201", conn.writes[1][1])
 
+    def test_write_without_response(self):
+        conn = ConnectionMock().connect()
+        fast_writes = []
+        conn.write_without_response = lambda handle, data: fast_writes.append(data)
+        hub = Hub(conn)
+
+        conn.notification_delayed('050082030a', 0.1)
+        hub.send(MsgPortOutput(0x03, MsgPortOutput.WRITE_DIRECT_MODE_DATA, b"\x00\x64"))
+        self.assertEqual([b"0800810311510064"], [str2hex(x) for x in fast_writes])
+
+        conn.notification_delayed('060001060600', 0.1)
+        hub.send(MsgHubProperties(MsgHubProperties.VOLTAGE_PERC, MsgHubProperties.UPD_REQUEST))
+        self.assertEqual(1, len(fast_writes))
+        self.assertEqual(b"0500010605", conn.writes[-1][1])
+        conn.wait_notifications_handled()
+
     def test_sensor(self):
         conn = ConnectionMock().connect()
         conn.notifications.append("0f0004020125000000001000000010")  # add dev
@@ -118,28 +212,94 @@ class HubTest(unittest.TestCase):
 
         self.assertEqual([(255, 10.0)], vals)
 
+    def test_reconnect(self):
+        attached = ["0f0004010126000000001000000010"]
+        conn = RespondingConnectionMock(attached).connect()
+        hub = Hub(conn)
+        time.sleep(0.1)
+        motor = hub.peripherals[0x01]
+        assert isinstance(motor, EncodedMotor)
+
+        vals = []
+        motor.subscribe(vals.append, EncodedMotor.SENSOR_ANGLE)
+
+        new_conn = RespondingConnectionMock(attached).connect()
+        connections = [new_conn]
+        hub.enable_reconnect(connections.pop, initial_delay=0.01, check_interval=0.01)
+        conn.notifications.append("04000231")  # hub disconnects
+
+        for _ in range(100):
+            if hub.connection is new_conn and hub._link_up.is_set():
+                break
+            time.sleep(0.01)
+
+        self.assertIs(new_conn, hub.connection)
+        self.assertIs(motor, hub.peripherals[0x01], "Peripheral object survives reconnect")
+        self.assertEqual([b"0a004101020100000001"], [data for _, data in new_conn.writes])
+
+        new_conn.notifications.append("0800450102000000")
+        time.sleep(0.1)
+        self.assertEqual([2], vals, "Subscriber still gets values")
+
 
 class MoveHubTest(unittest.TestCase):
+    ATTACHED = [
+        "0f0004020125000000001000000010", "0f0004030126000000001000000010", "0f0004000127000100000001000000",
+        "0f0004010127000100000001000000", "090004100227003738", "0f0004320117000100000001000000",
+        "0f00043a0128000000000100000001", "0f00043b0115000200000002000000", "0f00043c0114000200000002000000",
+    ]
+    REPLIES = {
+        "0500010105": "12000101064c45474f204d6f766520487562",
+        "0500010d05": "0b00010d06001653a0d1d4",
+        "0500010605": "060001060600",
+        "0500010305": "0900010306170000 11",
+        "0500030103": "0600030104ff",
+    }
+
     def test_capabilities(self):
-        conn = ConnectionMock()
-        conn.notifications.append('0f00 04 02 0125000000001000000010')
-        conn.notifications.append('0f00 04 03 0126000000001000000010')
-        conn.notifications.append('0f00 04 00 0127000100000001000000')
-        conn.notifications.append('0f00 04 01 0127000100000001000000')
-        conn.notifications.append('0900 04 10 0227003738')
-        conn.notifications.append('0f00 04 32 0117000100000001000000')
-        conn.notifications.append('0f00 04 3a 0128000000000100000001')
-        conn.notifications.append('0f00 04 3b 0115000200000002000000')
-        conn.notifications.append('0f00 04 3c 0114000200000002000000')
-
-        conn.notification_delayed('12000101064c45474f204d6f766520487562', 1.1)
-        conn.notification_delayed('0b00010d06001653a0d1d4', 1.3)
-        conn.notification_delayed('060001060600', 1.5)
-        conn.notification_delayed('0600030104ff', 1.7)
-        MoveHub(conn.connect())
-        time.sleep(1)
-        conn.wait_notifications_handled()
-        self.assertEqual(b"0500010105", conn.writes[1][1])
-        self.assertEqual(b"0500010d05", conn.writes[2][1])
-        self.assertEqual(b"0500010605", conn.writes[3][1])
-        self.assertEqual(b"0500030103", conn.writes[4][1])
+        conn = RespondingConnectionMock(self.ATTACHED, self.REPLIES).connect()
+        hub = MoveHub(conn)
+        self.assertIsInstance(hub.vision_sensor, VisionSensor)
+        self.assertIsInstance(hub.motor_external, EncodedMotor)
+
+        written = [data for _, data in conn.writes]
+        for request in (b"0500010105", b"0500010d05", b"0500010605", b"0500010305", b"0500030103"):
+            self.assertIn(request, written)
+
+        self.assertEqual("LEGO Move Hub", hub.info.get(MsgHubProperties.ADVERTISE_NAME))
+        self.assertEqual("00:16:53:a0:d1:d4", hub.info.get(MsgHubProperties.PRIMARY_MAC))
+        self.assertEqual(0, hub.info.get(MsgHubProperties.VOLTAGE_PERC))
+        self.assertEqual("1.1.00.0017", hub.info.as_dict()["fw_version"])
+        self.assertIn(MsgHubProperties.RSSI, hub.info.unsupported)
+
+        # static properties of the same hub come from cache
+        conn = RespondingConnectionMock(self.ATTACHED, self.REPLIES).connect()
+        hub = MoveHub(conn)
+        written = [data for _, data in conn.writes]
+        self.assertNotIn(b"0500010405", written)
+        self.assertIn(b"0500010305", written)
+        self.assertIn(b"0500010605", written)
+        self.assertEqual("1.1.00.0017", hub.info.get(MsgHubProperties.FW_VERSION))
+
+        # firmware update invalidates cached properties
+        replies = dict(self.REPLIES)
+        replies["0500010305"] = "0900010306180000 11"
+        conn = RespondingConnectionMock(self.ATTACHED, replies).connect()
+        hub = MoveHub(conn)
+        self.assertIn(b"0500010405", [data for _, data in conn.writes])
+        self.assertEqual("1.1.00.0018", hub.info.get(MsgHubProperties.FW_VERSION))
+
+    def test_skip_report(self):
+        conn = RespondingConnectionMock(self.ATTACHED, self.REPLIES).connect()
+        hub = MoveHub(conn, report_status=False)
+        self.assertEqual([], [data for _, data in conn.writes if data.startswith(b"050001")])
+
+        self.assertEqual({MsgHubProperties.VOLTAGE_PERC: 0}, hub.info.fetch([MsgHubProperties.VOLTAGE_PERC]))
+
+    def test_reexports(self):
+        # names used by docs and examples
+        from pylgbst.hub import COLORS, COLOR_NONE, COLOR_RED, MsgHubAction as HubAction
+
+        self.assertEqual("RED", COLORS[COLOR_RED])
+        self.assertIn(COLOR_NONE, COLORS)
+        self.assertIs(MsgHubAction, HubAction)
@@ -0,0 +1,50 @@
+import time
+import unittest
+from urllib.request import urlopen
+
+from pylgbst import metrics
+from pylgbst.comms.cemulator import HubEmulator
+from pylgbst.hub import MoveHub
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.registry.reset()
+
+    def test_collect_and_export(self):
+        updates = []
+        metrics.registry.add_hook(lambda name, labels, value: updates.append(name))
+        server = metrics.start_http_server(0)
+        try:
+            hub = MoveHub(HubEmulator())
+            hub.metrics_label = "robot1"
+            hub.motor_A.subscribe(lambda angle: time.sleep(0.001))
+            hub.motor_A.angled(90)
+            time.sleep(0.1)
+
+            self.assertEqual(1, metrics.messages_out.get(("robot1", "MsgPortOutput")))
+            self.assertGreater(metrics.messages_in.get(("robot1", "MsgPortValueSingle")), 0)
+            self.assertEqual(0, metrics.in_flight.get(("robot1",)))
+            self.assertGreater(metrics.callback_time.get(("robot1", "0x00", "EncodedMotor")).count, 0)
+            self.assertIn("pylgbst_reply_latency_seconds", updates)
+
+            response = urlopen("http://localhost:%s/metrics" % server.port)
+            self.assertEqual(metrics.CONTENT_TYPE, response.headers["Content-Type"])
+            text = response.read().decode("utf-8")
+        finally:
+            server.stop()
+            metrics.registry.hooks.clear()
+
+        self.assertIn('pylgbst_messages_out_total{hub="robot1",type="MsgPortOutput"} 1\n', text)
+        self.assertIn('pylgbst_bytes_in_total{hub="robot1",backend="HubEmulator"}', text)
+        self.assertIn('pylgbst_reply_latency_seconds_bucket{hub="robot1",type="MsgPortOutput",le="+Inf"} 1\n', text)
+        self.assertTrue(text.endswith("# EOF\n"))
+
+    def test_disabled(self):
+        hub = MoveHub(HubEmulator())
+        hub.motor_A.angled(10)
+        self.assertIsNone(metrics.messages_out.get((hub.metrics_label, "MsgPortOutput")))
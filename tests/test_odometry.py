@@ -0,0 +1,94 @@
+import math
+import unittest
+
+from pylgbst.comms.cemulator import HubEmulator
+from pylgbst.hub import MoveHub
+from pylgbst.odometry import Odometry, unwrap_int32
+
+
+class OdometryTest(unittest.TestCase):
+    def _odometry(self):
+        # wheel circumference of 360 units makes 1 degree equal 1 unit of distance
+        odo = Odometry(wheel_diameter=360 / math.pi, track_width=100, smoothing=1.0)
+        odo.add_motor("A", Odometry.LEFT)
+        odo.add_motor("B", Odometry.RIGHT, direction=-1)
+        odo.update_many({"A": 0, "B": 0}, 0.0)
+        return odo
+
+    def test_unwrap(self):
+        self.assertEqual(10, unwrap_int32(0, 10))
+        self.assertEqual(-10, unwrap_int32(0, -10))
+        self.assertEqual(2, unwrap_int32(2 ** 31 - 1, -2 ** 31 + 1))
+        self.assertEqual(-2, unwrap_int32(-2 ** 31 + 1, 2 ** 31 - 1))
+
+    def test_straight(self):
+        odo = self._odometry()
+        odo.update_many({"A": 100, "B": -100}, 1.0)
+        pose = odo.pose
+        self.assertAlmostEqual(100, pose.x)
+        self.assertAlmostEqual(0, pose.y)
+        self.assertAlmostEqual(0, pose.heading)
+        self.assertAlmostEqual(100, pose.linear_speed)
+        self.assertAlmostEqual(0, pose.angular_speed)
+
+    def test_separate_samples(self):
+        odo = self._odometry()
+        for step in range(1, 11):
+            odo.update("A", step, step / 10.0)
+            odo.update("B", -step, step / 10.0)
+        pose = odo.pose
+        self.assertAlmostEqual(10, pose.x, 2)
+        self.assertAlmostEqual(0, pose.heading)
+        self.assertAlmostEqual(10, pose.linear_speed)
+
+    def test_sides_paired(self):
+        odo = self._odometry()
+        for step in range(1, 11):
+            odo.update("A", step * 10, step / 10.0)
+            self.assertAlmostEqual(-0.1, odo.pose.heading)  # right side is taken as still until it reports
+            odo.update("B", -step * 10, step / 10.0)
+            self.assertAlmostEqual(0, odo.pose.heading)
+            self.assertAlmostEqual(0, odo.pose.y)
+        self.assertAlmostEqual(100, odo.pose.x)
+
+    def test_one_side_moves(self):
+        odo = self._odometry()
+        quarter = 200 * math.pi / 4  # left wheel travel for 90 degrees turn around right one
+        for step in range(1, 11):
+            odo.update("A", quarter * step / 10, step / 10.0)
+        self.assertAlmostEqual(-math.pi / 2, odo.pose.heading)
+        self.assertAlmostEqual(50, odo.pose.x, delta=0.1)
+        self.assertAlmostEqual(-50, odo.pose.y, delta=0.1)
+
+    def test_detach(self):
+        hub = MoveHub(HubEmulator())
+        odo = Odometry(wheel_diameter=360 / math.pi, track_width=100)
+        odo.attach(hub.motor_A, Odometry.LEFT)
+        odo.attach(hub.motor_B, Odometry.RIGHT, direction=-1)
+        self.assertTrue(hub.motor_A._subscribers)
+        odo.detach()
+        self.assertFalse(hub.motor_A._subscribers)
+        self.assertFalse(hub.motor_B._subscribers)
+        self.assertEqual({Odometry.LEFT: 0, Odometry.RIGHT: 0}, odo._side_count)
+
+    def test_turn_in_place(self):
+        odo = self._odometry()
+        quarter = 100 * math.pi / 4  # wheel travel for 90 degrees turn
+        odo.update_many({"A": -quarter, "B": -quarter}, 1.0)
+        pose = odo.pose
+        self.assertAlmostEqual(0, pose.x)
+        self.assertAlmostEqual(math.pi / 2, pose.heading)
+        self.assertAlmostEqual(math.pi / 2, pose.angular_speed)
+
+    def test_wraparound(self):
+        odo = Odometry(wheel_diameter=360 / math.pi, track_width=100)
+        odo.add_motor("A", Odometry.LEFT)
+        odo.add_motor("B", Odometry.RIGHT)
+        odo.update_many({"A": 2 ** 31 - 5, "B": 2 ** 31 - 5}, 0.0)
+        odo.update_many({"A": -2 ** 31 + 5, "B": -2 ** 31 + 5}, 1.0)
+        self.assertAlmostEqual(10, odo.pose.x)
+
+    def test_reset(self):
+        odo = self._odometry()
+        odo.reset(1, 2, 0.5)
+        self.assertEqual((1, 2, 0.5), odo.pose[:3])
@@ -0,0 +1,35 @@
+import unittest
+
+from pylgbst import packets
+from pylgbst.comms.cemulator import HubEmulator
+from pylgbst.hub import MoveHub
+from pylgbst.messages import MsgPortOutput, MsgPortOutputFeedback
+
+
+class PacketTraceTest(unittest.TestCase):
+    def tearDown(self):
+        packets.disable()
+
+    def test_trace(self):
+        records = []
+        hub = MoveHub(HubEmulator())
+        hub.motor_A.angled(10)
+
+        packets.enable(records.append)
+        self.assertTrue(packets.enabled)
+        hub.motor_A.angled(10)
+        packets.disable(records.append)
+        self.assertFalse(packets.enabled)
+        hub.motor_A.angled(10)
+
+        self.assertEqual([packets.OUT, packets.IN, packets.IN], [record.direction for record in records])
+        self.assertIsInstance(records[0].msg, MsgPortOutput)
+        self.assertIsInstance(records[-1].msg, MsgPortOutputFeedback)
+        self.assertEqual("050082000a", records[-1].hex)
+        self.assertTrue(str(records[-1]).startswith("hub in  0x0e 050082000a MsgPortOutputFeedback("))
+
+    def test_log_sink(self):
+        packets.enable()
+        with self.assertLogs("packets", "DEBUG") as logs:
+            packets.trace(packets.IN, "hub", 0x0e, b"\x05\x00\x82\x00\x0a")
+        self.assertEqual(["DEBUG:packets:hub in  0x0e 050082000a"], logs.output)
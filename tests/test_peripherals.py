@@ -55,6 +55,28 @@ class PeripheralsTest(unittest.TestCase):
         self.assertEqual(b"0a004132010100000000", hub.writes.pop(1)[1])
         self.assertEqual(b"0a008132115101204060", hub.writes.pop(1)[1])
 
+    def test_led_shadow_state(self):
+        hub = HubMock()
+        hub.led = LEDRGB(hub, MoveHub.PORT_LED)
+        hub.peripherals[MoveHub.PORT_LED] = hub.led
+
+        hub.connection.notification_delayed("0a004732000100000000", 0.1)
+        hub.connection.notification_delayed("050082320a", 0.2)
+        hub.led.set_color(COLOR_RED)
+        self.assertEqual(3, len(hub.writes))
+
+        hub.led.set_color(COLOR_RED)  # already confirmed, nothing sent
+        self.assertEqual(3, len(hub.writes))
+
+        hub.connection.notification_delayed("050082320a", 0.1)
+        hub.led.set_color(COLOR_RED, force=True)
+        self.assertEqual(b"0800813211510009", hub.writes.pop(3)[1])
+
+        hub.connection.notification_delayed("050082320a", 0.1)
+        hub.resync_outputs()
+        self.assertEqual(b"0800813211510009", hub.writes.pop(3)[1])
+        hub.connection.wait_notifications_handled()
+
     def test_current(self):
         hub = HubMock()
         time.sleep(0.1)
@@ -195,6 +217,68 @@ class PeripheralsTest(unittest.TestCase):
 
         hub.connection.wait_notifications_handled()
 
+    def test_motor_profiles(self):
+        hub = HubMock()
+        motor = EncodedMotor(hub, MoveHub.PORT_D)
+        hub.peripherals[MoveHub.PORT_D] = motor
+
+        hub.connection.notification_delayed('050082030a', 0.1)
+        hub.connection.notification_delayed('050082030a', 0.2)
+        hub.connection.notification_delayed('050082030a', 0.3)
+        motor.timed(1.0, acc_time=1.0, dec_time=0.5)
+        self.assertEqual(b"090081031105e80300", hub.writes.pop(1)[1])
+        self.assertEqual(b"090081031106f40100", hub.writes.pop(1)[1])
+        self.assertEqual(b"0c0081031109e80364647f03", hub.writes.pop(1)[1])
+
+        # profiles are already in place
+        hub.connection.notification_delayed('050082030a', 0.1)
+        motor.angled(180, acc_time=1.0, dec_time=0.5, use_profile=0)
+        self.assertEqual(b"0e008103110bb400000064647f03", hub.writes.pop(1)[1])
+
+        # single slot gets overwritten
+        hub.connection.notification_delayed('050082030a', 0.1)
+        hub.connection.notification_delayed('050082030a', 0.2)
+        motor.start_speed(1.0, acc_time=2.0, use_profile=0)
+        self.assertEqual(b"090081031105d00700", hub.writes.pop(1)[1])
+        self.assertEqual(b"090081031107646401", hub.writes.pop(1)[1])
+
+        hub.connection.wait_notifications_handled()
+        self.assertEqual(1, len(hub.writes))
+
+    def test_motor_coalescing(self):
+        hub = HubMock()
+        motor = EncodedMotor(hub, MoveHub.PORT_D)
+        hub.peripherals[MoveHub.PORT_D] = motor
+        motor.set_coalescing()
+
+        motor.start_power(0.25)
+        time.sleep(0.1)  # first command is in flight, waiting for feedback
+        motor.start_power(0.5)
+        motor.start_power(0.75)
+
+        hub.connection.notification_delayed('050082030a', 0.0)
+        hub.connection.notification_delayed('050082030a', 0.2)
+        time.sleep(0.3)
+        hub.connection.notification_delayed('050082030a', 0.1)
+        motor.stop()  # can't be coalesced, goes after pending ones
+        hub.connection.wait_notifications_handled()
+
+        self.assertEqual(b"07008103110119", hub.writes[1][1])
+        self.assertEqual(b"0700810311014b", hub.writes[2][1])
+        self.assertEqual(b"0c0081031109000064647f03", hub.writes[3][1])
+        self.assertEqual(4, len(hub.writes))
+        self.assertEqual(1, motor._output_channel.replaced)
+
+    def test_coalescing_off(self):
+        hub = HubMock()
+        motor = EncodedMotor(hub, MoveHub.PORT_D)
+        for _ in range(3):
+            motor.set_coalescing()
+            channel = motor._output_channel
+            motor.set_coalescing(False)
+            self.assertFalse(channel._thread.is_alive(), "Sender thread is stopped")
+        self.assertIsNone(motor._output_channel)
+
     def test_motor_sensor(self):
         hub = HubMock()
         motor = EncodedMotor(hub, MoveHub.PORT_C)
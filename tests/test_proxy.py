@@ -0,0 +1,109 @@
+import socket
+import time
+import unittest
+from threading import Thread
+
+from pylgbst.comms import proxy
+from pylgbst.comms.proxy import ProxyServer, ProxyConnection
+from pylgbst.comms.cemulator import HubEmulator
+from pylgbst.hub import Hub, MoveHub
+from pylgbst.messages import MsgHubProperties, MsgPortValueSingle
+from pylgbst.peripherals import EncodedMotor
+from tests import ConnectionMock
+
+
+class ProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.hub_conn = ConnectionMock().connect()
+        self.server = ProxyServer(port=0)
+        self.server.add_hub("LEGO Move Hub", self.hub_conn)
+        thr = Thread(target=self.server.start)
+        thr.daemon = True
+        thr.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.hub_conn.wait_notifications_handled()
+
+    def test_many_clients(self):
+        conn1 = ProxyConnection("LEGO Move Hub", port=self.server.port).connect()
+        hub = Hub(conn1)
+
+        values = []
+        conn2 = ProxyConnection(0, port=self.server.port, msg_types=[MsgPortValueSingle.TYPE]).connect()
+        conn2.set_notify_handler(lambda handle, data: values.append(data))
+        conn2.enable_notifications()
+        time.sleep(0.1)
+
+        self.hub_conn.notification_delayed('060001060600', 0.1)
+        resp = hub.send(MsgHubProperties(MsgHubProperties.VOLTAGE_PERC, MsgHubProperties.UPD_REQUEST))
+        self.assertIsInstance(resp, MsgHubProperties)
+        self.assertEqual(b"0500010605", self.hub_conn.writes[-1][1])
+
+        self.hub_conn.notification_delayed('0800450102000000', 0.0)
+        time.sleep(0.2)
+        self.assertEqual([bytes.fromhex('0800450102000000')], values, "Filtered client gets only port values")
+
+        conn1.disconnect()
+        conn2.disconnect()
+
+    def test_unknown_hub(self):
+        conn = ProxyConnection("No such hub", port=self.server.port)
+        with self.assertRaises(ConnectionError):
+            conn.connect()
+        conn._reader.join(1)
+        self.assertFalse(conn.is_alive(), "Socket is closed")
+
+    def test_hub_write_error(self):
+        conn = ProxyConnection(0, port=self.server.port).connect()
+        hub = Hub(conn)
+        request = MsgHubProperties(MsgHubProperties.VOLTAGE_PERC, MsgHubProperties.UPD_REQUEST)
+
+        def _fail(handle, data):
+            raise ConnectionError("Hub is gone")
+
+        write, self.hub_conn.write = self.hub_conn.write, _fail
+        with self.assertRaises(ConnectionError) as ctx:
+            hub.send(request, timeout=5)
+        self.assertIn("Hub is gone", str(ctx.exception))
+
+        self.hub_conn.write = write
+        self.hub_conn.notification_delayed('060001060600', 0.1)
+        self.assertIsInstance(hub.send(request, timeout=5), MsgHubProperties, "Client stays usable")
+        conn.disconnect()
+
+    def test_slow_client(self):
+        server_side, client_side = socket.socketpair()
+        client = proxy._ProxyClient(self.server, server_side, ("test", 0))
+        for _ in range(proxy.CLIENT_QUEUE_SIZE):
+            client.send(b"frame")
+        client.send(b"frame")
+        self.assertTrue(client._closed, "Client that can't keep up is disconnected, not silently starved")
+        client_side.close()
+
+    def test_handshake_timeout(self):
+        silent = socket.socket()
+        silent.bind(("localhost", 0))
+        silent.listen(1)
+        timeout, proxy.HANDSHAKE_TIMEOUT = proxy.HANDSHAKE_TIMEOUT, 0.1
+        try:
+            with self.assertRaises(ConnectionError):
+                ProxyConnection("LEGO Move Hub", port=silent.getsockname()[1]).connect()
+        finally:
+            proxy.HANDSHAKE_TIMEOUT = timeout
+            silent.close()
+
+    def test_late_subscriber(self):
+        server = ProxyServer(port=0)
+        server.add_hub("LEGO Move Hub", HubEmulator())
+        thr = Thread(target=server.start)
+        thr.daemon = True
+        thr.start()
+        try:
+            time.sleep(0.1)  # hub has announced its devices before anyone subscribed
+            hub = MoveHub(ProxyConnection("LEGO Move Hub", port=server.port).connect(), devices_timeout=2)
+            self.assertIsInstance(hub.motor_A, EncodedMotor)
+            self.assertIn(MoveHub.PORT_A, hub.peripherals)
+            hub.connection.disconnect()
+        finally:
+            server.disconnect()
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import time
+import unittest
+
+from pylgbst.comms import recorder
+from pylgbst.comms.cemulator import HubEmulator
+from pylgbst.comms.recorder import RecordingConnection, ReplayConnection, TraceReader, DIR_NOTIFY, DIR_WRITE
+from pylgbst.hub import MoveHub
+
+
+class RecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(prefix="pylgbst-trace-"), "session.trace")
+
+    def test_record_replay(self):
+        conn = RecordingConnection(HubEmulator(), self.path)
+        hub = MoveHub(conn)
+        hub.motor_A.angled(90)
+        conn.writer.flush()
+
+        reader = TraceReader(self.path)
+        records = list(reader.records())
+        notifications = [bytes(data) for _, direction, _, data in records if direction == DIR_NOTIFY]
+        self.assertIn(b"\x05\x00\x82\x00\x0a", notifications)
+        self.assertIn(DIR_WRITE, [direction for _, direction, _, _ in records])
+        self.assertGreater(reader.duration, 0)
+
+        got = []
+        replay = ReplayConnection(self.path, speed=None)
+        replay.set_notify_handler(lambda handle, data: got.append(data))
+        replay.enable_notifications()
+        self.assertTrue(replay.finished.wait(1))
+        self.assertEqual(notifications, got)
+        replay.disconnect()
+
+    def test_seek(self):
+        old_interval = recorder.INDEX_INTERVAL
+        recorder.INDEX_INTERVAL = 4
+        try:
+            writer = recorder.TraceWriter(self.path)
+            for num in range(20):
+                writer.append(DIR_NOTIFY, 0x0e, bytes([num]))
+                time.sleep(0.002)
+            writer.close()
+        finally:
+            recorder.INDEX_INTERVAL = old_interval
+
+        reader = TraceReader(self.path)
+        all_records = list(reader.records())
+        self.assertEqual(20, len(all_records))
+
+        middle = all_records[10][0]
+        tail = list(reader.records(middle))
+        self.assertEqual([bytes([num]) for num in range(10, 20)], [data for _, _, _, data in tail])
+
+        os.remove(self.path + ".idx")
+        self.assertEqual(10, len(list(TraceReader(self.path).records(middle))))
+
+    def test_disconnect_during_gap(self):
+        writer = recorder.TraceWriter(self.path)
+        writer.append(DIR_NOTIFY, 0x0e, b"\x00")
+        time.sleep(0.01)
+        writer.append(DIR_NOTIFY, 0x0e, b"\x01")
+        writer.close()
+
+        got = []
+        replay = ReplayConnection(self.path, speed=0.001)  # gap takes 10+ seconds
+        replay.set_notify_handler(lambda handle, data: got.append(data))
+        replay.enable_notifications()
+        time.sleep(0.1)
+        started = time.monotonic()
+        replay.disconnect()
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual([b"\x00"], got)
+
+        replay.speed = None
+        replay.seek(0)
+        self.assertTrue(replay.finished.wait(1))
+        self.assertEqual([b"\x00", b"\x00", b"\x01"], got)
+        replay.disconnect()
+
+    def test_empty_trace(self):
+        open(self.path, "wb").close()
+        replay = ReplayConnection(self.path, speed=None)
+        replay.enable_notifications()
+        self.assertTrue(replay.finished.wait(1))
+        self.assertEqual(0.0, TraceReader(self.path).duration)
+        replay.disconnect()
+
+        writer = recorder.TraceWriter(self.path)
+        self.assertEqual([], list(TraceReader(self.path).records()), "Header is there before first record")
+        writer.close()
+
+    def test_notification_after_disconnect(self):
+        conn = RecordingConnection(HubEmulator(), self.path)
+        handled = []
+        conn.set_notify_handler(lambda handle, data: handled.append(data))
+        conn.disconnect()
+
+        conn.connection._handler(0x0e, b"\x05\x00\x82\x00\x0a")
+        self.assertEqual([b"\x05\x00\x82\x00\x0a"], handled)
+        self.assertEqual([], list(TraceReader(self.path).records()))
@@ -0,0 +1,77 @@
+import sys
+import threading
+import time
+import unittest
+
+from pylgbst.comms.shared import SharedMemoryPublisher, SharedMemoryReader, SharedMemoryConnection
+from pylgbst.hub import Hub
+from tests import ConnectionMock
+
+
+class SharedMemoryTest(unittest.TestCase):
+    def setUp(self):
+        self.publisher = SharedMemoryPublisher(slot_count=8)
+
+    def tearDown(self):
+        self.publisher.close()
+
+    def test_fan_out(self):
+        consumer = SharedMemoryConnection(self.publisher.name, hub=1)
+        received = []
+        consumer.set_notify_handler(lambda handle, data: received.append((handle, data)))
+        consumer.enable_notifications()
+
+        conn = ConnectionMock().connect()
+        Hub(self.publisher.wrap(conn, hub=1))
+        conn.notifications.append("0f0004010126000000001000000010")
+        conn.wait_notifications_handled()
+
+        for _ in range(100):
+            if received:
+                break
+            time.sleep(0.01)
+        consumer.disconnect()
+        self.assertEqual([(Hub.HUB_HARDWARE_HANDLE, bytes.fromhex("0f0004010126000000001000000010"))], received)
+
+    def test_lapped_reader(self):
+        reader = SharedMemoryReader(self.publisher.name)
+        for x in range(20):
+            self.publisher.publish(0, 0x0e, bytes([x]), timestamp=x)
+
+        records = list(reader)
+        self.assertEqual(12, reader.lost)
+        self.assertEqual([bytes([x]) for x in range(12, 20)], [data for _, _, _, data in records])
+        self.assertEqual(19, records[-1][0])
+        self.assertIsNone(reader.read())
+
+        late = SharedMemoryReader(self.publisher.name, from_start=True)
+        self.assertEqual(8, len(list(late)))
+        reader.close()
+        late.close()
+
+    def test_two_writers(self):
+        publisher = SharedMemoryPublisher(slot_count=4096)
+        reader = SharedMemoryReader(publisher.name)
+
+        def _write(hub):
+            for x in range(2000):
+                publisher.publish(hub, 0x0e, x.to_bytes(2, "little"))
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            writers = [threading.Thread(target=_write, args=(hub,)) for hub in (0, 1)]
+            for writer in writers:
+                writer.start()
+            for writer in writers:
+                writer.join()
+        finally:
+            sys.setswitchinterval(interval)
+
+        records = list(reader)
+        reader.close()
+        publisher.close()
+        self.assertEqual(0, reader.lost)
+        for hub in (0, 1):
+            values = [int.from_bytes(data, "little") for _, rec_hub, _, data in records if rec_hub == hub]
+            self.assertEqual(list(range(2000)), values)
@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+import unittest
+
+from pylgbst.comms.cemulator import HubEmulator
+from pylgbst.hub import MoveHub
+from pylgbst.messages import MsgHubAlert
+from pylgbst.tracer import Span, tracer
+
+
+class TracerTest(unittest.TestCase):
+    def tearDown(self):
+        tracer.disable()
+        tracer.reset()
+
+    def test_stages(self):
+        hub = MoveHub(HubEmulator(latency=0.01))
+        self.assertEqual({}, tracer.summary())
+
+        tracer.enable()
+        hub.motor_A.angled(10)
+        hub.led.set_color((1, 2, 3))
+
+        summary = tracer.summary()
+        stages = summary["MsgPortOutput port 0x00"]
+        self.assertEqual({"encode", "submit", "hub", "decode", "match", "wakeup", "total"}, set(stages))
+        self.assertGreaterEqual(stages["hub"]["max"], 0.02)
+        self.assertIn("MsgPortOutput port 0x32", summary)
+
+        path = os.path.join(tempfile.mkdtemp(prefix="pylgbst-trace-"), "trace.json")
+        tracer.export_chrome(path)
+        with open(path) as fhd:
+            events = json.load(fhd)["traceEvents"]
+        self.assertIn("MsgPortOutput", set(event["cat"] for event in events))
+        self.assertEqual(len(tracer.spans), len([event for event in events if event["cat"] == "request"]))
+
+    def test_reply_before_submit(self):
+        span = Span(1, MsgHubAlert(MsgHubAlert.LOW_VOLTAGE))
+        start = span.stamps[0][1]
+        span.stamp("encode", start + 1)
+        span.stamp("submit", start + 3)
+        span.stamp("hub", start + 2)  # reply arrived while write call was still returning
+        span.stamp("decode", start + 4)
+        self.assertEqual([("encode", start, 1), ("submit", start + 1, 2), ("hub", start + 3, 0),
+                          ("decode", start + 3, 1)], span.stages())
+        self.assertEqual(4, span.total)